@@ -1,6 +1,7 @@
 try:
-    from flask import Flask, request, jsonify, make_response, session
+    from flask import Flask, request, jsonify, make_response, session, g
     from pymongo import MongoClient
+    from pymongo.errors import OperationFailure
     import requests
     import re
     from flask_cors import CORS
@@ -9,13 +10,53 @@ try:
     import json 
     import os
     from flask_session import Session
-    from flask import send_from_directory
+    from flask import send_from_directory, copy_current_request_context
+    from flask.json.provider import DefaultJSONProvider
     from dotenv import load_dotenv
+    import base64
+    import contextlib
+    import gzip
+    from collections import OrderedDict, deque
+    from datetime import datetime, timedelta, timezone
+    import bisect
+    import hashlib
+    import heapq
+    import math
+    import mmap
+    import queue
+    import sqlite3
+    import textwrap
+    import itertools
+    import operator
+    import threading
+    import time
+    from types import MappingProxyType
+    from collections.abc import Mapping
     print("✅ All imports successful")
 except ImportError as e:
     print(f"❌ Import error: {e}")
     raise
 
+try:
+    import orjson  # Optional: faster parsing of the local catalog file
+except ImportError:
+    orjson = None
+
+try:
+    import fcntl  # Optional: cross-process lock for the shared catalog file (not on Windows)
+except ImportError:
+    fcntl = None
+
+try:
+    import brotli  # Optional: brotli-compressed catalog responses
+except ImportError:
+    brotli = None
+
+try:
+    import numpy as np  # Optional: vectorized catalog filtering
+except ImportError:
+    np = None
+
 # Load environment variables
 load_dotenv()
 
@@ -27,6 +68,31 @@ except Exception as e:
     # Fallback to current directory if build folder doesn't exist
     app = Flask(__name__, static_folder='.', static_url_path='')
     print("✅ Flask app created with fallback static folder")
+
+class CatalogJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider that also serializes read-only mappings such as ProductView.
+    Compact output (what jsonify produces outside debug mode) is encoded with orjson when installed.
+    """
+    ORJSON_OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Mapping):
+            return dict(o.items())
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and kwargs in ({}, {"separators": (",", ":")}):
+            try:
+                return orjson.dumps(obj, default=self.default, option=self.ORJSON_OPTIONS).decode('utf-8')
+            except TypeError:
+                pass  # e.g. integers beyond 64 bits: let the stdlib encoder handle it
+        return super().dumps(obj, **kwargs)
+
+
+app.json = CatalogJSONProvider(app)
+
 #  Configure Flask Session for Vercel compatibility
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'YOUR_FLASK_SECRET_KEY_HERE')
 
@@ -47,7 +113,7 @@ ALLOWED_ORIGINS = os.getenv('ALLOWED_ORIGINS', '*').split(',')
 CORS(app, 
      resources={r"/*": {"origins": ALLOWED_ORIGINS}}, 
      supports_credentials=False if os.getenv('VERCEL') else True,
-     expose_headers=["Content-Type", "Authorization"],
+     expose_headers=["Content-Type", "Authorization", "X-Total-Count", "X-Next-Cursor"],
      allow_headers=["Content-Type", "Authorization", "X-Requested-With"],
      methods=["GET", "POST", "OPTIONS"]
 )
@@ -56,39 +122,207 @@ CORS(app,
 if not os.getenv('VERCEL'):
     Session(app)
 
-# MongoDB Connection - Simplified for Vercel
+def normalize_key(value):
+    """Lowercase lookup key stored next to display fields so queries can use equality/prefix index scans."""
+    return str(value or "").strip().lower()
+
+def normalized_key_expression(field_path):
+    """normalize_key() as an aggregation expression, so MongoDB derives the keys server-side."""
+    return {"$toLower": {"$trim": {"input": {"$toString": {"$ifNull": [field_path, ""]}}}}}
+
+def refresh_key_fields(target_collection, key_fields, scope=None):
+    """
+    Recompute normalized key fields ({"category_key": "$category", ...}) on every document where a
+    key is missing or no longer matches its source field, e.g. after a product was renamed.
+    """
+    stale = [{"$ne": [f"${key}", normalized_key_expression(source)]} for key, source in key_fields.items()]
+    return target_collection.update_many(
+        {**(scope or {}), "$expr": {"$or": stale}},
+        [{"$set": {key: normalized_key_expression(source) for key, source in key_fields.items()}}]
+    ).modified_count
+
+def refresh_catalog_keys(products_collection, scope=None):
+    """category_key and products.name_key of the embedded category documents. Returns documents updated."""
+    updated = refresh_key_fields(products_collection, {"category_key": "$category"}, scope)
+    stale_names = {"$anyElementTrue": [{"$map": {
+        "input": "$products",
+        "in": {"$ne": ["$$this.name_key", normalized_key_expression("$$this.name")]}
+    }}]}
+    updated += products_collection.update_many(
+        {**(scope or {}), "products": {"$type": "array"}, "$expr": stale_names},
+        [{"$set": {"products": {"$map": {
+            "input": "$products",
+            "in": {"$mergeObjects": ["$$this", {"name_key": normalized_key_expression("$$this.name")}]}
+        }}}}]
+    ).modified_count
+    return updated
+
+def ensure_catalog_indexes(products_collection):
+    """
+    Bring the normalized key fields of the category documents up to date and create the
+    indexes behind category and product-name lookups. Safe to run on every startup.
+    """
+    # Aggregation-pipeline updates (MongoDB 4.2+) derive the keys server-side
+    refresh_catalog_keys(products_collection)
+    products_collection.create_index("category_key")
+    products_collection.create_index("products.name_key")
+    print("✅ Catalog indexes ready (category_key, products.name_key)")
+
+def category_key_query(category):
+    """Equality match on the normalized category, accepting the plural form ("laptop" / "laptops")."""
+    category_key = normalize_key(category)
+    return {"category_key": {"$in": [category_key, f"{category_key}s"]}}
+
+def product_name_prefix_query(product_name):
+    """Anchored, escaped, case-sensitive prefix on the lowercase key, so MongoDB can bound the index scan."""
+    return {"products.name_key": product_name_prefix_condition(product_name)}
+
+def product_name_prefix_condition(product_name):
+    return {"$regex": f"^{re.escape(normalize_key(product_name))}"}
+
+# MongoDB Connection - lazy, so importing the app (Vercel cold starts, index.py) never waits on the network.
+# The first catalog read connects; if that fails a background loop keeps retrying with backoff
+# and flips MONGODB_CONNECTED back on once Atlas is reachable again.
 MONGODB_URI = os.getenv('MONGODB_URI')
-try:
-    if MONGODB_URI:
-        print("🔄 Connecting to MongoDB...")
-        client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-        # Test the connection
-        client.admin.command('ping')
-        db = client["ecommerce_db"]
-        collection = db["products"]
-        MONGODB_CONNECTED = True
-        print("✅ Successfully connected to MongoDB Atlas")
-    else:
-        raise Exception("MONGODB_URI environment variable not found")
-        
-except Exception as e:
-    print(f"❌ Failed to connect to MongoDB Atlas: {str(e)}")
-    print("🔄 Will use local JSON fallback for product data")
-    client = None
-    db = None
-    collection = None
-    MONGODB_CONNECTED = False 
+MONGODB_TIMEOUT_MS = int(os.getenv('MONGODB_TIMEOUT_MS', '5000'))
+MONGODB_RECONNECT_MAX_DELAY = float(os.getenv('MONGODB_RECONNECT_MAX_DELAY', '300'))
 
+client = None
+db = None
+collection = None
+MONGODB_CONNECTED = False
 
-# Google Gemini API Setup
-api_key = os.getenv('GEMINI_API_KEY')
-endpoint = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent?key={api_key}"
+_mongodb_lock = threading.Lock()
+_mongodb_attempted = False
+_mongodb_connect_lock = threading.Lock()  # One connection attempt, and so one MongoClient, at a time
+_mongodb_pending_client = None  # Created but not yet answering; retries reuse it
+_mongodb_reconnect_thread = None
+_mongodb_reconnect_lock = threading.Lock()
+_catalog_index_thread = None
+
+def connect_to_mongodb():
+    """
+    Single connection attempt; publishes client/db/collection only once the ping succeeds.
+    Index preparation runs in the background, so the caller only waits for the ping.
+    """
+    global client, db, collection, MONGODB_CONNECTED, _mongodb_pending_client
+
+    if not MONGODB_URI:
+        print("❌ Failed to connect to MongoDB Atlas: MONGODB_URI environment variable not found")
+        print("🔄 Will use local JSON fallback for product data")
+        return False
+
+    with _mongodb_connect_lock:
+        if MONGODB_CONNECTED:
+            return True  # Another thread connected while we waited
+        try:
+            print("🔄 Connecting to MongoDB...")
+            if client is None and _mongodb_pending_client is None:
+                # MongoClient connects in the background and recovers on its own, so one is enough
+                _mongodb_pending_client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=MONGODB_TIMEOUT_MS)
+            new_client = client or _mongodb_pending_client
+            # Test the connection
+            new_client.admin.command('ping')
+            new_db = new_client["ecommerce_db"]
+            client, db, collection = new_client, new_db, new_db["products"]
+            _mongodb_pending_client = None
+            MONGODB_CONNECTED = True
+            print("✅ Successfully connected to MongoDB Atlas")
+        except Exception as e:
+            print(f"❌ Failed to connect to MongoDB Atlas: {str(e)}")
+            print("🔄 Will use local JSON fallback for product data")
+            return False
+    start_catalog_index_preparation(new_db)
+    return True
+
+def start_catalog_index_preparation(database):
+    global _catalog_index_thread
+    with _mongodb_connect_lock:
+        if _catalog_index_thread is not None and _catalog_index_thread.is_alive():
+            return
+        _catalog_index_thread = threading.Thread(target=prepare_catalog_indexes, args=(database,),
+                                                 name="catalog-indexes", daemon=True)
+        _catalog_index_thread.start()
+
+def prepare_catalog_indexes(database):
+    """Key backfill and index builds; queries work (just slower) until they are done."""
+    try:
+        ensure_catalog_indexes(database["products"])
+        # Products renamed outside migrate/ingest keep stale keys until refreshed
+        refresh_key_fields(database[PRODUCT_ITEMS_COLLECTION], PRODUCT_ITEM_KEY_FIELDS)
+        ensure_product_item_indexes(database[PRODUCT_ITEMS_COLLECTION])
+    except Exception as index_error:
+        print(f"⚠️ Could not prepare catalog indexes: {str(index_error)}")
+
+def ensure_mongodb():
+    """Connect on first use. Later calls never block: they report the current state."""
+    global _mongodb_attempted
+
+    if MONGODB_CONNECTED or _mongodb_attempted:
+        return MONGODB_CONNECTED
+    with _mongodb_lock:
+        if not _mongodb_attempted:
+            if not connect_to_mongodb():
+                start_mongodb_reconnect_loop()
+            _mongodb_attempted = True
+    return MONGODB_CONNECTED
+
+def get_mongo_collection():
+    """The products collection, or None while MongoDB is unavailable."""
+    return collection if ensure_mongodb() else None
+
+def mark_mongodb_unavailable(error):
+    """Called when a query fails: fall back to local data and let the reconnect loop take over."""
+    global MONGODB_CONNECTED
+    if MONGODB_CONNECTED:
+        print(f"⚠️ MongoDB marked unavailable: {str(error)}")
+        MONGODB_CONNECTED = False
+    start_mongodb_reconnect_loop()
+
+def start_mongodb_reconnect_loop():
+    global _mongodb_reconnect_thread
+    if not MONGODB_URI:
+        return
+    with _mongodb_reconnect_lock:
+        if _mongodb_reconnect_thread is not None and _mongodb_reconnect_thread.is_alive():
+            return
+        _mongodb_reconnect_thread = threading.Thread(target=mongodb_reconnect_loop, name="mongodb-reconnect", daemon=True)
+        _mongodb_reconnect_thread.start()
 
+def mongodb_reconnect_loop():
+    """Retry with exponential backoff until MongoDB answers, then drop the fallback catalog snapshot."""
+    delay = 1.0
+    while not MONGODB_CONNECTED:
+        time.sleep(delay)
+        if connect_to_mongodb():
+            invalidate_catalog_cache()
+            break
+        delay = min(delay * 2, MONGODB_RECONNECT_MAX_DELAY)
+
+
+# Google Gemini API Setup - configuration only; the HTTP session is created on the first call
+api_key = os.getenv('GEMINI_API_KEY')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash-exp')
+GEMINI_API_BASE = os.getenv('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com/v1beta')
 
 headers = {
     "Content-Type": "application/json"
 }
 
+_gemini_session = None
+
+def gemini_url(method="generateContent"):
+    return f"{GEMINI_API_BASE}/models/{GEMINI_MODEL}:{method}?key={api_key}"
+
+def get_gemini_session():
+    """Shared requests session so Gemini calls reuse pooled TLS connections."""
+    global _gemini_session
+    if _gemini_session is None:
+        session = requests.Session()
+        session.headers.update(headers)
+        _gemini_session = session
+    return _gemini_session
+
 def validate_request(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -97,6 +331,190 @@ def validate_request(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Cache-Control sent with catalog responses, overridable per endpoint through the environment
+CATALOG_CACHE_CONTROL = {
+    "products": os.getenv('CACHE_CONTROL_PRODUCTS', 'public, max-age=60, stale-while-revalidate=300'),
+    "product": os.getenv('CACHE_CONTROL_PRODUCT', 'public, max-age=300, stale-while-revalidate=3600'),
+    "search_suggestions": os.getenv('CACHE_CONTROL_SEARCH_SUGGESTIONS', 'public, max-age=60, stale-while-revalidate=600'),
+    "facets": os.getenv('CACHE_CONTROL_FACETS', 'public, max-age=60, stale-while-revalidate=300'),
+}
+
+def compute_catalog_etag(policy, snapshot):
+    """
+    Strong ETag for a catalog response: catalog content + endpoint + normalized query.
+    The host is included because image URLs in the body are rewritten per host.
+    """
+    query = sorted(request.args.items(multi=True))
+    key = json.dumps([snapshot.digest, policy, request.path, query, request.host_url])
+    return '"' + hashlib.sha1(key.encode('utf-8')).hexdigest() + '"'
+
+def encoded_etag(etag, encoding):
+    """Compressed bodies are different representations, so they get their own ETag ("...-gzip")."""
+    return etag if encoding is None else f'{etag[:-1]}-{encoding}"'
+
+def etag_matches(etag, if_none_match):
+    """If-None-Match uses weak comparison, so W/ prefixes are ignored. Any encoding of etag matches."""
+    accepted = {etag, *(encoded_etag(etag, encoding) for encoding in RESPONSE_ENCODINGS)}
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return any(tag == '*' or tag.removeprefix('W/') in accepted for tag in candidates)
+
+# Catalog response bodies, serialized (and compressed) once per catalog version, host and query.
+# Bounded by entries and by bytes (bodies plus their compressed copies); bodies larger than
+# CATALOG_RESPONSE_CACHE_MAX_BODY are served uncached so one big listing can't flush the rest.
+CATALOG_RESPONSE_CACHE_SIZE = int(os.getenv('CATALOG_RESPONSE_CACHE_SIZE', '256'))
+CATALOG_RESPONSE_CACHE_BYTES = int(os.getenv('CATALOG_RESPONSE_CACHE_BYTES', str(32 * 1024 * 1024)))
+CATALOG_RESPONSE_CACHE_MAX_BODY = int(os.getenv('CATALOG_RESPONSE_CACHE_MAX_BODY', str(1024 * 1024)))
+RESPONSE_COMPRESS_MIN_BYTES = 1024
+RESPONSE_ENCODINGS = {
+    "br": (lambda body: brotli.compress(body, quality=9)) if brotli is not None else None,
+    "gzip": lambda body: gzip.compress(body, compresslevel=9, mtime=0),
+}  # In order of preference
+_catalog_responses = OrderedDict()
+_catalog_responses_bytes = 0
+_catalog_responses_lock = threading.Lock()
+
+def cached_response_size(entry):
+    """Bytes held by a cache entry: the body and every compressed copy of it."""
+    return sum(len(value) for name, value in entry.items() if name != "headers")
+
+def trim_catalog_responses():
+    """Evict least recently used entries until both limits hold. Call with the lock held."""
+    global _catalog_responses_bytes
+    while _catalog_responses and (len(_catalog_responses) > CATALOG_RESPONSE_CACHE_SIZE
+                                  or _catalog_responses_bytes > CATALOG_RESPONSE_CACHE_BYTES):
+        _, evicted = _catalog_responses.popitem(last=False)
+        _catalog_responses_bytes -= cached_response_size(evicted)
+
+def cached_catalog_response(etag):
+    """Cached {"body", "headers", <encoding>: compressed body} for a catalog ETag, or None."""
+    with _catalog_responses_lock:
+        entry = _catalog_responses.get(etag)
+        if entry is not None:
+            _catalog_responses.move_to_end(etag)
+        return entry
+
+def cache_catalog_response(etag, response):
+    """Keep the serialized body of a successful catalog response for the next identical request."""
+    global _catalog_responses_bytes
+    if CATALOG_RESPONSE_CACHE_SIZE <= 0 or CATALOG_RESPONSE_CACHE_BYTES <= 0 or response.direct_passthrough:
+        return None
+    body = response.get_data()
+    if len(body) > CATALOG_RESPONSE_CACHE_MAX_BODY:
+        return None
+    entry = {
+        "body": body,
+        "headers": [(name, value) for name, value in response.headers if name != 'Content-Length'],
+    }
+    with _catalog_responses_lock:
+        previous = _catalog_responses.pop(etag, None)
+        if previous is not None:
+            _catalog_responses_bytes -= cached_response_size(previous)
+        _catalog_responses[etag] = entry
+        _catalog_responses_bytes += len(body)
+        trim_catalog_responses()
+    return entry
+
+def add_compressed_body(etag, entry, encoding):
+    """Compress a cached body once; later requests for the same encoding share the bytes."""
+    global _catalog_responses_bytes
+    compressed = RESPONSE_ENCODINGS[encoding](entry["body"])
+    with _catalog_responses_lock:
+        if encoding not in entry:
+            entry[encoding] = compressed
+            if _catalog_responses.get(etag) is entry:  # Not evicted meanwhile: it counts against the budget
+                _catalog_responses_bytes += len(compressed)
+                trim_catalog_responses()
+    return entry[encoding]
+
+def negotiate_encoding(entry):
+    """Best content coding the client accepts for a cached body (None: send it uncompressed)."""
+    if entry is None or len(entry["body"]) < RESPONSE_COMPRESS_MIN_BYTES:
+        return None
+    for name, compress in RESPONSE_ENCODINGS.items():
+        if compress is not None and request.accept_encodings[name]:
+            return name
+    return None
+
+def catalog_response_from_cache(entry, etag):
+    """Response straight from cached bytes, compressed with the best encoding the client accepts."""
+    body, encoding = entry["body"], negotiate_encoding(entry)
+    if encoding is not None:
+        body = entry[encoding] if encoding in entry else add_compressed_body(etag, entry, encoding)
+
+    response = app.response_class(body, status=200)
+    response.headers.clear()
+    response.headers.extend(entry["headers"])
+    response.headers['Content-Length'] = str(len(body))
+    if len(entry["body"]) >= RESPONSE_COMPRESS_MIN_BYTES:
+        response.vary.add('Accept-Encoding')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['ETag'] = encoded_etag(etag, encoding)
+    return response
+
+def not_modified_response(etag, cache_control):
+    response = make_response('', 304)
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def body_etag_response(response, cache_control):
+    """
+    Without a snapshot (CATALOG_CACHE_TTL=0) the ETag is a hash of the body: the view still
+    runs, but an unchanged response goes back to the client as a 304 without its body.
+    """
+    if response.status_code != 200 or 'X-Error' in response.headers or response.direct_passthrough:
+        return response
+    etag = '"' + hashlib.sha1(response.get_data()).hexdigest() + '"'
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and etag_matches(etag, if_none_match):
+        return not_modified_response(etag, cache_control)
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def catalog_cache_headers(policy):
+    """
+    Adds ETag and Cache-Control headers to a catalog endpoint and answers
+    If-None-Match with 304 before the view builds (and serializes) its body.
+    Successful bodies are cached by ETag, so repeat requests are served from bytes.
+    With CATALOG_CACHE_TTL=0 there is no snapshot to take the ETag from: see body_etag_response().
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            cache_control = CATALOG_CACHE_CONTROL[policy]
+            if CATALOG_CACHE_TTL <= 0:
+                return body_etag_response(make_response(f(*args, **kwargs)), cache_control)
+
+            # One snapshot per request: the ETag and the body must describe the same catalog
+            snapshot = g.catalog_snapshot = get_catalog_snapshot()
+            etag = compute_catalog_etag(policy, snapshot)
+
+            entry = cached_catalog_response(etag)
+            if_none_match = request.headers.get('If-None-Match')
+            if if_none_match and etag_matches(etag, if_none_match):
+                return not_modified_response(encoded_etag(etag, negotiate_encoding(entry)), cache_control)
+
+            if entry is None:
+                response = make_response(f(*args, **kwargs))
+                # Never cache error fallbacks (e.g. the empty list served with X-Error)
+                if response.status_code != 200 or 'X-Error' in response.headers:
+                    return response
+                response.headers['Cache-Control'] = cache_control
+                entry = cache_catalog_response(etag, response)
+                if entry is None:
+                    response.headers['ETag'] = etag
+                    return response
+            return catalog_response_from_cache(entry, etag)
+        return decorated_function
+    return decorator
+
+def request_catalog_snapshot():
+    """The snapshot this request's ETag was computed from (a fresh one outside catalog_cache_headers)."""
+    snapshot = g.get('catalog_snapshot')
+    return snapshot if snapshot is not None else get_catalog_snapshot()
+
 @app.errorhandler(500)
 def handle_server_error(error):
     return jsonify({
@@ -212,7 +630,7 @@ def test_detailed():
         return jsonify({
             "message": "Flask API is working!",
             "environment": "vercel" if os.getenv('VERCEL') else "local",
-            "mongodb_connected": MONGODB_CONNECTED,
+            "mongodb_connected": ensure_mongodb(),
             "python_version": "3.9",
             "available_endpoints": [
                 "/test", "/health", "/api/products", "/api/product/<id>", 
@@ -232,12 +650,13 @@ def health_check():
     Comprehensive health check for the Flask application - v1.0.1
     """
     try:
+        ensure_mongodb()
         health_status = {
             "status": "healthy",
             "timestamp": json.dumps({"timestamp": "now"}, default=str),
             "services": {
                 "flask": "running",
-                "mongodb": "connected" if MONGODB_CONNECTED else "disconnected",
+                "mongodb": "connected" if MONGODB_CONNECTED else ("reconnecting" if _mongodb_reconnect_thread is not None and _mongodb_reconnect_thread.is_alive() else "disconnected"),
                 "local_fallback": "available",
                 "gemini_api": "configured" if api_key else "not_configured"
             },
@@ -249,14 +668,20 @@ def health_check():
         
         # Test data fetching
         try:
-            products = fetch_products_from_database()
-            product_counts = {cat: len(prods) for cat, prods in products.items()}
+            snapshot = get_catalog_snapshot()
+            product_counts = {cat: len(prods) for cat, prods in snapshot.products.items()}
             health_status["product_data"] = {
                 "available": True,
-                "categories": list(products.keys()),
+                "categories": list(snapshot.products.keys()),
                 "total_products": sum(product_counts.values()),
                 "breakdown": product_counts
             }
+            health_status["catalog_cache"] = {
+                "version": snapshot.version,
+                "digest": snapshot.digest,
+                "age_seconds": round(time.time() - snapshot.loaded_at, 1),
+                "ttl_seconds": CATALOG_CACHE_TTL
+            }
         except Exception as e:
             health_status["product_data"] = {
                 "available": False,
@@ -264,6 +689,9 @@ def health_check():
             }
             health_status["status"] = "degraded"
         
+        health_status["gemini_cache"] = gemini_response_cache.summary()
+        health_status["gemini_semantic_cache"] = semantic_response_cache.summary()
+        
         # Determine overall status
         if not MONGODB_CONNECTED:
             health_status["status"] = "degraded"
@@ -330,6 +758,7 @@ def chat_options():
 
 
 @app.route('/api/search-suggestions', methods=['GET'])
+@catalog_cache_headers('search_suggestions')
 def search_suggestions():
     """Return product name suggestions based on a search query"""
     try:
@@ -337,34 +766,11 @@ def search_suggestions():
         if not query or len(query) < 2:
             return jsonify([])
             
-        # Fetch products from database
-        structured_products = fetch_products_from_database()
+        # Look the query up in the per-catalog-version suggestion index
+        snapshot = request_catalog_snapshot()
+        index = snapshot.derived("suggestions", build_suggestion_index)
         
-        # Extract all product names from all categories
-        all_products = []
-        for category, products in structured_products.items():
-            for product in products:
-                product['category'] = category  # Add category to each product
-            all_products.extend(products)
-            
-        # Find matching products (by name or brand)
-        matches = []
-        for product in all_products:
-            product_name = product.get('name', '').lower()
-            product_brand = product.get('brand', '').lower()
-            
-            if query in product_name or query in product_brand:
-                matches.append({
-                    'name': product.get('name', ''),
-                    'category': product.get('category', ''),
-                    'image': product.get('image', '')
-                })
-                
-        # Sort by relevance (exact matches first)
-        matches.sort(key=lambda x: 0 if x['name'].lower().startswith(query) else 1)
-                
-        # Limit results
-        return jsonify(matches[:10])
+        return jsonify(index.lookup(query, limit=10))
         
     except Exception as e:
         print(f"❌ Error in search suggestions: {str(e)}")
@@ -375,12 +781,12 @@ def get_products_by_category(category):
     """
     Fetch all products belonging to a specific category from the database.
     """
-    # Search for the category in the database
-    category_data = collection.find_one(
-    {"category": {"$regex": f"^{re.escape(category)}s?$", "$options": "i"}},
-    {"products": 1, "_id": 0}
-)
+    products_collection = get_mongo_collection()
+    if products_collection is None:
+        return jsonify({"reply": f"No {category}s found in the database."}), 200
 
+    # Search for the category in the database (indexed equality on the normalized key)
+    category_data = products_collection.find_one(category_key_query(category), {"products": 1, "_id": 0})
 
     if not category_data:
         return jsonify({"reply": f"No {category}s found in the database."}), 200
@@ -400,8 +806,17 @@ def get_product_image(product_name):
         # Normalize product name
         product_name = product_name.lower()
         
-        # First, try to match from database
-        product = db.products.find_one({"name": {"$regex": product_name, "$options": "i"}})
+        # First, try to match from database (indexed prefix match on the embedded product name key)
+        product = None
+        products_collection = get_mongo_collection()
+        if products_collection is not None:
+            category_doc = products_collection.find_one(
+                product_name_prefix_query(product_name),
+                {"products": {"$elemMatch": {"name_key": product_name_prefix_condition(product_name)}},
+                 "category": 1, "_id": 0}
+            )
+            if category_doc and category_doc.get("products"):
+                product = dict(category_doc["products"][0], category=category_doc.get("category", ""))
         if product and "image" in product and product["image"]:
             # Instead of redirect, return a JSON with the image URL
             image_url = product["image"]
@@ -725,8 +1140,7 @@ def chat():
                     "category_switched": True  # Flag to indicate this is a category switch
                 }
                 
-                # Get products for the new category
-                structured_products = fetch_products_from_database()
+                # Get products for the new category (reuse the catalog fetched for this turn)
                 new_conversational_query["all_products"] = structured_products.get(new_category, [])
                 
                 # Send to Gemini with the new category context
@@ -792,95 +1206,242 @@ def chat():
         traceback.print_exc()
         return jsonify({"error": "An internal server error occurred while processing your request."}), 500
 
+# -------------------- **Streaming Chat** --------------------
+# Seconds between SSE keep-alive comments while the chat turn is still being worked on
+CHAT_STREAM_KEEPALIVE = 15
+
+
+class StreamingMessageExtractor:
+    """
+    Pulls the "message" string out of Gemini's JSON reply while it is still being generated:
+    feed() takes each raw chunk and returns the newly decoded message text (possibly "").
+    """
+    ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = None  # Next undecoded character of the message value
+        self.done = False
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        if self.done:
+            return ""
+        if self.position is None:
+            match = re.search(r'"message"\s*:\s*"', self.buffer)
+            if not match:
+                return ""
+            self.position = match.end()
+
+        text = []
+        buffer, i = self.buffer, self.position
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self.done = True
+                break
+            if char != '\\':
+                text.append(char)
+                i += 1
+                continue
+            # Escape sequence: wait for the next chunk if it is cut off
+            if i + 1 >= len(buffer):
+                break
+            if buffer[i + 1] != 'u':
+                text.append(self.ESCAPES.get(buffer[i + 1], buffer[i + 1]))
+                i += 2
+                continue
+            if i + 6 > len(buffer):
+                break
+            code = int(buffer[i + 2:i + 6], 16)
+            if 0xD800 <= code < 0xDC00:
+                # Surrogate pair (emoji): needs the second half as well
+                if i + 12 > len(buffer):
+                    break
+                code = 0x10000 + ((code - 0xD800) << 10) + (int(buffer[i + 8:i + 12], 16) - 0xDC00)
+                i += 6
+            text.append(chr(code))
+            i += 6
+        self.position = i
+        return "".join(text)
+
+
+class StreamingReplyPreview:
+    """
+    One Gemini call's reply as it is generated, post-processed like the final reply
+    (convert_markdown_to_html): feed() takes each raw chunk and returns the newly added HTML.
+    Text from an unpaired "*" on is held back until the markdown around it is complete.
+    """
+
+    def __init__(self):
+        self.extractor = StreamingMessageExtractor()
+        self.message = ""
+        self.shown = ""
+
+    def feed(self, chunk):
+        self.message += self.extractor.feed(chunk)
+        html = convert_markdown_to_html(self.message)
+        if not self.extractor.done and '*' in html:
+            html = html[:html.index('*')]
+        if len(html) <= len(self.shown) or not html.startswith(self.shown):
+            return ""
+        delta, self.shown = html[len(self.shown):], html
+        return delta
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {app.json.dumps(data)}\n\n"
+
+
+@app.route('/chat/stream', methods=['POST'])
+@validate_request
+def chat_stream():
+    """
+    /chat over Server-Sent Events. "delta" events carry the reply HTML while Gemini generates it,
+    converted like the final reply; a turn that calls Gemini again starts over with a delta marked
+    "reset". Once the complete reply has been post-processed come "products" (when the turn
+    recommended new ones), "chat_state" and "done" with the same body /chat returns ("error" on
+    failure). The "done" reply is authoritative. A client that disconnects stops the Gemini stream.
+    """
+    request_data = request.get_json()
+    previous_products = (request_data.get("chat_state") or {}).get("recommended_products") or []
+    events = queue.Queue()
+    cancelled = threading.Event()
+    gemini_calls = itertools.count()
+
+    def open_reply_stream():
+        """on_text for one Gemini call, with a preview of its own."""
+        preview = StreamingReplyPreview()
+        reset = next(gemini_calls) > 0
+
+        def on_text(chunk):
+            nonlocal reset
+            delta = preview.feed(chunk)
+            if delta:
+                events.put(("delta", {"text": delta, "reset": True} if reset else {"text": delta}))
+                reset = False
+        return on_text
+
+    @copy_current_request_context
+    def run_chat():
+        _gemini_stream.open = open_reply_stream
+        _gemini_stream.cancelled = cancelled
+        try:
+            response = make_response(chat())
+            events.put(("result", (response.status_code, response.get_json(silent=True))))
+        except Exception as e:
+            print(f"❌ Error in /chat/stream: {str(e)}")
+            events.put(("result", (500, None)))
+        finally:
+            _gemini_stream.open = None
+            _gemini_stream.cancelled = None
+
+    threading.Thread(target=run_chat, daemon=True).start()
+
+    def generate():
+        try:
+            while True:
+                try:
+                    kind, payload = events.get(timeout=CHAT_STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if kind == "delta":
+                    yield sse_event("delta", payload)
+                    continue
+
+                status, body = payload
+                if status != 200 or not isinstance(body, dict):
+                    yield sse_event("error", body or {"error": "An internal server error occurred while processing your request."})
+                    return
+                chat_state = body.get("chat_state") or {}
+                products = chat_state.get("recommended_products") or []
+                if products and products != previous_products:
+                    yield sse_event("products", {"recommended_products": products})
+                yield sse_event("chat_state", {"chat_state": chat_state})
+                yield sse_event("done", body)
+                return
+        except GeneratorExit:
+            # The client went away: stop generating text nobody will read
+            print("🛑 /chat/stream client disconnected")
+            cancelled.set()
+            raise
+
+    return app.response_class(generate(), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route('/api/products', methods=['GET'])
+@catalog_cache_headers('products')
 def api_products():
+    """
+    List products, optionally filtered by category/brand/search.
+    Supports server-side paging (limit + cursor), sorting (sort=price_asc|price_desc|name)
+    and field projection (fields=name,price,...). Without limit the whole result is returned.
+    """
     try:
         # Get query parameters
-        category = request.args.get('category', 'all').lower()
-        brand = request.args.get('brand', '').lower()
-        search = request.args.get('search', '').strip()
+        try:
+            filters = parse_catalog_filters(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        category, brand, search = filters["category"], filters["brand"], filters["search"]
+        min_price, max_price, spec_filters = filters["min_price"], filters["max_price"], filters["spec_filters"]
+        sort_key = request.args.get('sort', '').strip().lower()
+        cursor = request.args.get('cursor', '').strip()
+        limit = request.args.get('limit', '').strip()
+        fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
         
-        # Fetch products from database with fallback
-        structured_products = fetch_products_from_database()
+        if sort_key and sort_key not in CATALOG_SORT_KEYS:
+            return jsonify({"error": f"Invalid sort '{sort_key}'", "allowed": list(CATALOG_SORT_KEYS)}), 400
+        if limit:
+            if not limit.isdigit() or int(limit) < 1:
+                return jsonify({"error": "limit must be a positive integer"}), 400
+            limit = min(int(limit), API_PRODUCTS_MAX_LIMIT)
         
-        # Handle empty database case
-        if not structured_products:
-            print("⚠️ No products found from database or local fallback")
-            return jsonify([])
-            
-        # Prepare result array
-        result = []
-        
-        # If category is "all", gather products from all categories
-        if category == 'all':
-            for cat, products in structured_products.items():
-                for product in products:
-                    product['category'] = cat  # Add category to each product
-                    # Fix image path to use backend URL since Vercel deployment has issues
-                    if 'image' in product and not product['image'].startswith('http'):
-                        backend_base_url = request.host_url.rstrip('/')
-                        if product['image'].startswith('/images/'):
-                            product['image'] = f"{backend_base_url}{product['image']}"
-                        else:
-                            product['image'] = f"{backend_base_url}/images/{product['image']}"
-                    result.append(product)
+        if catalog_pushdown_enabled() and not search and not spec_filters:
+            # No in-memory catalog: let MongoDB filter and sort on the per-product indexes
+            result = query_product_items(category, brand, min_price, max_price, sort_key)
+            positions = {product['id']: i for i, product in enumerate(result)}
         else:
-            # Get products from the specific category
-            result = structured_products.get(category, [])
-            # Add category to each product and fix image paths
-            for product in result:
-                product['category'] = category
-                # Fix image path to use backend URL since Vercel deployment has issues
-                if 'image' in product and not product['image'].startswith('http'):
-                    backend_base_url = request.host_url.rstrip('/')
-                    if product['image'].startswith('/images/'):
-                        product['image'] = f"{backend_base_url}{product['image']}"
-                    else:
-                        product['image'] = f"{backend_base_url}/images/{product['image']}"
+            # Serve from the catalog snapshot; only the page we return gets copied
+            snapshot = request_catalog_snapshot()
+            
+            # Handle empty database case
+            if not snapshot.products:
+                print("⚠️ No products found from database or local fallback")
+                return jsonify([])
+            
+            # Presorted ordering for this category, narrowed by the filters
+            result, positions = select_catalog_products(snapshot, filters, sort_key)
         
-        # Apply brand filter if specified
-        if brand:
-            result = [p for p in result if brand.lower() in p.get('brand', '').lower()]
+        total_count = len(result)
         
-        # Apply search filter if specified
-        if search:
-            # Case-insensitive search in name and features
-            search_terms = search.lower().split()
-            filtered_results = []
-            
-            for product in result:
-                product_name = product.get('name', '').lower()
-                product_features = ' '.join(product.get('features', [])).lower()  # Changed from specifications to features
-                product_text = f"{product_name} {product_features}"
-                
-                # Check if all search terms are found in the product text
-                if all(term in product_text for term in search_terms):
-                    filtered_results.append(product)
-            
-            result = filtered_results
+        # Keyset pagination: the cursor is the ID of the last product on the previous page
+        if cursor:
+            try:
+                cursor_position = positions[decode_page_cursor(cursor)]
+            except (KeyError, ValueError):
+                return jsonify({"error": "Invalid or expired cursor"}), 400
+            start = bisect.bisect_right(result, cursor_position, key=lambda p: positions[p['id']])
+            result = result[start:]
         
-        # Create a mapping of all products to their global index first
-        all_products = []
-        for cat, products in structured_products.items():
-            for product in products:
-                product['category'] = cat
-                all_products.append(product)
-        
-        # Add ID field for each product based on their position in the complete list
-        for i, product in enumerate(all_products):
-            name_slug = re.sub(r'[^a-z0-9]', '-', product['name'].lower())
-            name_slug = name_slug.strip('-')
-            name_slug = re.sub(r'-+', '-', name_slug)
-            product['id'] = f"{i+1}-{name_slug}"
-        
-        # Filter the results with IDs already assigned
-        if category != 'all':
-            result = [p for p in all_products if p.get('category', '').lower() == category]
-        else:
-            result = all_products
+        next_cursor = None
+        if limit and len(result) > limit:
+            result = result[:limit]
+            next_cursor = encode_page_cursor(result[-1]['id'])
         
-        print(f"✅ API returning {len(result)} products for category '{category}'")
-        return jsonify(result)
+        # Fix image path to use backend URL since Vercel deployment has issues
+        # (resolved while serializing; the shared catalog records are never copied or modified)
+        backend_base_url = request.host_url.rstrip('/')
+        page = [ProductView(product, backend_base_url, fields) for product in result]
+        
+        print(f"✅ API returning {len(page)} of {total_count} products for category '{category}'")
+        response = jsonify(page)
+        response.headers['X-Total-Count'] = str(total_count)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
     
     except Exception as e:
         print(f"❌ Error in /api/products: {str(e)}")
@@ -892,7 +1453,33 @@ def api_products():
         return response, 200  # Return 200 to avoid frontend errors, but with empty array
 
 
+@app.route('/api/facets', methods=['GET'])
+@catalog_cache_headers('facets')
+def api_facets():
+    """
+    Filter sidebar counts: products per category, brand and price bucket.
+    Takes the same filters as /api/products. Each facet ignores its own filter,
+    so the sidebar still shows the other brands/categories/price ranges to switch to.
+    """
+    try:
+        filters = parse_catalog_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        snapshot = request_catalog_snapshot()
+        unfiltered = {"category": "all", "brand": "", "search": "", "min_price": None, "max_price": None, "spec_filters": {}}
+        if filters == unfiltered:
+            return jsonify(snapshot.derived("facets", build_catalog_facets).summary())
+        return jsonify(count_filtered_facets(snapshot, filters).summary())
+
+    except Exception as e:
+        print(f"❌ Error in /api/facets: {str(e)}")
+        return jsonify({"error": "Failed to compute facets"}), 500
+
+
 @app.route('/api/product/<product_id>', methods=['GET'])
+@catalog_cache_headers('product')
 def api_product_by_id(product_id):
     """
     Get a single product by its ID
@@ -900,52 +1487,27 @@ def api_product_by_id(product_id):
     try:
         print(f"🔍 Looking for product with ID: {product_id}")
         
-        # Fetch all products from database
-        structured_products = fetch_products_from_database()
+        snapshot = request_catalog_snapshot()
         
-        if not structured_products:
+        if not snapshot.products:
             return jsonify({"error": "No products found"}), 404
         
-        # Create a flat list of all products with their IDs - SAME AS /api/products
-        all_products = []
-        for category, products in structured_products.items():
-            for product in products:
-                product['category'] = category
-                all_products.append(product)
-        
-        # Generate IDs using the same logic as /api/products (flat list indexing)
-        for i, product in enumerate(all_products):
-            name_slug = re.sub(r'[^a-z0-9]', '-', product['name'].lower())
-            name_slug = name_slug.strip('-')
-            name_slug = re.sub(r'-+', '-', name_slug)
-            generated_id = f"{i+1}-{name_slug}"
-            product['id'] = generated_id  # Always set the ID
-            
-            # Try multiple matching strategies
-            if (generated_id == product_id or 
-                product_id in generated_id or 
-                generated_id.endswith(f"-{product_id}") or
-                product['name'].lower().replace(' ', '-') in product_id.lower()):
-                
-                # Fix image path to use backend URL since Vercel deployment has issues
-                if 'image' in product and not product['image'].startswith('http'):
-                    backend_base_url = request.host_url.rstrip('/')
-                    if product['image'].startswith('/images/'):
-                        product['image'] = f"{backend_base_url}{product['image']}"
-                    else:
-                        product['image'] = f"{backend_base_url}/images/{product['image']}"
-                print(f"✅ Found product: {product['name']} with ID: {generated_id}")
-                return jsonify(product)
-        
-        # Debug: Log all available IDs for troubleshooting
-        available_ids = [p['id'] for p in all_products]
-        print(f"❌ Product not found with ID: {product_id}")
-        print(f"Available IDs: {available_ids[:10]}...")  # Show first 10 IDs
-        return jsonify({
-            "error": "Product not found", 
-            "requested_id": product_id,
-            "available_ids": available_ids[:5]  # Include some available IDs for debugging
-        }), 404
+        # Stable IDs and legacy aliases are indexed once per catalog version
+        product = snapshot.find_product(product_id)
+        
+        if product is None:
+            available_ids = list(itertools.islice(snapshot.products_by_id, 5))
+            print(f"❌ Product not found with ID: {product_id}")
+            return jsonify({
+                "error": "Product not found", 
+                "requested_id": product_id,
+                "available_ids": available_ids  # Include some available IDs for debugging
+            }), 404
+        
+        # Fix image path to use backend URL since Vercel deployment has issues
+        product = ProductView(product, request.host_url.rstrip('/'))
+        print(f"✅ Found product: {product['name']} with ID: {product['id']}")
+        return jsonify(product)
         
     except Exception as e:
         print(f"❌ Error in /api/product/{product_id}: {str(e)}")
@@ -1033,6 +1595,7 @@ def debug_db():
         mongodb_uri = os.getenv('MONGODB_URI')
         vercel_env = os.getenv('VERCEL')
         
+        ensure_mongodb()
         debug_info = {
             "mongodb_uri_exists": bool(mongodb_uri),
             "mongodb_uri_length": len(mongodb_uri) if mongodb_uri else 0,
@@ -1063,6 +1626,13 @@ def debug_db():
         # Try to count documents
         product_count = collection.count_documents({})
         
+        # Confirm the catalog lookups are served by indexes rather than collection scans
+        query_plans = {}
+        for label, query in (("category", category_key_query("phone")),
+                             ("product_name", product_name_prefix_query("iphone"))):
+            winning_plan = collection.find(query).explain().get("queryPlanner", {}).get("winningPlan", {})
+            query_plans[label] = describe_plan_stages(winning_plan)
+        
         # Get a sample document
         sample_doc = collection.find_one({})
         if sample_doc and "_id" in sample_doc:
@@ -1073,6 +1643,7 @@ def debug_db():
             "databases": db_names,
             "collections": collections,
             "product_count": product_count,
+            "query_plans": query_plans,
             "sample_document": sample_doc
         })
     except Exception as e:
@@ -1082,6 +1653,14 @@ def debug_db():
         
 # -------------------- **Helper Functions** --------------------
 
+def describe_plan_stages(plan):
+    """Flatten an explain() winningPlan into its stage names, e.g. ['FETCH', 'IXSCAN']."""
+    stages = []
+    while plan:
+        stages.append(plan.get("stage", "UNKNOWN"))
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return stages
+
 def detect_product_category(user_message):
     """
     Enhanced function to detect product category with better typo tolerance
@@ -1155,99 +1734,573 @@ def levenshtein_distance(s1, s2):
     return previous_row[-1]
 
 
-def send_to_gemini(user_data, structured_products):
+# -------------------- **Gemini Prompt Builder** --------------------
+# Approximate token ceiling for one Gemini prompt (0 = no limit). Over budget, the
+# lowest-priority trimmable sections (old conversation turns, then candidate products) shrink.
+GEMINI_PROMPT_TOKEN_BUDGET = int(os.getenv('GEMINI_PROMPT_TOKEN_BUDGET', '12000'))
+# Product fields the model needs; ids, slugs and categories are left out of prompts
+PROMPT_PRODUCT_FIELDS = ("name", "brand", "price", "features", "image")
+
+
+def estimate_tokens(text):
+    """Rough Gemini token count: about 4 characters per token for English text and JSON."""
+    return (len(text) + 3) // 4
+
+
+def compact_json(value):
+    """Minified JSON for prompts (pretty-printing costs a token for every indent)."""
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def compact_products(products):
+    """Products reduced to PROMPT_PRODUCT_FIELDS, skipping empty values."""
+    return [
+        {field: product[field] for field in PROMPT_PRODUCT_FIELDS if product.get(field) not in (None, "", [], ())}
+        for product in products if isinstance(product, dict)
+    ]
+
+
+class PromptBuilder:
     """
-    Enhanced function to improve product filtering and respect brand preferences.
+    Gemini prompt assembled from named sections, sent in the order they were added.
+    Fixed sections are always sent. Item sections (conversation turns, products) are
+    rendered from a list and, when the prompt is over its token budget, lose items
+    lowest priority first down to `keep`. Every build logs tokens per section.
     """
-    # Get products from the selected category
-    category = user_data["category"].lower()
-    all_products = structured_products.get(category, [])
-    
-    # DEBUGGING: Add detailed logging
-    print(f"🔍 RECOMMENDATION DEBUG: structured_products keys: {list(structured_products.keys()) if structured_products else 'None'}")
-    print(f"🔍 RECOMMENDATION DEBUG: Looking for category '{category}'")
-    print(f"🔍 RECOMMENDATION DEBUG: all_products length: {len(all_products)}")
-    print(f"🔍 RECOMMENDATION DEBUG: user_data: {user_data}")
-    
-    if not all_products:
-        print(f"❌ RECOMMENDATION DEBUG: No products found for category '{category}'")
-        # Try direct fetch as fallback
-        fallback_products = fetch_products_from_database()
-        if fallback_products and category in fallback_products:
-            all_products = fallback_products[category]
-            print(f"✅ RECOMMENDATION DEBUG: Fallback found {len(all_products)} products for {category}")
-        else:
-            return {"response_type": "recommendation", 
-                    "message": f"I don't have any {category} products in our database at the moment."}
-    
-    print(f"🔍 Sending {len(all_products)} {category} products to Gemini")
-    
-    # Extract brand preference more accurately
-    brand_preference = None
-    if "budget_brand_response" in user_data:
-        brand_response = user_data["budget_brand_response"].lower()
-        
-        # List of common brands to check for
-        common_brands = ["apple", "samsung", "sony", "lg", "dell", "hp", "asus", 
-                        "acer", "lenovo", "microsoft", "google", "oneplus", "xiaomi"]
-        
-        # Check if any brand is mentioned
-        for brand in common_brands:
-            if brand in brand_response and "not " + brand not in brand_response:
-                brand_preference = brand
-                break
-                
-        # Check for specific product lines that imply brands
-        brand_indicators = {
-            "iphone": "apple", "macbook": "apple", "galaxy": "samsung", 
-            "pixel": "google", "surface": "microsoft"
-        }
-        
-        for indicator, brand in brand_indicators.items():
-            if indicator in brand_response:
-                brand_preference = brand
-                break
-    
-    # Convert products to JSON for Gemini
-    products_json = json.dumps(all_products, indent=2)
 
-    # Prepare the requirements
-    requirements = []
-    if user_data["purpose"]:
-        requirements.append(f"Will be used for: {user_data['purpose']}")
-    if user_data["features"]:
-        features_text = ", ".join(user_data["features"]) if isinstance(user_data["features"], list) else user_data["features"]
-        requirements.append(f"Desired features: {features_text}")
-    
-    # Add brand preference if detected
-    if brand_preference:
-        requirements.append(f"Preferred brand: {brand_preference}")
-    
-    # If we're using raw response mode, pass the budget and brand question response directly
-    if user_data.get("raw_response", False) and "budget_brand_response" in user_data:
-        requirements.append(f"Budget and brand preferences: {user_data['budget_brand_response']}")
-    
-    requirements_text = "\n".join([f"- {req}" for req in requirements])
+    def __init__(self, label, token_budget=None):
+        self.label = label
+        self.token_budget = GEMINI_PROMPT_TOKEN_BUDGET if token_budget is None else token_budget
+        self.sections = []
 
-    gpt_payload = {
-        "contents": [
-            {
-                "role": "user",
-                "parts": [
-                    {
-                        "text": f"""
-        You are a digital shopping assistant helping customers find the best products from our inventory.
+    def add(self, name, text):
+        """A fixed section; common indentation is removed and empty text is skipped."""
+        text = textwrap.dedent(text).strip()
+        if text:
+            self.sections.append({"name": name, "text": text})
 
-        ### **USER REQUIREMENTS:**
-        {requirements_text}
+    def add_items(self, name, items, render, priority, keep=0, trim_from_start=False):
+        """A section rendered from items; lower priority is trimmed first, oldest first with trim_from_start."""
+        section = {"name": name, "items": list(items), "render": render, "priority": priority,
+                   "keep": keep, "trim_from_start": trim_from_start, "trimmed": 0}
+        section["text"] = render(section["items"])
+        self.sections.append(section)
 
-        ### **IMPORTANT PRODUCT UNDERSTANDING RULES:**
-        1. When a user mentions a specific product like "iPhone", that indicates they prefer the Apple brand
-        2. If they say "Samsung Galaxy", that means they prefer Samsung brand
-        3. If they say "Google Pixel", that means they prefer Google brand
-        4. Always prioritize the specific products/brands mentioned in their requirements
-        5. When a user states they have "no budget", offer high-quality options without price constraints
-        6. If they don't mention budget, prioritize mid-range products
+    def total_tokens(self):
+        return sum(estimate_tokens(section["text"]) for section in self.sections)
+
+    def trim(self, section, overflow):
+        """Drop about `overflow` tokens worth of items from a section (never below its keep)."""
+        items = section["items"]
+        dropped = 0
+        while items and len(items) > section["keep"] and dropped < overflow:
+            item = items.pop(0) if section["trim_from_start"] else items.pop()
+            dropped += estimate_tokens(compact_json(item))
+            section["trimmed"] += 1
+        section["text"] = section["render"](items)
+
+    def build(self):
+        """Prompt text within the token budget."""
+        total = self.total_tokens()
+        if self.token_budget > 0 and total > self.token_budget:
+            trimmable = sorted((s for s in self.sections if "items" in s), key=lambda s: s["priority"])
+            for section in trimmable:
+                while total > self.token_budget and len(section["items"]) > section["keep"]:
+                    self.trim(section, total - self.token_budget)
+                    total = self.total_tokens()
+
+        breakdown = ", ".join(
+            f"{s['name']} {estimate_tokens(s['text'])}" + (f" (-{s['trimmed']} items)" if s.get("trimmed") else "")
+            for s in self.sections
+        )
+        print(f"🧮 Gemini {self.label} prompt: ~{total} tokens [{breakdown}]")
+        if self.token_budget > 0 and total > self.token_budget:
+            print(f"⚠️ Gemini {self.label} prompt is still over its {self.token_budget}-token budget")
+        return "\n\n".join(section["text"] for section in self.sections)
+
+
+# -------------------- **Gemini Response Cache** --------------------
+# Conversations often open the same way ("laptop" -> "gaming" -> "under 1500"), so Gemini's
+# answer to an identical prompt is reused for GEMINI_CACHE_TTL seconds (0 disables the cache).
+# GEMINI_CACHE_PATH adds an sqlite file behind the in-memory LRU so entries survive restarts.
+GEMINI_CACHE_TTL = float(os.getenv('GEMINI_CACHE_TTL', '3600'))
+GEMINI_CACHE_SIZE = int(os.getenv('GEMINI_CACHE_SIZE', '512'))
+GEMINI_CACHE_PATH = os.getenv('GEMINI_CACHE_PATH', '')
+# Expired sqlite rows are swept every this many stores
+GEMINI_CACHE_SWEEP_EVERY = 100
+
+
+class GeminiResponseCache:
+    """
+    LRU + TTL cache of Gemini response texts keyed by prompt digest, with an optional
+    sqlite backend. Only answers that contain a parseable JSON reply are stored.
+    """
+
+    def __init__(self, ttl, size, path=''):
+        self.ttl = ttl
+        self.size = size
+        self.entries = OrderedDict()  # key -> (expires_at, text)
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self.db = None
+        if path and ttl > 0:
+            try:
+                self.db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+                self.db.execute("CREATE TABLE IF NOT EXISTS gemini_cache "
+                                "(key TEXT PRIMARY KEY, response TEXT NOT NULL, expires_at REAL NOT NULL)")
+                self.db.commit()
+                print(f"✅ Gemini response cache persisted to {path}")
+            except sqlite3.Error as e:
+                print(f"⚠️ Gemini response cache stays in memory ({path}: {e})")
+                self.db = None
+
+    def get(self, key):
+        if self.ttl <= 0:
+            return None
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[1]
+            self.entries.pop(key, None)
+            if self.db is not None:
+                try:
+                    row = self.db.execute("SELECT response, expires_at FROM gemini_cache WHERE key = ? AND expires_at > ?",
+                                          (key, now)).fetchone()
+                except sqlite3.Error as e:
+                    print(f"⚠️ Gemini cache read failed: {e}")
+                    row = None
+                if row is not None:
+                    self._remember(key, row[1], row[0])
+                    self.stats["disk_hits"] += 1
+                    return row[0]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key, text):
+        if self.ttl <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            self._remember(key, expires_at, text)
+            self.stats["stores"] += 1
+            if self.db is not None:
+                try:
+                    self.db.execute("INSERT OR REPLACE INTO gemini_cache (key, response, expires_at) VALUES (?, ?, ?)",
+                                    (key, text, expires_at))
+                    if self.stats["stores"] % GEMINI_CACHE_SWEEP_EVERY == 0:
+                        self.db.execute("DELETE FROM gemini_cache WHERE expires_at <= ?", (time.time(),))
+                    self.db.commit()
+                except sqlite3.Error as e:
+                    print(f"⚠️ Gemini cache write failed: {e}")
+
+    def _remember(self, key, expires_at, text):
+        self.entries[key] = (expires_at, text)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def summary(self):
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["disk_hits"] + self.stats["misses"]
+            hit_rate = (self.stats["hits"] + self.stats["disk_hits"]) / lookups if lookups else 0.0
+            return {**self.stats, "entries": len(self.entries), "hit_rate": round(hit_rate, 3),
+                    "ttl_seconds": self.ttl, "persistent": self.db is not None}
+
+
+gemini_response_cache = GeminiResponseCache(GEMINI_CACHE_TTL, GEMINI_CACHE_SIZE, GEMINI_CACHE_PATH)
+
+
+def gemini_cache_key(gpt_payload):
+    """
+    Digest of everything that shapes the answer: model, catalog content and the prompt, with
+    case and whitespace normalized. The prompt carries the category, the conversation,
+    rejected products and the candidate products, so equivalent conversations share a key.
+    """
+    prompt = " ".join(part.get("text", "") for content in gpt_payload["contents"] for part in content["parts"])
+    # Lowercase, collapse whitespace and drop it next to quotes (padding around quoted user messages)
+    normalized = re.sub(r' ?" ?', '"', " ".join(prompt.lower().split()))
+    snapshot = _catalog_snapshot
+    key = json.dumps([GEMINI_MODEL, snapshot.digest if snapshot is not None else "", normalized])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def has_json_reply(text):
+    """Whether the response holds a JSON object the chat handlers can parse (worth caching)."""
+    for pattern in (r'```json\s*({.*?})\s*```', r'```\s*({.*?})\s*```'):
+        match = re.search(pattern, text, re.DOTALL)
+        if match:
+            try:
+                json.loads(match.group(1).strip())
+                return True
+            except ValueError:
+                pass
+    return False
+
+
+# -------------------- **Semantic Response Cache** --------------------
+# Optional second layer for follow-up turns: a paraphrase of a cached conversation
+# ("cheap gaming laptop" / "budget laptop for games") reuses its answer when the hashed
+# bag-of-words vectors of the user's turns are at least GEMINI_SEMANTIC_THRESHOLD cosine-similar.
+# Only conversations with the same slot state (category, flags, recommended and rejected
+# products, numbers and brands mentioned) are compared. Needs NumPy; off by default and can be
+# switched off at runtime through POST /api/gemini-cache/semantic.
+GEMINI_SEMANTIC_CACHE = os.getenv('GEMINI_SEMANTIC_CACHE', 'off').lower() in ('1', 'true', 'on', 'yes')
+GEMINI_SEMANTIC_THRESHOLD = float(os.getenv('GEMINI_SEMANTIC_THRESHOLD', '0.9'))
+GEMINI_SEMANTIC_CACHE_SIZE = int(os.getenv('GEMINI_SEMANTIC_CACHE_SIZE', '256'))
+SEMANTIC_VECTOR_DIM = 1024
+SEMANTIC_STOPWORDS = {
+    "a", "an", "and", "any", "are", "be", "can", "do", "for", "from", "have", "i", "i'm", "im", "in", "is",
+    "it", "like", "looking", "me", "my", "need", "of", "on", "one", "or", "please", "show", "some",
+    "something", "that", "the", "to", "want", "what", "which", "with", "would", "you",
+}
+SEMANTIC_SYNONYMS = {
+    "cheap": "budget", "cheaper": "budget", "affordable": "budget", "inexpensive": "budget", "low-cost": "budget",
+    "games": "gaming", "gamer": "gaming", "game": "gaming",
+    "notebook": "laptop", "laptops": "laptop", "smartphone": "phone", "mobile": "phone", "phones": "phone",
+    "television": "tv", "tvs": "tv", "headphones": "headphone", "earbuds": "headphone",
+    "below": "under", "less": "under", "max": "under", "maximum": "under",
+}
+
+
+def semantic_terms(text):
+    """Normalized terms of a message: stopwords dropped, synonyms folded, common suffixes stripped."""
+    terms = []
+    for token in tokenize_search_text(text):
+        if token in SEMANTIC_STOPWORDS:
+            continue
+        token = SEMANTIC_SYNONYMS.get(token, token)
+        for suffix in ("ing", "es", "s", "er"):
+            if len(token) > len(suffix) + 2 and token.endswith(suffix) and not token[-len(suffix) - 1].isdigit():
+                token = token[:-len(suffix)]
+                break
+        terms.append(token)
+    return terms
+
+
+def embed_semantic_text(text):
+    """L2-normalized signed hashing vector of the text's terms (log-scaled counts)."""
+    vector = np.zeros(SEMANTIC_VECTOR_DIM, dtype=np.float32)
+    counts = {}
+    for term in semantic_terms(text):
+        counts[term] = counts.get(term, 0) + 1
+    for term, count in counts.items():
+        digest = int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+        vector[digest % SEMANTIC_VECTOR_DIM] += (1.0 + math.log(count)) * (1 if digest >> 63 else -1)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+def semantic_conversation_hash(conversation):
+    """Short digest that tells audit entries apart without recording what the user wrote."""
+    return hashlib.sha256(conversation.encode('utf-8')).hexdigest()[:12]
+
+
+class SemanticResponseCache:
+    """
+    Gemini responses grouped by slot state; a lookup embeds the conversation and reuses the
+    most similar entry in its group when it clears the threshold. LRU + TTL eviction, and the
+    last decisions are kept in an audit log. Neither the entries nor the log keep the user's
+    wording: conversations are identified by a short hash only.
+    """
+
+    def __init__(self, enabled, threshold, size, ttl):
+        self.enabled = enabled and np is not None and ttl > 0
+        self.threshold = threshold
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # (bucket, key) -> {"vector", "text", "conversation_hash", "expires_at"}
+        self.buckets = {}  # bucket -> set of entry keys
+        self.audit = deque(maxlen=200)
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def get(self, bucket, conversation):
+        if not self.enabled:
+            return None
+        vector = embed_semantic_text(conversation)
+        now = time.time()
+        with self.lock:
+            best_key, best_similarity = None, -1.0
+            for entry_key in list(self.buckets.get(bucket, ())):
+                entry = self.entries[entry_key]
+                if entry["expires_at"] <= now:
+                    self._forget(entry_key)
+                    continue
+                similarity = float(np.dot(vector, entry["vector"]))
+                if similarity > best_similarity:
+                    best_key, best_similarity = entry_key, similarity
+            if best_key is None:
+                self.stats["misses"] += 1
+                return None
+
+            entry = self.entries[best_key]
+            accepted = best_similarity >= self.threshold
+            query_hash = semantic_conversation_hash(conversation)
+            self.audit.append({"time": round(now, 3), "similarity": round(best_similarity, 4), "accepted": accepted,
+                               "query_hash": query_hash, "cached_query_hash": entry["conversation_hash"]})
+            print(f"🧭 Semantic cache {'hit' if accepted else 'miss'}: similarity {best_similarity:.3f} "
+                  f"(threshold {self.threshold}) {query_hash} ~ {entry['conversation_hash']}")
+            if not accepted:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(best_key)
+            self.stats["hits"] += 1
+            return entry["text"]
+
+    def put(self, bucket, key, conversation, text):
+        if not self.enabled:
+            return
+        entry = {"vector": embed_semantic_text(conversation), "text": text,
+                 "conversation_hash": semantic_conversation_hash(conversation), "expires_at": time.time() + self.ttl}
+        with self.lock:
+            self.entries[(bucket, key)] = entry
+            self.entries.move_to_end((bucket, key))
+            self.buckets.setdefault(bucket, set()).add((bucket, key))
+            self.stats["stores"] += 1
+            while len(self.entries) > self.size:
+                self._forget(next(iter(self.entries)))
+                self.stats["evictions"] += 1
+
+    def _forget(self, entry_key):
+        self.entries.pop(entry_key, None)
+        bucket_keys = self.buckets.get(entry_key[0])
+        if bucket_keys is not None:
+            bucket_keys.discard(entry_key)
+            if not bucket_keys:
+                del self.buckets[entry_key[0]]
+
+    def set_enabled(self, enabled):
+        """Kill switch: disabling also drops every entry."""
+        with self.lock:
+            self.enabled = bool(enabled) and np is not None and self.ttl > 0
+            if not self.enabled:
+                self.entries.clear()
+                self.buckets.clear()
+        return self.enabled
+
+    def summary(self):
+        with self.lock:
+            return {**self.stats, "enabled": self.enabled, "entries": len(self.entries),
+                    "threshold": self.threshold, "ttl_seconds": self.ttl}
+
+
+semantic_response_cache = SemanticResponseCache(GEMINI_SEMANTIC_CACHE, GEMINI_SEMANTIC_THRESHOLD,
+                                                GEMINI_SEMANTIC_CACHE_SIZE, GEMINI_CACHE_TTL)
+
+
+def semantic_cache_context(query_data, brands=()):
+    """
+    (bucket digest, conversation text) for a follow-up query. The bucket holds the slot state
+    that must match exactly; the conversation (the user's turns) is compared by similarity.
+    """
+    user_turns = [entry.get("message", "") for entry in query_data.get("conversation_history", [])
+                  if entry.get("role") == "user"]
+    latest = query_data.get("user_message", "")
+    if latest and (not user_turns or user_turns[-1] != latest):
+        user_turns.append(latest)
+    conversation = " | ".join(" ".join(turn.lower().split()) for turn in user_turns)
+
+    slot_state = {
+        "model": GEMINI_MODEL,
+        "catalog": _catalog_snapshot.digest if _catalog_snapshot is not None else "",
+        "category": str(query_data.get("category", "")).lower(),
+        "flags": sorted(key for key in ("is_initial", "category_switched", "task_suitability_check", "provide_detailed_info",
+                                        "has_use_case", "has_budget", "should_show_products", "explicit_show_request")
+                        if query_data.get(key)),
+        "focus_product": str(query_data.get("focus_product") or "").lower(),
+        "mentioned": sorted(str(name).lower() for name in query_data.get("specifically_mentioned_products", []) if name),
+        "recommended": sorted(str(p.get("name", "")).lower() for p in query_data.get("recommended_products", []) if isinstance(p, dict)),
+        "rejected": sorted(str(name).lower() for name in query_data.get("rejected_products", []) if name),
+        # Numbers (budgets, sizes) and brands change the answer however similar the wording is
+        "numbers": sorted(set(re.findall(r'\d+(?:\.\d+)?', conversation))),
+        "brands": sorted(brand for brand in brands if brand and re.search(rf'\b{re.escape(brand)}\b', conversation)),
+    }
+    bucket = hashlib.sha256(json.dumps(slot_state, sort_keys=True).encode('utf-8')).hexdigest()
+    return bucket, conversation
+
+
+@app.route('/api/gemini-cache/semantic', methods=['GET', 'POST'])
+def semantic_cache_admin():
+    """Semantic cache stats and similarity audit log; POST {"enabled": false} is the kill switch."""
+    if not CATALOG_ADMIN_TOKEN or request.headers.get('X-Admin-Token') != CATALOG_ADMIN_TOKEN:
+        return jsonify({"error": "Forbidden"}), 403
+    if request.method == 'POST':
+        enabled = semantic_response_cache.set_enabled((request.get_json(silent=True) or {}).get("enabled", False))
+        print(f"🧭 Semantic cache {'enabled' if enabled else 'disabled'}")
+    return jsonify({**semantic_response_cache.summary(), "audit": list(semantic_response_cache.audit)})
+
+
+# Set per thread by /chat/stream: open() returns the on_text callback for one Gemini call,
+# which receives its text chunk by chunk while it is generated; cancelled is set once the
+# client has disconnected
+_gemini_stream = threading.local()
+
+
+def gemini_stream_cancelled():
+    cancelled = getattr(_gemini_stream, "cancelled", None)
+    return cancelled is not None and cancelled.is_set()
+
+
+def stream_gemini_text(gpt_payload, on_text):
+    """
+    Call streamGenerateContent (as SSE), passing every text chunk to on_text as it arrives.
+    Returns the complete text, or None on API errors or when the /chat/stream client is gone.
+    """
+    response = get_gemini_session().post(gemini_url("streamGenerateContent") + "&alt=sse",
+                                         json=gpt_payload, timeout=30, stream=True)
+    with response:
+        print(f"🔄 Gemini API Stream Status: {response.status_code}")
+        if response.status_code != 200:
+            print(f"❌ Gemini API Error: {response.text}")
+            return None
+        response.encoding = 'utf-8'
+        chunks = []
+        for line in response.iter_lines(decode_unicode=True):
+            if gemini_stream_cancelled():
+                print("🛑 Gemini stream stopped: the client disconnected")
+                return None
+            if not line or not line.startswith("data:"):
+                continue
+            data = json.loads(line[len("data:"):])
+            for candidate in data.get("candidates", [])[:1]:
+                for part in candidate.get("content", {}).get("parts", []):
+                    if part.get("text"):
+                        chunks.append(part["text"])
+                        on_text(part["text"])
+        return "".join(chunks)
+
+
+def generate_gemini_text(gpt_payload, semantic_context=None):
+    """
+    Gemini's response text for a payload, served from the response cache when possible
+    (and, given a semantic_cache_context(), from a similar cached conversation). None on API errors.
+    Inside /chat/stream the text is also streamed to the client as it is generated.
+    """
+    if gemini_stream_cancelled():
+        return None  # /chat/stream client disconnected: don't start another call
+    open_stream = getattr(_gemini_stream, "open", None)
+    on_text = open_stream() if open_stream is not None else None
+    key = gemini_cache_key(gpt_payload)
+    cached = gemini_response_cache.get(key)
+    if cached is not None:
+        print("⚡ Gemini response served from cache")
+    elif semantic_context is not None:
+        cached = semantic_response_cache.get(*semantic_context)
+    if cached is not None:
+        if on_text is not None:
+            on_text(cached)
+        return cached
+
+    if on_text is not None:
+        generated_text = stream_gemini_text(gpt_payload, on_text)
+        if generated_text is None:
+            return None
+    else:
+        response = get_gemini_session().post(gemini_url(), json=gpt_payload, timeout=30)
+        print(f"🔄 Gemini API Response Status: {response.status_code}")
+        if response.status_code != 200:
+            print(f"❌ Gemini API Error: {response.text}")
+            return None
+
+        response_data = response.json()
+        generated_text = response_data["candidates"][0]["content"]["parts"][0].get("text", "")
+    if has_json_reply(generated_text):
+        gemini_response_cache.put(key, generated_text)
+        if semantic_context is not None:
+            semantic_response_cache.put(semantic_context[0], key, semantic_context[1], generated_text)
+    return generated_text
+
+
+def send_to_gemini(user_data, structured_products):
+    """
+    Enhanced function to improve product filtering and respect brand preferences.
+    """
+    # Get products from the selected category
+    category = user_data["category"].lower()
+    all_products = structured_products.get(category, [])
+    
+    # DEBUGGING: Add detailed logging
+    print(f"🔍 RECOMMENDATION DEBUG: structured_products keys: {list(structured_products.keys()) if structured_products else 'None'}")
+    print(f"🔍 RECOMMENDATION DEBUG: Looking for category '{category}'")
+    print(f"🔍 RECOMMENDATION DEBUG: all_products length: {len(all_products)}")
+    print(f"🔍 RECOMMENDATION DEBUG: user_data: {user_data}")
+    
+    if not all_products:
+        print(f"❌ RECOMMENDATION DEBUG: No products found for category '{category}'")
+        # Try direct fetch as fallback
+        fallback_products = fetch_products_from_database()
+        if fallback_products and category in fallback_products:
+            all_products = fallback_products[category]
+            print(f"✅ RECOMMENDATION DEBUG: Fallback found {len(all_products)} products for {category}")
+        else:
+            return {"response_type": "recommendation", 
+                    "message": f"I don't have any {category} products in our database at the moment."}
+    
+    print(f"🔍 Sending {len(all_products)} {category} products to Gemini")
+    
+    # Extract brand preference more accurately
+    brand_preference = None
+    if "budget_brand_response" in user_data:
+        brand_response = user_data["budget_brand_response"].lower()
+        
+        # List of common brands to check for
+        common_brands = ["apple", "samsung", "sony", "lg", "dell", "hp", "asus", 
+                        "acer", "lenovo", "microsoft", "google", "oneplus", "xiaomi"]
+        
+        # Check if any brand is mentioned
+        for brand in common_brands:
+            if brand in brand_response and "not " + brand not in brand_response:
+                brand_preference = brand
+                break
+                
+        # Check for specific product lines that imply brands
+        brand_indicators = {
+            "iphone": "apple", "macbook": "apple", "galaxy": "samsung", 
+            "pixel": "google", "surface": "microsoft"
+        }
+        
+        for indicator, brand in brand_indicators.items():
+            if indicator in brand_response:
+                brand_preference = brand
+                break
+    
+    # Only the best candidates go into the prompt; answers are still checked against all_products
+    candidate_products = select_prompt_candidates(all_products, user_data)
+
+    # Prepare the requirements
+    requirements = []
+    if user_data["purpose"]:
+        requirements.append(f"Will be used for: {user_data['purpose']}")
+    if user_data["features"]:
+        features_text = ", ".join(user_data["features"]) if isinstance(user_data["features"], list) else user_data["features"]
+        requirements.append(f"Desired features: {features_text}")
+    
+    # Add brand preference if detected
+    if brand_preference:
+        requirements.append(f"Preferred brand: {brand_preference}")
+    
+    # If we're using raw response mode, pass the budget and brand question response directly
+    if user_data.get("raw_response", False) and "budget_brand_response" in user_data:
+        requirements.append(f"Budget and brand preferences: {user_data['budget_brand_response']}")
+    
+    requirements_text = "\n".join([f"- {req}" for req in requirements])
+
+    # Assemble the prompt within the token budget (the lowest-ranked candidates are trimmed first)
+    prompt = PromptBuilder("recommendation")
+    prompt.add("instructions", "You are a digital shopping assistant helping customers find the best products from our inventory.")
+    prompt.add("requirements", f"### **USER REQUIREMENTS:**\n{requirements_text}")
+    prompt.add("rules", """
+        ### **IMPORTANT PRODUCT UNDERSTANDING RULES:**
+        1. When a user mentions a specific product like "iPhone", that indicates they prefer the Apple brand
+        2. If they say "Samsung Galaxy", that means they prefer Samsung brand
+        3. If they say "Google Pixel", that means they prefer Google brand
+        4. Always prioritize the specific products/brands mentioned in their requirements
+        5. When a user states they have "no budget", offer high-quality options without price constraints
+        6. If they don't mention budget, prioritize mid-range products
 
         ### **RULES FOR RECOMMENDATIONS:**
         1. ONLY recommend products from the EXACT list provided below
@@ -1261,12 +2314,11 @@ def send_to_gemini(user_data, structured_products):
         9. If a preferred brand is mentioned, try to recommend only that brand's products
         10. IMPORTANT: Always include the product's image field in your recommendations
         11. If a specific brand is mentioned, ONLY recommend products from that brand unless none are available
-
-        ### **AVAILABLE PRODUCTS (ONLY recommend from this list):**
-        ```json
-        {products_json}
-        ```
-
+        """)
+    prompt.add_items("products", candidate_products,
+                     lambda products: f"### **AVAILABLE PRODUCTS (ONLY recommend from this list):**\n```json\n{compact_json(compact_products(products))}\n```",
+                     priority=1, keep=3)
+    prompt.add("format", f"""
         ### **CRITICAL PRODUCT RESTRICTION:**
         **EXTREMELY IMPORTANT**: You MUST ONLY recommend products that are available in the product list above. You are STRICTLY FORBIDDEN from recommending any products not in this database. NEVER mention products like "Xbox Series X", "ASUS ROG Phone 7", "Nubia RedMagic 8 Pro" or any other products not explicitly listed above. If none of our products match the user's specific request, explain what we do have available instead.
 
@@ -1287,23 +2339,14 @@ def send_to_gemini(user_data, structured_products):
           ]
         }}
         ```
-        """
-                    }
-                ]
-            }
-        ]
-    }
+        """)
 
-    try:
-        response = requests.post(endpoint, headers=headers, json=gpt_payload, timeout=30)
-        print(f"🔄 Gemini API Response Status: {response.status_code}")
+    gpt_payload = {"contents": [{"role": "user", "parts": [{"text": prompt.build()}]}]}
 
-        if response.status_code != 200:
-            print(f"❌ Gemini API Error: {response.text}")
+    try:
+        generated_text = generate_gemini_text(gpt_payload)
+        if generated_text is None:
             return {"response_type": "recommendation", "message": "Failed to process your query."}
-
-        response_data = response.json()
-        generated_text = response_data["candidates"][0]["content"]["parts"][0].get("text", "")
         print(f"🔍 INITIAL GEMINI RESPONSE DEBUG: Got response length: {len(generated_text)}")
         print(f"🔍 INITIAL GEMINI RESPONSE DEBUG: First 500 chars: {generated_text[:500]}...")
         
@@ -1523,58 +2566,51 @@ def send_followup_to_gemini(query_data):
         NEVER suggest that a product you recommended is not a good choice.
         """
     
-    # Prepare the products context
+    # Prepare the products context. "all_available" carries the best candidates for this
+    # conversation; the answer is still validated against the full category (all_products)
+    candidate_products = select_prompt_candidates(all_products, query_data)
     context_products = {
-        "recommended": recommended_products,
-        "all_available": all_products,
+        "recommended": compact_products(recommended_products),
+        "all_available": candidate_products,
         "specifically_mentioned": specifically_mentioned_products,
         "rejected_products": rejected_products  # Include rejected products
     }
     
     # DEBUGGING: Log what we're sending to Gemini
-    print(f"🔍 GEMINI PAYLOAD DEBUG: Sending {len(all_products)} products to Gemini for category '{category}'")
+    print(f"🔍 GEMINI PAYLOAD DEBUG: Sending {len(candidate_products)} of {len(all_products)} products to Gemini for category '{category}'")
     if len(all_products) > 0:
         print(f"🔍 GEMINI PAYLOAD DEBUG: First product: {all_products[0].get('name', 'No name')}")
         print(f"🔍 GEMINI PAYLOAD DEBUG: All product names: {[p.get('name', 'No name') for p in all_products[:3]]}")
     
-    # Convert context to JSON for Gemini
-    context_json = json.dumps(context_products, indent=2)
-    
-    gpt_payload = {
-        "contents": [
-            {
-                "role": "user",
-                "parts": [
-                    {
-                        "text": f"""
+    # Assemble the prompt within the token budget: the oldest conversation turns are
+    # trimmed first, then the lowest-ranked candidate products
+    prompt = PromptBuilder("follow-up")
+    prompt.add("instructions", f"""
         You are a digital shopping assistant helping a customer find the perfect {category}.
         
         {"This is the initial conversation. The customer is interested in a " + category + ". " + ("For gaming and audio categories with limited inventory, show available products after understanding basic needs." if category in ["gaming", "audio"] else "Start by understanding their needs, budget, and preferences naturally.") if query_data.get("is_initial") else "Continue the conversation naturally."}
-
-        ### **CONVERSATION HISTORY:**
-        {json.dumps(query_data.get("conversation_history", []), indent=2)}
-
-        ### **CONVERSATION CONTEXT:**
-        {context_text}
-
-        ### **PRODUCT CONTEXT:**
-        ```json
-        {context_json}
-        ```
-
+        """)
+    prompt.add_items("history", query_data.get("conversation_history", []),
+                     lambda turns: f"### **CONVERSATION HISTORY:**\n{compact_json(turns)}",
+                     priority=0, keep=2, trim_from_start=True)
+    prompt.add("context", f"### **CONVERSATION CONTEXT:**\n{context_text}")
+    prompt.add_items("products", candidate_products,
+                     lambda products: f"### **PRODUCT CONTEXT:**\n```json\n{compact_json({**context_products, 'all_available': compact_products(products)})}\n```",
+                     priority=1, keep=3)
+    prompt.add("question", f"""
         ### **USER'S FOLLOW-UP QUESTION:**
         "{user_question}"
-        
-        {f'''### **CATEGORY SWITCH DETECTED:**
+        """)
+    if query_data.get("category_switched"):
+        prompt.add("category_switch", f'''### **CATEGORY SWITCH DETECTED:**
 The user has switched to {category}s. This is a fresh start for this new category. You need to gather the essential information:
 1. What they'll primarily use the {category} for (purpose/use case)
 2. Their budget range  
 3. Any specific features they're looking for
 
-Respond naturally to their question while beginning this information gathering process. Don't show products until you have at least their primary use case.''' if query_data.get("category_switched") else ""}
-
-        {suitability_check_instructions}
-
+Respond naturally to their question while beginning this information gathering process. Don't show products until you have at least their primary use case.''')
+    prompt.add("suitability", suitability_check_instructions)
+    prompt.add("rules", f"""
         ### **CRITICAL PRODUCT RESTRICTION:**
         **EXTREMELY IMPORTANT**: You MUST ONLY recommend, suggest, or mention products that are available in the "all_available" products list above. You are STRICTLY FORBIDDEN from recommending any products that are not in this database. If a user asks for a specific product type and none exist in the database, politely explain that you don't currently have that type of product in stock and ask if they'd like to see what similar alternatives are available. NEVER invent, suggest, or recommend products like "Xbox Series X", "ASUS ROG Phone 7", "Nubia RedMagic 8 Pro" or any other products not explicitly listed in the database.
 
@@ -1713,23 +2749,16 @@ Respond naturally to their question while beginning this information gathering p
           "include_rejected_products": false  // Set to true if user's query indicates they want to see previously rejected products
         }}
         ```
-        """
-                    }
-                ]
-            }
-        ]
-    }
+        """)
+
+    gpt_payload = {"contents": [{"role": "user", "parts": [{"text": prompt.build()}]}]}
 
     try:
         print(f"🔍 GEMINI REQUEST DEBUG: Calling Gemini API...")
-        response = requests.post(endpoint, headers=headers, json=gpt_payload, timeout=30)
-        
-        if response.status_code != 200:
-            print(f"❌ Gemini API Error: {response.text}")
+        brands = {product.get("brand", "").lower() for product in all_products if isinstance(product, dict)}
+        generated_text = generate_gemini_text(gpt_payload, semantic_cache_context(query_data, brands))
+        if generated_text is None:
             return {"message": "I'm having trouble analyzing these products right now. Could you try again?"}
-
-        response_data = response.json()
-        generated_text = response_data["candidates"][0]["content"]["parts"][0].get("text", "")
         print(f"🔍 GEMINI RESPONSE DEBUG: Got response length: {len(generated_text)}")
         print(f"🔍 GEMINI RESPONSE DEBUG: First 200 chars: {generated_text[:200]}...")
         
@@ -1921,16 +2950,19 @@ Respond naturally to their question while beginning this information gathering p
             # Filter by price if user mentioned products being too expensive
             if "too expensive" in user_question.lower() or "cheaper" in user_question.lower():
                 # Get max price of recommended products to compare against
-                recommended_prices = [get_price_number(p.get("price", "")) for p in recommended_products]
-                max_recommended_price = max(recommended_prices) if recommended_prices else float('inf')
+                # (products without a price count as infinitely expensive)
+                recommended_prices = [as_product_record(p).price_value for p in recommended_products]
+                max_recommended_price = (max(float('inf') if price is None else price for price in recommended_prices)
+                                         if recommended_prices else float('inf'))
                 
                 # Only keep alternatives that are cheaper than the most expensive recommended product
-                cheaper_alternatives = []
-                for product in alternatives:
-                    product_price = get_price_number(product.get("price", ""))
-                    # Only keep products at least 15% cheaper
-                    if product_price < max_recommended_price * 0.85:
-                        cheaper_alternatives.append(product)
+                # (at least 15% cheaper, at catalog prices): one price-index range query
+                category_key = normalize_key(category)
+                price_index = get_catalog_snapshot().derived("prices", build_price_index)
+                cheaper_ids = {product["id"] for product in
+                               price_index.window(category_key, high=max_recommended_price * 0.85, strict_high=True)}
+                cheaper_alternatives = [product for product in alternatives
+                                        if make_product_id(product.get("name", ""), category_key) in cheaper_ids]
                 
                 # Replace alternatives with cheaper ones only
                 if cheaper_alternatives:
@@ -2186,216 +3218,1863 @@ Respond naturally to their question while beginning this information gathering p
         else:
             return {"message": "I encountered an error while processing your question. Could we try again?"}
     
-def fetch_products_from_database():
+# -------------------- **Per-Product Catalog Schema** --------------------
+
+# One document per product, populated by migrate_products.py. With PRODUCT_SCHEMA=auto the
+# loader reads it once the migration marker is present (or when it is the only layout with
+# data) and otherwise keeps reading the embedded category documents.
+PRODUCT_ITEMS_COLLECTION = os.getenv('PRODUCT_ITEMS_COLLECTION', 'product_items')
+CATALOG_META_COLLECTION = 'catalog_meta'
+PRODUCT_ITEMS_MIGRATION_MARKER = 'product_items_migration'
+PRODUCT_SCHEMA = os.getenv('PRODUCT_SCHEMA', 'auto').lower()  # auto | embedded | per_product
+PRODUCT_SCHEMA_RECHECK = float(os.getenv('PRODUCT_SCHEMA_RECHECK', '300'))
+_product_schema_decision = None  # (use per-product documents, re-check after) for PRODUCT_SCHEMA=auto
+
+# Sort orders pushed down to MongoDB for the per-product schema
+PRODUCT_ITEM_SORTS = {
+    "": [("sort_order", 1)],
+    "price_asc": [("price_value", 1), ("sort_order", 1)],
+    "price_desc": [("price_value", -1), ("sort_order", 1)],
+    "name": [("name_key", 1)],
+}
+
+
+def get_product_items_collection():
+    return db[PRODUCT_ITEMS_COLLECTION] if ensure_mongodb() else None
+
+
+def use_product_items():
     """
-    Fetches all products from MongoDB with fallback to local JSON file.
+    Whether catalog reads should come from the per-product collection. The auto-detected
+    answer is cached for PRODUCT_SCHEMA_RECHECK seconds (and dropped on catalog invalidation).
     """
-    # First try MongoDB if connected
-    if MONGODB_CONNECTED and collection is not None:
-        try:
-            products_cursor = collection.find({}, {"_id": 0})
-            structured_products = {}
+    global _product_schema_decision
+    if PRODUCT_SCHEMA == 'embedded':
+        return False
+    if PRODUCT_SCHEMA == 'per_product':
+        return True
+    decision = _product_schema_decision
+    if decision is not None and time.time() < decision[1]:
+        return decision[0]
+    if not ensure_mongodb():
+        return False
+    use_items = detect_product_items_schema(db)
+    _product_schema_decision = (use_items, time.time() + PRODUCT_SCHEMA_RECHECK)
+    return use_items
 
-            # Enhanced debug message
-            print("🔍 Fetching products from MongoDB Atlas...")
-            all_docs = list(products_cursor)
-            print(f"📋 Found {len(all_docs)} documents in MongoDB")
-            
-            if len(all_docs) == 0:
-                print("⚠️ No documents found in MongoDB, falling back to local data")
-                return fetch_products_from_local()
-                
-            for i, doc in enumerate(all_docs):
-                print(f"📄 Document {i+1}: category='{doc.get('category', 'NO CATEGORY')}', products={len(doc.get('products', []))}")
 
-            for doc in all_docs:
-                category = doc.get("category", "").strip().lower()
-                
-                if not category:
-                    continue  # Skip documents with no category
-                
-                # Initialize category list if it doesn't exist
-                if category not in structured_products:
-                    structured_products[category] = []
-
-                # Extract product details
-                if "products" in doc and isinstance(doc["products"], list):
-                    for sub_prod in doc["products"]:
-                        product_name = sub_prod.get("name", "").strip()
-                        product_price = sub_prod.get("price", "N/A")
-                        product_features = sub_prod.get("specifications", [])
-                        product_brand = sub_prod.get("brand", "").strip()
-                        
-                        # Get image directly from database field
-                        product_image = sub_prod.get("image", "")
+def detect_product_items_schema(database):
+    """PRODUCT_SCHEMA=auto: per-product once migrated, or when product_items is the only layout with data."""
+    if product_items_migrated(database):
+        return True
+    return (database[PRODUCT_ITEMS_COLLECTION].estimated_document_count() > 0
+            and database["products"].estimated_document_count() == 0)
 
-                        # Skip products without a name
-                        if not product_name:
-                            continue
 
-                        # Handle missing data
-                        if product_price == "N/A" or product_price is None:
-                            product_price = "Unknown Price"
+def product_items_migrated(database):
+    return database[CATALOG_META_COLLECTION].find_one({"_id": PRODUCT_ITEMS_MIGRATION_MARKER}, {"_id": 1}) is not None
 
-                        if not product_brand:
-                            product_brand = "Generic Brand"
-                        
-                        # Create relative image URL - use the image from database
-                        image_url = None
-                        if product_image:
-                            # Use relative path for production compatibility
-                            image_url = f"/images/{product_image}"
-                        else:
-                            # If no image in database, use default image
-                            image_url = "/images/default-product.jpg"
-                        
-                        # Add to structured products
-                        structured_products[category].append({
-                            "name": product_name,
-                            "price": f"${product_price}" if isinstance(product_price, (int, float)) else product_price,
-                            "features": product_features,
-                            "brand": product_brand,
-                            "image": image_url  # Use the full URL path
-                        })
 
-            # Detailed summary debug
-            product_counts = {cat: len(prods) for cat, prods in structured_products.items()}
-            print(f"📦 Loaded products from MongoDB: {product_counts}")
-            
-            # Extra debug for gaming and audio
-            if 'gaming' in structured_products:
-                print(f"🎮 Gaming products: {[p['name'] for p in structured_products['gaming']]}")
-            if 'audio' in structured_products:
-                print(f"🔊 Audio products: {[p['name'] for p in structured_products['audio']]}")
-            
-            return structured_products
+def mark_product_items_migrated(database, **details):
+    """Record that the catalog now lives in product_items (written by migrate_products.py)."""
+    database[CATALOG_META_COLLECTION].update_one(
+        {"_id": PRODUCT_ITEMS_MIGRATION_MARKER},
+        {"$set": {**details, "migratedAt": datetime.now(timezone.utc)}},
+        upsert=True
+    )
 
-        except Exception as e:
-            print(f"❌ MongoDB Error: {str(e)}")
-            print("🔄 Falling back to local JSON data...")
-            return fetch_products_from_local()
-    else:
-        print("🔄 Using local JSON data (MongoDB not connected)")
-        return fetch_products_from_local()
 
-def fetch_products_from_local():
+def reset_product_schema_decision():
+    global _product_schema_decision
+    _product_schema_decision = None
+
+
+# Normalized lookup keys of a per-product document and the fields they are derived from
+PRODUCT_ITEM_KEY_FIELDS = {"name_key": "$name", "category_key": "$category", "brand_key": "$brand"}
+
+
+def ensure_product_item_indexes(items_collection):
+    """Compound (category, brand, price) index for filter push-down, plus name and ordering lookups."""
+    items_collection.create_index([("category_key", 1), ("brand_key", 1), ("price_value", 1)])
+    items_collection.create_index([("category_key", 1), ("price_value", 1)])
+    items_collection.create_index("name_key")
+    items_collection.create_index("sort_order")
+    # Polling fallback of the catalog watcher
+    items_collection.create_index("updatedAt")
+
+
+def build_product_item(raw_product, category, sort_order):
     """
-    Fallback function to load products from local JSON file and add missing categories.
+    Per-product document for a product taken from a category document.
+    _id is the stable product ID, so writing the same product twice is an upsert, not a duplicate.
     """
-    try:
-        print("📁 Loading products from local products.json...")
-        
-        # Load existing data
-        with open('products.json', 'r') as f:
-            data = json.load(f)
-        
-        structured_products = {}
-        frontend_base_url = os.getenv('FRONTEND_BASE_URL', 'https://final-year-project-taupe.vercel.app')
-        
-        # Process existing categories
-        for item in data:
-            category = item.get("category", "").strip().lower()
-            if not category:
-                continue
-                
-            if category not in structured_products:
-                structured_products[category] = []
-                
-            if "products" in item and isinstance(item["products"], list):
-                for sub_prod in item["products"]:
-                    product_name = sub_prod.get("name", "").strip()
-                    product_price = sub_prod.get("price", "N/A")
-                    product_features = sub_prod.get("specifications", [])
-                    product_brand = sub_prod.get("brand", "").strip()
-                    product_image = sub_prod.get("image", "")
-                    
-                    if not product_name:
-                        continue
-                        
-                    # Handle missing data
-                    if product_price == "N/A" or product_price is None:
-                        product_price = "Unknown Price"
-                    if not product_brand:
-                        product_brand = "Generic Brand"
-                    
-                    # Create image URL
-                    if product_image:
-                        image_url = f"{frontend_base_url}/images/{product_image}"
-                    else:
-                        image_url = f"{frontend_base_url}/images/default-product.jpg"
-                    
-                    structured_products[category].append({
-                        "name": product_name,
-                        "price": f"${product_price}" if isinstance(product_price, (int, float)) else product_price,
-                        "features": product_features,
-                        "brand": product_brand,
-                        "image": image_url
-                    })
-        
-        # Add missing gaming products
-        if 'gaming' not in structured_products:
-            structured_products['gaming'] = [
-                {
-                    "name": "Sony PlayStation 5 Console",
-                    "brand": "Sony", 
-                    "price": "$499.99",
-                    "features": [
-                        "Custom AMD Zen 2 8-core CPU running at 3.5GHz",
-                        "Custom AMD RDNA 2 GPU with 10.28 TFLOPs",
-                        "16GB GDDR6 RAM with 448GB/s memory bandwidth",
-                        "825GB custom NVMe SSD with 5.5GB/s raw throughput",
-                        "Support for 4K gaming at up to 120fps with ray tracing",
-                        "Backwards compatibility with PlayStation 4 games",
-                        "DualSense wireless controller with haptic feedback"
-                    ],
-                    "image": f"{frontend_base_url}/images/ps5.jpg"
-                },
-                {
-                    "name": "Gaming Headset Stereo Surround Sound Gaming Headphones with Breathing RGB Light",
-                    "brand": "OZEINO",
-                    "price": "$29.99", 
-                    "features": [
-                        "50mm high-precision neodymium drivers for superior sound quality",
-                        "Breathing RGB LED lights with 7 color variations",
-                        "360-degree adjustable noise-canceling microphone",
-                        "3.5mm universal compatibility (PC, PS4, PS5, Xbox One, Nintendo Switch)",
-                        "Comfortable memory foam ear cushions for extended gaming sessions",
-                        "Professional gaming-grade audio with virtual surround sound"
-                    ],
-                    "image": f"{frontend_base_url}/images/gamingheadphone.jpg"
-                }
-            ]
-        
-        # Add missing audio products
-        if 'audio' not in structured_products:
-            structured_products['audio'] = [
-                {
-                    "name": "Gaming Headset Pro with RGB Lighting",
-                    "brand": "OZEINO",
-                    "price": "$49.99",
-                    "features": [
-                        "7.1 Surround Sound for immersive gaming experience",
-                        "Dynamic RGB lighting with multiple color modes", 
-                        "Professional-grade noise canceling microphone",
-                        "Ultra-comfortable memory foam padding",
-                        "Compatible with PC, PS4, PS5, Xbox, Nintendo Switch",
-                        "High-quality 50mm drivers for crystal clear audio"
-                    ],
-                    "image": f"{frontend_base_url}/images/headphone.jpg"
-                }
-            ]
-        
-        # Detailed summary
-        product_counts = {cat: len(prods) for cat, prods in structured_products.items()}
-        print(f"📦 Loaded products from local JSON: {product_counts}")
-        
-        return structured_products
-        
+    name = str(raw_product.get("name", "")).strip()
+    category_key = normalize_key(category)
+    product_id = make_product_id(name, category_key)
+    item = {key: value for key, value in raw_product.items() if key not in ("_id", "name_key")}
+    item.update({
+        "_id": product_id,
+        "product_id": product_id,
+        "name": name,
+        "name_key": normalize_key(name),
+        "category": category_key,
+        "category_key": category_key,
+        "brand_key": normalize_key(raw_product.get("brand")),
+        "price_value": parse_price_value(raw_product.get("price")),
+        "sort_order": sort_order,
+    })
+    return item
+
+
+def product_item_update(item, keep_sort_order=True):
+    """
+    Update pipeline that upserts a per-product document. updatedAt only moves when the
+    content actually changes, so re-running an import doesn't wake the catalog watchers.
+    It is stamped by the server ($$NOW), not by the client that built the update.
+    With keep_sort_order, existing products stay where they are in the catalog.
+    """
+    fields = {key: value for key, value in item.items() if key not in ("_id", "sort_order")}
+    content_hash = make_content_hash(fields)
+    sort_order = {"$literal": item.get("sort_order")}
+    return [
+        {"$set": {
+            "updatedAt": {"$cond": [{"$eq": ["$content_hash", content_hash]}, "$updatedAt", "$$NOW"]},
+            "sort_order": {"$ifNull": ["$sort_order", sort_order]} if keep_sort_order else sort_order,
+        }},
+        # $literal so display prices like "$999" aren't read as field paths
+        {"$set": {**{key: {"$literal": value} for key, value in fields.items()}, "content_hash": content_hash}},
+    ]
+
+
+def catalog_pushdown_enabled():
+    """
+    Push filters down to MongoDB only when there is no in-memory snapshot to answer them
+    (CATALOG_CACHE_TTL=0) and the per-product schema with its compound index is in use.
+    """
+    return CATALOG_CACHE_TTL <= 0 and ensure_mongodb() and use_product_items()
+
+
+def query_product_items(category='all', brand='', min_price=None, max_price=None, sort_key=''):
+    """
+    Filter products inside MongoDB using the (category_key, brand_key, price_value) index.
+    Brand matches as a substring of the brand, like the in-memory filters: the matching
+    brand keys are resolved first, so the query itself stays an $in of index range scans.
+    """
+    items_collection = get_product_items_collection()
+    query = {}
+    if category and category != 'all':
+        query["category_key"] = normalize_key(category)
+    if brand:
+        brand = normalize_key(brand)
+        # Products without a brand are served as "Generic Brand" (see normalize_catalog_product)
+        query["brand_key"] = {"$in": [brand_key for brand_key in items_collection.distinct("brand_key", query)
+                                      if brand in (brand_key or "generic brand")]}
+    price_range = {}
+    if min_price is not None:
+        price_range["$gte"] = min_price
+    if max_price is not None:
+        price_range["$lte"] = max_price
+    if price_range:
+        query["price_value"] = price_range
+
+    products = []
+    cursor = items_collection.find(query, {"_id": 0}).sort(PRODUCT_ITEM_SORTS.get(sort_key, PRODUCT_ITEM_SORTS[""]))
+    for item in cursor:
+        product = normalize_catalog_product(item, "")
+        if product:
+            product["category"] = item.get("category_key", "")
+            product["id"] = item.get("product_id", "")
+            products.append(product)
+    return products
+
+
+# -------------------- **Catalog Snapshot Cache** --------------------
+
+# Seconds a loaded catalog snapshot is served before the data source is queried again.
+# CATALOG_CACHE_TTL=0 disables the cache and reloads on every call.
+CATALOG_CACHE_TTL = float(os.getenv('CATALOG_CACHE_TTL', '300'))
+# When a reload comes back empty we keep serving the previous snapshot and retry after this many seconds
+CATALOG_RETRY_INTERVAL = float(os.getenv('CATALOG_RETRY_INTERVAL', '30'))
+# Shared secret for POST /api/catalog/refresh (endpoint is disabled when unset)
+CATALOG_ADMIN_TOKEN = os.getenv('CATALOG_ADMIN_TOKEN', '')
+
+_catalog_lock = threading.Lock()
+_catalog_snapshot = None
+
+
+class CatalogSnapshot:
+    """
+    Immutable, versioned copy of the product catalog shared by every request in the process.
+    The version only moves forward when the catalog content actually changes.
+    Every product carries its category and a stable, content-derived "id".
+    """
+    __slots__ = ('version', 'digest', 'products', 'products_by_id', 'id_aliases', 'loaded_at', 'expires_at',
+                 '_derived', '_builders')
+
+    def __init__(self, version, structured_products, ttl):
+        self.version = version
+
+        products_by_id = {}
+        frozen_categories = {}
+        for category, products in structured_products.items():
+            frozen_products = []
+            for product in products:
+                if isinstance(product, ProductRecord) and product.get("category") == category:
+                    # Carried over unchanged from the previous snapshot (see with_changes)
+                    products_by_id[product["id"]] = product
+                    frozen_products.append(product)
+                    continue
+                # Per-product documents carry their stored _id; other sources derive it from the name
+                product_id = product.get("id") or make_product_id(product.get("name", ""), category)
+                if product_id in products_by_id:
+                    # Same name twice in one category: disambiguate with the rest of the record
+                    product_id = f"{product_id}-{make_content_hash(product)[:6]}"
+                frozen = freeze_product(product, category, product_id)
+                products_by_id[product_id] = frozen
+                frozen_products.append(frozen)
+            if frozen_products:
+                frozen_categories[category] = tuple(frozen_products)
+
+        self.products = MappingProxyType(frozen_categories)
+        self.products_by_id = MappingProxyType(products_by_id)
+        self.digest = compute_catalog_digest(self.products)
+        self.id_aliases = MappingProxyType(build_product_id_aliases(self.products))
+        self.loaded_at = time.time()
+        self.expires_at = self.loaded_at + ttl
+        self._derived = {}
+        self._builders = {}
+
+    def is_fresh(self):
+        return time.time() < self.expires_at
+
+    def product_count(self):
+        return sum(len(products) for products in self.products.values())
+
+    def iter_products(self):
+        """All products in catalog order (category by category)."""
+        for products in self.products.values():
+            yield from products
+
+    def find_product(self, product_id):
+        """O(1) lookup by stable ID, falling back to the legacy ID alias table."""
+        for candidate in (product_id, product_id.lower()):
+            product = self.products_by_id.get(candidate)
+            if product is None and candidate in self.id_aliases:
+                product = self.products_by_id.get(self.id_aliases[candidate])
+            if product is not None:
+                return product
+        return None
+
+    def derived(self, name, builder):
+        """
+        Return an index derived from this snapshot, building it on first use.
+        Derived indexes live and die with the snapshot, so they never go stale.
+        """
+        index = self._derived.get(name)
+        if index is None:
+            self._builders.setdefault(name, builder)
+            index = self._derived.setdefault(name, builder(self))
+        return index
+
+    def with_changes(self, upserts, deleted_ids, ttl):
+        """
+        Next version of the catalog with products upserted ((product ID, category, product dict))
+        and deleted by ID. Unchanged products are carried over as-is; an updated product keeps
+        its place in its category and new ones are appended.
+        """
+        replaced = {}
+        appended = []
+        for product_id, category, product in upserts:
+            if product_id in self.products_by_id and self.products_by_id[product_id]["category"] == category:
+                replaced[product_id] = product
+            else:
+                appended.append((category, product))
+        removed_ids = set(deleted_ids) | {product_id for product_id, _, _ in upserts if product_id not in replaced}
+
+        structured_products = {}
+        for category, products in self.products.items():
+            structured_products[category] = [replaced.get(p["id"], p) for p in products if p["id"] not in removed_ids]
+        for category, product in appended:
+            structured_products.setdefault(category, []).append(product)
+
+        return CatalogSnapshot(self.version + 1, structured_products, ttl)
+
+    def warm_from(self, previous):
+        """
+        Build every derived index the previous snapshot had, before this one is published,
+        so the first requests after a swap don't all race to build them. Indexes that can
+        be updated in place (the price index, the facet counts) are patched instead of rebuilt.
+        """
+        removed = [p for product_id, p in previous.products_by_id.items() if self.products_by_id.get(product_id) is not p]
+        added = [p for product_id, p in self.products_by_id.items() if previous.products_by_id.get(product_id) is not p]
+        for name, builder in list(previous._builders.items()):
+            previous_index = previous._derived.get(name)
+            self._builders[name] = builder
+            if hasattr(previous_index, "updated"):
+                self._derived[name] = previous_index.updated(removed, added)
+            else:
+                self.derived(name, builder)
+
+    def to_structured_products(self):
+        """
+        Return {category: [product, ...]} with fresh lists that callers may reshape freely.
+        The products themselves are the shared read-only records; copy with dict() to annotate.
+        """
+        return {category: list(products) for category, products in self.products.items()}
+
+
+class ProductRecord(dict):
+    """
+    Read-only catalog product. The display fields are the dict items, so a record
+    serializes exactly like any other product dict; the values filters, sorts and
+    search need are normalized once when the snapshot is built.
+    """
+    __slots__ = ('price_value', 'name_lower', 'brand_lower', 'name_tokens', 'slug', 'specs', '_digest')
+
+    def __init__(self, fields):
+        super().__init__(fields)
+        name = str(fields.get("name", ""))
+        self.price_value = parse_price_value(fields.get("price"))
+        self.name_lower = name.lower()
+        self.brand_lower = str(fields.get("brand", "")).lower()
+        self.name_tokens = tuple(self.name_lower.split())
+        self.slug = make_product_slug(name)
+        self.specs = extract_product_specs(fields.get("features"))
+        self._digest = None
+
+    def content_digest(self):
+        """Hash of the record's fields (ID and category included), computed on first use."""
+        if self._digest is None:
+            self._digest = make_content_hash(self)
+        return self._digest
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("catalog products are read-only; copy with dict(product) first")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return (ProductRecord, (dict(self),))
+
+
+def freeze_product(product, category, product_id):
+    """Read-only record for a product dict; features become a tuple so they can't be appended to."""
+    frozen = dict(product)
+    if isinstance(frozen.get("features"), list):
+        frozen["features"] = tuple(frozen["features"])
+    frozen["category"] = category
+    frozen["id"] = product_id
+    return ProductRecord(frozen)
+
+
+# Numeric specs pulled out of feature strings ("16GB RAM", "6.9-inch display", "1TB SSD")
+# so they can be filtered on (/api/products?min_ram_gb=16&max_display_inches=14)
+CATALOG_SPEC_PATTERNS = {
+    "ram_gb": re.compile(r'(\d+(?:\.\d+)?)\s*(gb|tb)\s+(?:of\s+)?(?:unified\s+)?(?:ram|memory|lpddr\w*|ddr\w*|gddr\w*)'),
+    "storage_gb": re.compile(r'(\d+(?:\.\d+)?)\s*(gb|tb)\s+(?:\w+\s+)?(?:ssd|storage|hdd|nvme)'),
+    # Bare "in" only when attached to the number ("6.1in", "6.1-in"), so "2 in 1" or "built-in" never count
+    "display_inches": re.compile(r'(\d+(?:\.\d+)?)(?:\s*-?\s*inch|\s*"|-?in\b)'),
+    "camera_mp": re.compile(r'(\d+(?:\.\d+)?)\s*mp\b'),
+    "refresh_hz": re.compile(r'(\d+)\s*hz\b'),
+}
+
+
+def extract_product_specs(features):
+    """{spec name: number} for every CATALOG_SPEC_PATTERNS entry found in the features (first match wins)."""
+    if isinstance(features, str):
+        features = [features]
+    text = ' | '.join(str(feature) for feature in features or ()).lower()
+    specs = {}
+    for name, pattern in CATALOG_SPEC_PATTERNS.items():
+        match = pattern.search(text)
+        if match:
+            value = float(match.group(1))
+            if match.lastindex and match.lastindex > 1 and match.group(2) == 'tb':
+                value *= 1024
+            specs[name] = value
+    return specs
+
+
+def matches_spec_filters(product, spec_filters):
+    """Whether a record satisfies every {spec: (low, high)} bound; a missing spec never matches."""
+    for name, (low, high) in spec_filters.items():
+        value = product.specs.get(name)
+        if value is None or (low is not None and value < low) or (high is not None and value > high):
+            return False
+    return True
+
+
+def resolve_image_url(image, base_url):
+    """Absolute URL for a product image; relative paths are served from base_url."""
+    if not isinstance(image, str) or image.startswith('http'):
+        return image
+    if image.startswith('/images/'):
+        return f"{base_url}{image}"
+    return f"{base_url}/images/{image}"
+
+
+class ProductView(Mapping):
+    """
+    Per-request, read-only view of a catalog product used for serialization.
+    The image is resolved against the request's host and `fields` projects the keys
+    (always keeping "id") on access, so the shared record is never copied or changed.
+    """
+    __slots__ = ('product', 'image_base', 'visible_keys')
+
+    def __init__(self, product, image_base, fields=None):
+        self.product = product
+        self.image_base = image_base
+        if fields:
+            self.visible_keys = tuple(key for key in dict.fromkeys(['id', *fields]) if key in product)
+        else:
+            self.visible_keys = tuple(product)
+
+    def __getitem__(self, key):
+        if key not in self.visible_keys:
+            raise KeyError(key)
+        value = self.product[key]
+        return resolve_image_url(value, self.image_base) if key == 'image' else value
+
+    def __iter__(self):
+        return iter(self.visible_keys)
+
+    def __len__(self):
+        return len(self.visible_keys)
+
+
+def as_product_record(product):
+    """Catalog records pass through; plain dicts (pushdown results, Gemini output) are normalized once."""
+    return product if isinstance(product, ProductRecord) else ProductRecord(product)
+
+
+def make_product_slug(name):
+    """URL slug used in product IDs, e.g. 'iPhone 16 Pro Max' -> 'iphone-16-pro-max'."""
+    name_slug = re.sub(r'[^a-z0-9]', '-', name.lower())
+    name_slug = name_slug.strip('-')
+    return re.sub(r'-+', '-', name_slug)
+
+
+def make_product_id(name, category):
+    """
+    Stable product ID derived from content rather than catalog position,
+    so links stay valid when products are added, removed or reordered.
+    """
+    return f"{make_product_slug(name)}-{category}"
+
+
+def make_content_hash(product):
+    payload = json.dumps(product, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def build_product_id_aliases(categories):
+    """
+    Map the ID formats already out in the wild onto stable IDs:
+    - positional IDs from older /api/products responses ("3-google-pixel-9-pro")
+    - navbar/home links ("1-iphone-16-pro-max-phone")
+    - chatbot product cards ("1-iphone-16-pro-max")
+    - bare name slugs ("samsung-galaxy-s25-ultra")
+    The first product to claim an alias keeps it.
+    """
+    aliases = {}
+    position = 0
+    for products in categories.values():
+        for product in products:
+            position += 1
+            stable_id = product["id"]
+            name = product.get("name", "")
+            name_slug = product.slug
+            chat_slug = product.name_lower.replace(" ", "-").replace("/", "-")
+
+            aliases.setdefault(f"{position}-{name_slug}", stable_id)
+            for alias in (f"1-{stable_id}", name_slug, f"1-{name_slug}", chat_slug, f"1-{chat_slug}"):
+                aliases.setdefault(alias, stable_id)
+    return aliases
+
+
+# Sort orders accepted by /api/products?sort=
+CATALOG_SORT_KEYS = ("price_asc", "price_desc", "name")
+# Largest page /api/products will return when a limit is requested
+API_PRODUCTS_MAX_LIMIT = int(os.getenv('API_PRODUCTS_MAX_LIMIT', '100'))
+
+
+def parse_price_value(price):
+    """Numeric value of a display price like '$1,299.99'; None when there is no usable number."""
+    if isinstance(price, (int, float)):
+        return float(price)
+    numeric_part = re.sub(r'[^\d.]', '', str(price or ''))
+    try:
+        return float(numeric_part)
+    except ValueError:
+        return None
+
+
+def build_catalog_orderings(snapshot):
+    """
+    Presorted product orderings for every category (plus "all") and sort key,
+    along with each product's position in them for cursor pagination.
+    Products without a usable price sort last in both price orders.
+    """
+    missing = float('inf')
+    categories = dict(snapshot.products)
+    categories['all'] = tuple(snapshot.iter_products())
+
+    orderings = {}
+    for category, products in categories.items():
+        sorted_lists = {
+            "": products,
+            "name": tuple(sorted(products, key=lambda p: p.name_lower)),
+            "price_asc": tuple(sorted(
+                products, key=lambda p: p.price_value if p.price_value is not None else missing)),
+            "price_desc": tuple(sorted(
+                products, key=lambda p: -p.price_value if p.price_value is not None else missing)),
+        }
+        for sort_key, ordered in sorted_lists.items():
+            positions = {product["id"]: i for i, product in enumerate(ordered)}
+            orderings[(category, sort_key)] = (ordered, positions)
+    return orderings
+
+
+def get_catalog_ordering(snapshot, category, sort_key=""):
+    """(products, positions) for a category in the requested order; unknown categories are empty."""
+    orderings = snapshot.derived("orderings", build_catalog_orderings)
+    return orderings.get((category, sort_key), ((), {}))
+
+
+class PriceIndex:
+    """
+    Products sorted by numeric price per category and per (category, brand), so a
+    budget window costs two binary searches plus the matches it returns.
+    Products without a usable price are left out: they never satisfy a budget.
+    """
+
+    def __init__(self, categories):
+        self.keys = {}           # (category, brand or None) -> ascending (price, catalog position)
+        self.entries = {}        # same key -> products, aligned with keys
+        self.brands = {}         # category -> brands present in it
+        self.positions = {}      # (category, product ID) -> catalog position
+        self.next_position = {}  # category -> position given to the next product appended
+        for category, products in categories.items():
+            grouped = {}
+            for position, product in enumerate(products):
+                self.positions[(category, product.get("id", position))] = position
+                if product.price_value is None:
+                    continue
+                entry = ((product.price_value, position), product)
+                grouped.setdefault((category, None), []).append(entry)
+                grouped.setdefault((category, product.brand_lower), []).append(entry)
+            for key, entries in grouped.items():
+                entries.sort(key=lambda entry: entry[0])
+                self.keys[key] = [sort_key for sort_key, _ in entries]
+                self.entries[key] = [product for _, product in entries]
+            self.brands[category] = tuple(brand for _, brand in grouped if brand is not None)
+            self.next_position[category] = len(products)
+
+    def window(self, category, low=None, high=None, brand=None, strict_high=False):
+        """
+        Products priced within [low, high] (or [low, high) with strict_high), in catalog order.
+        brand matches as a substring of the lowercase brand, like the linear filters did.
+        """
+        if brand:
+            keys = [(category, name) for name in self.brands.get(category, ()) if brand in name]
+        else:
+            keys = [(category, None)]
+
+        matches = []
+        for key in keys:
+            sort_keys = self.keys.get(key, [])
+            start = bisect.bisect_left(sort_keys, (low, -1)) if low is not None else 0
+            if high is None:
+                end = len(sort_keys)
+            elif strict_high:
+                end = bisect.bisect_left(sort_keys, (high, -1))
+            else:
+                end = bisect.bisect_right(sort_keys, (high, math.inf))
+            matches.extend(zip(sort_keys[start:end], self.entries[key][start:end]))
+        matches.sort(key=lambda match: match[0][1])
+        return [product for _, product in matches]
+
+    def updated(self, removed, added):
+        """
+        Copy of the index without the `removed` products and with the `added` ones, copying
+        only the lists they touch. An added product replacing a removed one with the same ID
+        keeps its place; new products go to the end of their category (and of "all", which
+        therefore only matches a rebuild as a set until the next full reload).
+        """
+        index = PriceIndex({})
+        index.keys, index.entries = dict(self.keys), dict(self.entries)
+        index.brands, index.positions = dict(self.brands), dict(self.positions)
+        index.next_position = dict(self.next_position)
+        copied = set()
+
+        def writable(key):
+            if key not in copied:
+                index.keys[key] = list(index.keys.get(key, ()))
+                index.entries[key] = list(index.entries.get(key, ()))
+                copied.add(key)
+            return index.keys[key], index.entries[key]
+
+        def indexed_categories(product):
+            # The snapshot's index also lists every product under "all"
+            return [product["category"], "all"] if "all" in self.next_position else [product["category"]]
+
+        freed = {}
+        for product in removed:
+            for category in indexed_categories(product):
+                position = index.positions.pop((category, product["id"]), None)
+                if position is None:
+                    continue
+                freed[(category, product["id"])] = position
+                if product.price_value is None:
+                    continue
+                for key in ((category, None), (category, product.brand_lower)):
+                    sort_keys, entries = writable(key)
+                    i = bisect.bisect_left(sort_keys, (product.price_value, position))
+                    if i < len(entries) and entries[i] is product:
+                        del sort_keys[i], entries[i]
+
+        for product in added:
+            for category in indexed_categories(product):
+                position = freed.pop((category, product["id"]), None)
+                if position is None:
+                    position = index.next_position.get(category, 0)
+                    index.next_position[category] = position + 1
+                index.positions[(category, product["id"])] = position
+                if product.price_value is None:
+                    continue
+                for key in ((category, None), (category, product.brand_lower)):
+                    sort_keys, entries = writable(key)
+                    i = bisect.bisect_left(sort_keys, (product.price_value, position))
+                    sort_keys.insert(i, (product.price_value, position))
+                    entries.insert(i, product)
+
+        for category in {category for category, _ in copied}:
+            index.brands[category] = tuple(brand for (key_category, brand), entries in index.entries.items()
+                                           if key_category == category and brand is not None and entries)
+        return index
+
+
+def build_price_index(snapshot):
+    categories = dict(snapshot.products)
+    categories['all'] = tuple(snapshot.iter_products())
+    return PriceIndex(categories)
+
+
+# Columnar filtering: "auto" uses NumPy once the catalog reaches CATALOG_COLUMNAR_MIN_PRODUCTS
+CATALOG_COLUMNAR = os.getenv('CATALOG_COLUMNAR', 'auto').lower()  # auto | on | off
+CATALOG_COLUMNAR_MIN_PRODUCTS = int(os.getenv('CATALOG_COLUMNAR_MIN_PRODUCTS', '2000'))
+
+
+class CatalogColumns:
+    """
+    Column-oriented copy of a snapshot: one NumPy array per attribute, row i being
+    the i-th product in catalog order. Budget, brand, spec and ID predicates combine
+    as boolean masks, so a filter is a handful of array operations per request
+    instead of a Python loop over every product.
+    """
+
+    def __init__(self, snapshot):
+        self.rows = tuple(snapshot.iter_products())
+        self.row_of = {product["id"]: row for row, product in enumerate(self.rows)}
+        self.category_codes = {category: code for code, category in enumerate(snapshot.products)}
+        self._ordered_rows = {}
+
+        self.brand_names = sorted({product.brand_lower for product in self.rows})
+        brand_codes = {brand: code for code, brand in enumerate(self.brand_names)}
+
+        self.category = np.array([self.category_codes[p["category"]] for p in self.rows], dtype=np.int32)
+        self.brand = np.array([brand_codes[p.brand_lower] for p in self.rows], dtype=np.int32)
+        # Missing numbers are NaN, which fails every comparison and so never matches a bound
+        self.price = np.array([np.nan if p.price_value is None else p.price_value for p in self.rows],
+                              dtype=np.float64)
+        self.specs = {
+            name: np.array([p.specs.get(name, np.nan) for p in self.rows], dtype=np.float64)
+            for name in CATALOG_SPEC_PATTERNS
+        }
+
+    def mask(self, category=None, brand=None, low=None, high=None, spec_filters=None, ids=None):
+        """Boolean row mask for every predicate given; brand matches as a substring."""
+        mask = np.ones(len(self.rows), dtype=bool)
+        if category and category != 'all':
+            mask &= self.category == self.category_codes.get(category, -1)
+        if brand:
+            mask &= np.isin(self.brand, [code for code, name in enumerate(self.brand_names) if brand in name])
+        for column, (column_low, column_high) in [(self.price, (low, high)),
+                                                  *((self.specs[name], bounds)
+                                                    for name, bounds in (spec_filters or {}).items())]:
+            if column_low is not None or column_high is not None:
+                mask &= ~np.isnan(column)
+            if column_low is not None:
+                mask &= column >= column_low
+            if column_high is not None:
+                mask &= column <= column_high
+        if ids is not None:
+            selected = np.zeros(len(self.rows), dtype=bool)
+            selected[[self.row_of[product_id] for product_id in ids if product_id in self.row_of]] = True
+            mask &= selected
+        return mask
+
+    def products(self, mask):
+        """Products passing the mask, in catalog order."""
+        return [self.rows[row] for row in np.flatnonzero(mask)]
+
+    def select(self, ordering_key, ordered, mask):
+        """Products passing the mask, in the order of a presorted ordering (cached by its key)."""
+        rows = self._ordered_rows.get(ordering_key)
+        if rows is None:
+            rows = np.array([self.row_of[p["id"]] for p in ordered], dtype=np.int64)
+            rows = self._ordered_rows.setdefault(ordering_key, rows)
+        return [ordered[i] for i in np.flatnonzero(mask[rows])]
+
+
+def get_catalog_columns(snapshot):
+    """The snapshot's columnar view, or None when NumPy is unavailable or it isn't worth it."""
+    if np is None or CATALOG_COLUMNAR == 'off':
+        return None
+    if CATALOG_COLUMNAR != 'on' and snapshot.product_count() < CATALOG_COLUMNAR_MIN_PRODUCTS:
+        return None
+    return snapshot.derived("columns", CatalogColumns)
+
+
+def parse_catalog_filters(args):
+    """
+    Catalog filters shared by /api/products and /api/facets:
+    category, brand, search, min_price/max_price and min_<spec>/max_<spec> bounds.
+    Raises ValueError for bounds that aren't numbers.
+    """
+    try:
+        min_price = float(args['min_price']) if args.get('min_price') else None
+        max_price = float(args['max_price']) if args.get('max_price') else None
+        # Numeric spec bounds, e.g. min_ram_gb=16&max_display_inches=14
+        spec_filters = {}
+        for name in CATALOG_SPEC_PATTERNS:
+            spec_low = args.get(f'min_{name}')
+            spec_high = args.get(f'max_{name}')
+            if spec_low or spec_high:
+                spec_filters[name] = (float(spec_low) if spec_low else None, float(spec_high) if spec_high else None)
+    except ValueError:
+        raise ValueError("min_*/max_* price and spec bounds must be numbers")
+    return {
+        "category": args.get('category', 'all').lower(),
+        "brand": args.get('brand', '').strip().lower(),
+        "search": args.get('search', '').strip(),
+        "min_price": min_price,
+        "max_price": max_price,
+        "spec_filters": spec_filters,
+    }
+
+
+def select_catalog_products(snapshot, filters, sort_key=""):
+    """
+    Products matching the filters in the requested order, plus each product's
+    position in that order (for cursors). Without a sort, search results
+    follow relevance order.
+    """
+    category, brand, search = filters["category"], filters["brand"], filters["search"]
+    min_price, max_price, spec_filters = filters["min_price"], filters["max_price"], filters["spec_filters"]
+
+    # Presorted ordering for this category (products already carry their category and stable ID)
+    ordered, positions = get_catalog_ordering(snapshot, category, sort_key)
+
+    # Search matches, ranked by relevance
+    ranked_ids = snapshot.derived("search", build_search_index).search(search) if search else None
+
+    columns = get_catalog_columns(snapshot)
+    if columns is not None:
+        # Brand, price, spec and search predicates as one vectorized mask
+        mask = columns.mask(brand=brand, low=min_price, high=max_price,
+                            spec_filters=spec_filters, ids=ranked_ids)
+        result = columns.select((category, sort_key), ordered, mask)
+    else:
+        result = list(ordered)
+
+        # Apply brand filter if specified
+        if brand:
+            result = [p for p in result if brand in p.brand_lower]
+
+        # Apply price filter if specified (products without a usable price are excluded)
+        if min_price is not None or max_price is not None:
+            low = min_price if min_price is not None else float('-inf')
+            high = max_price if max_price is not None else float('inf')
+            result = [p for p in result
+                      if p.price_value is not None and low <= p.price_value <= high]
+
+        # Apply spec filters if specified (products missing the spec are excluded)
+        if spec_filters:
+            result = [p for p in result if matches_spec_filters(p, spec_filters)]
+
+        # Apply search filter if specified
+        if ranked_ids is not None:
+            matched_ids = set(ranked_ids)
+            result = [p for p in result if p['id'] in matched_ids]
+
+    if ranked_ids is not None and not sort_key:
+        # Without an explicit sort, results (and cursors) follow the relevance order,
+        # which is fixed for a given query and catalog version
+        positions = {product_id: rank for rank, product_id in enumerate(ranked_ids)}
+        result.sort(key=lambda p: positions[p['id']])
+    return result, positions
+
+
+# Lower edges of the /api/facets price buckets; the last bucket is open-ended
+FACET_PRICE_BUCKETS = tuple(float(edge) for edge in os.getenv('FACET_PRICE_BUCKETS', '0,250,500,1000,1500,2000').split(','))
+
+
+class FacetCounts:
+    """
+    Counts per category, brand and price bucket for a set of products, plus their price range.
+    Brands are grouped case-insensitively and reported with their first spelling. Products
+    can be counted in and out again, so a new catalog version patches the previous
+    version's counts instead of recounting the whole catalog.
+    """
+
+    def __init__(self, products=()):
+        self.total = 0
+        self.categories = {}  # category -> count
+        self.brands = {}      # lowercase brand -> {spelling: count}, spellings in first-seen order
+        self.buckets = [0] * len(FACET_PRICE_BUCKETS)
+        self.prices = []      # every counted price, sorted, for the price range
+        for product in products:
+            self.count(product)
+        self.prices.sort()
+
+    def count(self, product, step=1):
+        """Count a product in every facet (step=-1 counts it out)."""
+        self.total += step
+        self.count_category(product, step)
+        self.count_brand(product, step)
+        self.count_price(product, step)
+
+    def count_category(self, product, step=1):
+        category = product["category"]
+        count = self.categories.get(category, 0) + step
+        if count:
+            self.categories[category] = count
+        else:
+            del self.categories[category]
+
+    def count_brand(self, product, step=1):
+        spellings = self.brands.setdefault(product.brand_lower, {})
+        spelling = product.get("brand", "")
+        count = spellings.get(spelling, 0) + step
+        if count:
+            spellings[spelling] = count
+        else:
+            del spellings[spelling]
+            if not spellings:
+                del self.brands[product.brand_lower]
+
+    def count_price(self, product, step=1):
+        """Added prices are appended: callers sort self.prices once they are done."""
+        price = product.price_value
+        if price is None:
+            return
+        bucket = bisect.bisect_right(FACET_PRICE_BUCKETS, price) - 1
+        if bucket >= 0:
+            self.buckets[bucket] += step
+        if step > 0:
+            self.prices.append(price)
+        else:
+            del self.prices[bisect.bisect_left(self.prices, price)]
+
+    def updated(self, removed, added):
+        """Copy of the counts without the `removed` products and with the `added` ones."""
+        facets = FacetCounts()
+        facets.total, facets.categories = self.total, dict(self.categories)
+        facets.brands = {brand: dict(spellings) for brand, spellings in self.brands.items()}
+        facets.buckets, facets.prices = list(self.buckets), list(self.prices)
+        for product in removed:
+            facets.count(product, -1)
+        for product in added:
+            facets.count(product)
+        facets.prices.sort()
+        return facets
+
+    def summary(self):
+        def ranked(counts):
+            return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+        brand_counts = {brand: sum(spellings.values()) for brand, spellings in self.brands.items()}
+        return {
+            "categories": [{"value": category, "count": count} for category, count in ranked(self.categories)],
+            "brands": [{"value": next(iter(self.brands[brand])), "count": count} for brand, count in ranked(brand_counts)],
+            "price_buckets": [
+                {"min": edge, "max": FACET_PRICE_BUCKETS[i + 1] if i + 1 < len(FACET_PRICE_BUCKETS) else None, "count": count}
+                for i, (edge, count) in enumerate(zip(FACET_PRICE_BUCKETS, self.buckets))
+            ],
+            "price_range": {"min": self.prices[0] if self.prices else None,
+                            "max": self.prices[-1] if self.prices else None},
+            "total": self.total,
+        }
+
+
+def build_catalog_facets(snapshot):
+    """Unfiltered facet counts; later catalog versions patch them through FacetCounts.updated()."""
+    return FacetCounts(snapshot.iter_products())
+
+
+def count_filtered_facets(snapshot, filters):
+    """
+    Facet counts for a filtered request, each facet ignoring its own filter, in one pass:
+    every product passing the search and spec filters is checked once against the category,
+    brand and price filters, and counts towards each facet whose other filters it passes.
+    """
+    category, brand = filters["category"], filters["brand"]
+    low, high, spec_filters = filters["min_price"], filters["max_price"], filters["spec_filters"]
+    ranked_ids = snapshot.derived("search", build_search_index).search(filters["search"]) if filters["search"] else None
+
+    columns = get_catalog_columns(snapshot)
+    if columns is not None:
+        in_category = columns.mask(category=category)
+        of_brand = columns.mask(brand=brand)
+        in_budget = columns.mask(low=low, high=high)
+        rows = np.flatnonzero(columns.mask(spec_filters=spec_filters, ids=ranked_ids)
+                              & ((in_category & of_brand) | (in_budget & (in_category | of_brand))))
+        candidates = zip((columns.rows[row] for row in rows), in_category[rows], of_brand[rows], in_budget[rows])
+    else:
+        matched_ids = set(ranked_ids) if ranked_ids is not None else None
+        has_budget = low is not None or high is not None
+        low = low if low is not None else float('-inf')
+        high = high if high is not None else float('inf')
+        candidates = (
+            (p, category == 'all' or p["category"] == category, not brand or brand in p.brand_lower,
+             not has_budget or (p.price_value is not None and low <= p.price_value <= high))
+            for p in snapshot.iter_products()
+            if (matched_ids is None or p["id"] in matched_ids) and (not spec_filters or matches_spec_filters(p, spec_filters))
+        )
+
+    facets = FacetCounts()
+    for product, product_in_category, product_of_brand, product_in_budget in candidates:
+        if product_of_brand and product_in_budget:
+            facets.count_category(product)
+        if product_in_category and product_in_budget:
+            facets.count_brand(product)
+        if product_in_category and product_of_brand:
+            facets.count_price(product)
+            if product_in_budget:
+                facets.total += 1
+    facets.prices.sort()
+    return facets
+
+
+class SuggestionIndex:
+    """
+    Type-ahead index over product names and brands.
+
+    Every suffix of every name/brand token is kept in one sorted table, so any
+    substring of a token is a prefix of some entry and can be found with bisect.
+    A lookup only touches the products sharing the query's longest token, then
+    confirms the full query against their name/brand.
+    """
+
+    def __init__(self, products):
+        self.entries = []  # (name_lower, brand_lower, name_tokens, payload)
+        table = []
+        for doc_id, product in enumerate(products):
+            name_lower = product.name_lower
+            brand_lower = product.brand_lower
+            name_tokens = product.name_tokens
+            self.entries.append((name_lower, brand_lower, name_tokens, {
+                'name': product.get('name', ''),
+                'category': product.get('category', ''),
+                'image': product.get('image', '')
+            }))
+            for token in set(name_tokens + tuple(brand_lower.split())):
+                for start in range(len(token)):
+                    table.append((token[start:], doc_id))
+        table.sort()
+        self.keys = [key for key, _ in table]
+        self.doc_ids = [doc_id for _, doc_id in table]
+
+    def candidates(self, token):
+        found = set()
+        i = bisect.bisect_left(self.keys, token)
+        while i < len(self.keys) and self.keys[i].startswith(token):
+            found.add(self.doc_ids[i])
+            i += 1
+        return found
+
+    def lookup(self, query, limit=10):
+        """
+        Products whose name or brand contains the query, ranked:
+        name starts with the query, then a name word starts with it, then anywhere.
+        """
+        query_tokens = query.split()
+        if not query_tokens:
+            return []
+
+        ranked = []
+        for doc_id in self.candidates(max(query_tokens, key=len)):
+            name_lower, brand_lower, name_tokens, payload = self.entries[doc_id]
+            if query not in name_lower and query not in brand_lower:
+                continue
+            if name_lower.startswith(query):
+                rank = 0
+            elif any(token.startswith(query_tokens[0]) for token in name_tokens) and query in name_lower:
+                rank = 1
+            else:
+                rank = 2
+            ranked.append((rank, doc_id))
+
+        return [self.entries[doc_id][3] for _, doc_id in heapq.nsmallest(limit, ranked)]
+
+
+def build_suggestion_index(snapshot):
+    return SuggestionIndex(list(snapshot.iter_products()))
+
+
+# Relative weight of each product field in search scoring
+SEARCH_FIELD_WEIGHTS = {"name": 3.0, "brand": 2.0, "features": 1.0}
+# Score multiplier for a query word that only matches as the prefix of an indexed term
+SEARCH_PREFIX_PENALTY = 0.7
+SEARCH_BM25_K1 = 1.2
+SEARCH_BM25_B = 0.75
+
+# Analyzed documents keyed by the searchable content, reused when the next
+# catalog snapshot is indexed so only new or changed products are re-tokenized
+_search_analysis_cache = {}
+
+
+def tokenize_search_text(text):
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+
+def product_feature_list(product):
+    features = product.get('features', [])
+    return [features] if isinstance(features, str) else list(features)
+
+
+def analyze_search_document(product):
+    """
+    Token sequences per field (kept for phrase matching) and the field-weighted
+    term frequencies used for BM25.
+    """
+    key = (product.get('name', ''), product.get('brand', ''), tuple(product_feature_list(product)))
+    analyzed = _search_analysis_cache.get(key)
+    if analyzed is not None:
+        return key, analyzed
+
+    fields = {
+        "name": tokenize_search_text(key[0]),
+        "brand": tokenize_search_text(key[1]),
+        "features": tokenize_search_text(' '.join(key[2])),
+    }
+    term_weights = {}
+    for field, tokens in fields.items():
+        for token in tokens:
+            term_weights[token] = term_weights.get(token, 0.0) + SEARCH_FIELD_WEIGHTS[field]
+    length = sum(len(tokens) * SEARCH_FIELD_WEIGHTS[field] for field, tokens in fields.items())
+    analyzed = (fields, term_weights, length)
+    return key, analyzed
+
+
+def parse_search_query(search):
+    """Split a query into quoted phrases and loose words: 'oled "pro max"' -> ([['pro', 'max']], ['oled'])."""
+    phrases = []
+    for phrase in re.findall(r'"([^"]*)"', search):
+        tokens = tokenize_search_text(phrase)
+        if len(tokens) > 1:
+            phrases.append(tokens)
+        elif tokens:
+            search += f" {tokens[0]}"
+    words = tokenize_search_text(re.sub(r'"[^"]*"', ' ', search))
+    return phrases, words
+
+
+def contains_phrase(tokens, phrase):
+    width = len(phrase)
+    return any(tokens[i:i + width] == phrase for i in range(len(tokens) - width + 1))
+
+
+class SearchIndex:
+    """
+    Inverted index over product name, brand and feature text with BM25 ranking.
+
+    Every query word must match (exactly, or as the prefix of an indexed term,
+    so "gam" finds "gaming"), and every quoted phrase must appear in order
+    within a single field.
+    """
+
+    def __init__(self, products):
+        global _search_analysis_cache
+
+        self.product_ids = []
+        self.documents = []
+        self.postings = {}
+        analysis_cache = {}
+        for doc_id, product in enumerate(products):
+            key, analyzed = analyze_search_document(product)
+            analysis_cache[key] = analyzed
+            self.product_ids.append(product['id'])
+            self.documents.append(analyzed)
+            for term, weight in analyzed[1].items():
+                self.postings.setdefault(term, {})[doc_id] = weight
+        # Drop analyses of products that left the catalog
+        _search_analysis_cache = analysis_cache
+
+        self.vocabulary = sorted(self.postings)
+        lengths = [analyzed[2] for analyzed in self.documents]
+        self.average_length = (sum(lengths) / len(lengths)) if lengths else 1.0
+
+    def expand(self, word):
+        """Indexed terms matching a query word: the word itself plus terms it is a prefix of."""
+        terms = []
+        i = bisect.bisect_left(self.vocabulary, word)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(word):
+            terms.append(self.vocabulary[i])
+            i += 1
+        return terms
+
+    def idf(self, document_count):
+        return math.log(1 + (len(self.documents) - document_count + 0.5) / (document_count + 0.5))
+
+    def bm25(self, term, doc_id, idf):
+        tf = self.postings[term][doc_id]
+        length_ratio = self.documents[doc_id][2] / self.average_length
+        norm = SEARCH_BM25_K1 * (1 - SEARCH_BM25_B + SEARCH_BM25_B * length_ratio)
+        return idf * tf * (SEARCH_BM25_K1 + 1) / (tf + norm)
+
+    def search(self, search):
+        """Product IDs matching the query, most relevant first."""
+        phrases, words = parse_search_query(search)
+        if not phrases and not words:
+            return []
+
+        scores = None
+        for word in words + [token for phrase in phrases for token in phrase]:
+            terms = self.expand(word)
+            # One IDF for the word across all its expansions, so a prefix that happens to reach
+            # a rare term ("pro" -> "projector") doesn't outrank exact matches of the word
+            idf = self.idf(len(set().union(*(self.postings[term] for term in terms))))
+            word_scores = {}
+            for term in terms:
+                factor = 1.0 if term == word else SEARCH_PREFIX_PENALTY
+                for doc_id in self.postings[term]:
+                    score = self.bm25(term, doc_id, idf) * factor
+                    if score > word_scores.get(doc_id, 0.0):
+                        word_scores[doc_id] = score
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {doc_id: score + word_scores[doc_id] for doc_id, score in scores.items() if doc_id in word_scores}
+            if not scores:
+                return []
+
+        for phrase in phrases:
+            scores = {
+                doc_id: score for doc_id, score in scores.items()
+                if any(contains_phrase(tokens, phrase) for tokens in self.documents[doc_id][0].values())
+            }
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [self.product_ids[doc_id] for doc_id, _ in ranked]
+
+
+def build_search_index(snapshot):
+    return SearchIndex(list(snapshot.iter_products()))
+
+
+def encode_page_cursor(product_id):
+    return base64.urlsafe_b64encode(product_id.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_page_cursor(cursor):
+    padding = '=' * (-len(cursor) % 4)
+    return base64.urlsafe_b64decode(cursor + padding).decode('utf-8')
+
+
+def compute_catalog_digest(categories):
+    """
+    Content hash of a catalog ({category: [product record, ...]}), used to decide whether a
+    reload changed anything. It depends only on the records and their order, so a full
+    reload and an incremental update that end up with the same catalog agree.
+    """
+    digest = hashlib.sha1()
+    for category, products in categories.items():
+        digest.update(json.dumps(category).encode('utf-8'))
+        for product in products:
+            digest.update(product.content_digest().encode('ascii'))
+    return digest.hexdigest()
+
+
+def get_catalog_snapshot():
+    """
+    Return the current catalog snapshot, reloading it from MongoDB/local JSON when the TTL expires.
+    Only one thread reloads at a time; the rest wait for it and reuse the result.
+    """
+    global _catalog_snapshot
+
+    snapshot = _catalog_snapshot
+    if snapshot is not None and snapshot.is_fresh():
+        return snapshot
+
+    with _catalog_lock:
+        # Another thread may have refreshed the snapshot while we were waiting for the lock
+        snapshot = _catalog_snapshot
+        if snapshot is not None and snapshot.is_fresh():
+            return snapshot
+
+        if CATALOG_SHARED_PATH and CATALOG_CACHE_TTL > 0:
+            new_snapshot = load_shared_catalog_snapshot(snapshot)
+        else:
+            new_snapshot = load_catalog_snapshot(snapshot)
+        if new_snapshot is snapshot:
+            return snapshot
+
+        if snapshot is not None:
+            new_snapshot.warm_from(snapshot)
+        _catalog_snapshot = new_snapshot
+        ttl = new_snapshot.expires_at - new_snapshot.loaded_at
+        print(f"📦 Catalog snapshot v{new_snapshot.version} ready ({new_snapshot.product_count()} products, ttl {ttl:.0f}s)")
+
+    if MONGODB_CONNECTED:
+        start_catalog_watcher()
+    return _catalog_snapshot
+
+
+def load_catalog_snapshot(previous):
+    """
+    Load a new snapshot from the data source. If the reload comes back empty the previous
+    snapshot is returned instead, with its expiry pushed back by CATALOG_RETRY_INTERVAL.
+    """
+    structured_products = load_products_from_database()
+
+    if not structured_products and previous is not None:
+        print(f"⚠️ Catalog reload returned no products, keeping snapshot v{previous.version}")
+        previous.expires_at = time.time() + CATALOG_RETRY_INTERVAL
+        return previous
+
+    ttl = CATALOG_CACHE_TTL if structured_products else min(CATALOG_CACHE_TTL, CATALOG_RETRY_INTERVAL)
+    snapshot = CatalogSnapshot(1 if previous is None else previous.version + 1, structured_products, ttl)
+    if previous is not None and previous.digest == snapshot.digest:
+        # Nothing changed: keep the previous snapshot, its version (so ETags) and its derived indexes
+        previous.expires_at = snapshot.expires_at
+        return previous
+    return snapshot
+
+
+def invalidate_catalog_cache():
+    """
+    Force the next catalog read to go back to the data source. With a shared catalog file,
+    a file another worker read from the data source after this call is accepted instead.
+    """
+    global _catalog_invalidated_at
+    snapshot = _catalog_snapshot
+    if snapshot is not None:
+        snapshot.expires_at = 0
+        print(f"🔄 Catalog snapshot v{snapshot.version} invalidated")
+    reset_product_schema_decision()
+    _catalog_invalidated_at = time.time()
+
+
+@app.route('/api/catalog/refresh', methods=['POST'])
+def refresh_catalog():
+    """Invalidate the catalog snapshot and reload it immediately"""
+    if not CATALOG_ADMIN_TOKEN or request.headers.get('X-Admin-Token') != CATALOG_ADMIN_TOKEN:
+        return jsonify({"error": "Forbidden"}), 403
+
+    invalidate_catalog_cache()
+    snapshot = get_catalog_snapshot()
+    return jsonify({
+        "status": "success",
+        "version": snapshot.version,
+        "digest": snapshot.digest,
+        "total_products": snapshot.product_count()
+    })
+
+# -------------------- **Shared Catalog File** --------------------
+# With several worker processes (gunicorn -w N), CATALOG_SHARED_PATH makes one worker load the
+# catalog from the data source and publish it as a file that the others read instead of each
+# querying MongoDB and normalizing every product again. Only the load is shared: every worker
+# decodes the file into its own records and builds its own indexes, so catalog memory still
+# grows with the number of workers.
+# Requires CATALOG_CACHE_TTL > 0; the file is refreshed on the same TTL. Its mtime is the time
+# the catalog was read from the data source.
+CATALOG_SHARED_PATH = os.getenv('CATALOG_SHARED_PATH', '')
+_catalog_invalidated_at = 0.0  # Shared files read from the data source before this are stale
+
+
+class SharedCatalogFile:
+    """A published catalog: {"version", "digest", "categories": {category: [product, ...]}} as JSON."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.written_at = os.fstat(f.fileno()).st_mtime
+            data = f.read()
+        document = orjson.loads(data) if orjson is not None else json.loads(data)
+        self.version = document["version"]
+        self.digest = document["digest"]
+        self.categories = document["categories"]  # Products carry their "id", so the snapshot keeps it
+        self.expires_at = self.written_at + CATALOG_CACHE_TTL
+
+
+def open_shared_catalog(path):
+    """The published catalog file, or None when it is missing or unreadable."""
+    try:
+        return SharedCatalogFile(path)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"⚠️ Ignoring unreadable shared catalog file {path}: {e}")
+        return None
+
+
+def publish_shared_catalog(snapshot, published, loaded_at, path):
+    """
+    Publish a snapshot read from the data source at loaded_at. The file is written under a
+    name keyed by its digest and renamed into place, so readers see the old or the new
+    catalog, never a partial one. If the published file already has this digest, only its
+    timestamp moves forward.
+    """
+    if published is not None and published.digest == snapshot.digest:
+        os.utime(path, (loaded_at, loaded_at))
+        return
+    document = {
+        "version": snapshot.version,
+        "digest": snapshot.digest,
+        "categories": {category: [dict(product) for product in products]
+                       for category, products in snapshot.products.items()},
+    }
+    if orjson is not None:
+        data = orjson.dumps(document, default=str)
+    else:
+        data = json.dumps(document, default=str).encode('utf-8')
+
+    temp_path = f"{path}.{snapshot.digest[:12]}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.utime(temp_path, (loaded_at, loaded_at))
+    os.replace(temp_path, path)
+
+
+@contextlib.contextmanager
+def shared_catalog_lock():
+    """Exclusive lock across worker processes, so only one of them reloads the data source."""
+    if fcntl is None:
+        yield
+        return
+    with open(f"{CATALOG_SHARED_PATH}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_shared_catalog_snapshot(previous):
+    """
+    This worker's own snapshot, built from the shared catalog file. When the file is missing,
+    older than CATALOG_CACHE_TTL or older than this worker's last invalidation, this worker
+    reloads the data source and republishes it first.
+    """
+    with shared_catalog_lock():
+        shared = open_shared_catalog(CATALOG_SHARED_PATH)
+        if shared is None or time.time() >= shared.expires_at or shared.written_at < _catalog_invalidated_at:
+            loaded_at = time.time()
+            snapshot = load_catalog_snapshot(previous)
+            if not snapshot.products:
+                return snapshot
+            try:
+                publish_shared_catalog(snapshot, shared, loaded_at, CATALOG_SHARED_PATH)
+                print(f"📤 Published catalog v{snapshot.version} to {CATALOG_SHARED_PATH}")
+            except OSError as e:
+                print(f"⚠️ Could not publish the shared catalog file: {e}")
+            return snapshot
+
+    if previous is not None and (previous.digest == shared.digest or previous.loaded_at >= shared.written_at):
+        # Already serving this catalog, or a newer one the catalog watcher applied
+        previous.expires_at = shared.expires_at
+        return previous
+
+    version = shared.version if previous is None else max(shared.version, previous.version + 1)
+    snapshot = CatalogSnapshot(version, shared.categories, shared.expires_at - time.time())
+    print(f"📥 Read catalog v{version} from {CATALOG_SHARED_PATH}")
+    return snapshot
+
+
+# -------------------- **Catalog Watcher** --------------------
+# Tails MongoDB for catalog edits and applies them to the snapshot in place of a full reload.
+# "auto" uses change streams where the server supports them (replica sets, Atlas) and
+# polls updatedAt on standalone servers. Off on Vercel, where background threads don't run.
+CATALOG_WATCH = os.getenv('CATALOG_WATCH', 'off' if os.getenv('VERCEL') else 'auto').lower()  # auto | change_stream | poll | off
+CATALOG_POLL_INTERVAL = float(os.getenv('CATALOG_POLL_INTERVAL', '5'))
+# Polls between sweeps for deleted products (updatedAt can't show deletions)
+CATALOG_RECONCILE_EVERY = int(os.getenv('CATALOG_RECONCILE_EVERY', '12'))
+# Polls re-read this many seconds before the watermark: updatedAt is stamped when a write
+# starts, so a slow write can become visible after a newer one was already seen
+CATALOG_POLL_OVERLAP = float(os.getenv('CATALOG_POLL_OVERLAP', '30'))
+# Change events applied together as one new snapshot version
+CATALOG_CHANGE_BATCH = int(os.getenv('CATALOG_CHANGE_BATCH', '500'))
+# Longest wait between retries after watcher errors (the wait doubles from CATALOG_POLL_INTERVAL)
+CATALOG_WATCH_MAX_DELAY = float(os.getenv('CATALOG_WATCH_MAX_DELAY', '300'))
+
+_catalog_watcher = None
+_catalog_watcher_lock = threading.Lock()
+_catalog_watcher_disabled = None  # Why the watcher can't run in this process, once it has found out
+_catalog_apply_lock = threading.Lock()
+
+
+def start_catalog_watcher():
+    """Start the background catalog watcher once per process (no-op when disabled)."""
+    global _catalog_watcher
+    if CATALOG_WATCH == 'off' or CATALOG_CACHE_TTL <= 0 or _catalog_watcher_disabled:
+        return
+    if _catalog_watcher is not None and _catalog_watcher.is_alive():
+        return
+    with _catalog_watcher_lock:
+        if _catalog_watcher is None or not _catalog_watcher.is_alive():
+            _catalog_watcher = threading.Thread(target=catalog_watch_loop, name="catalog-watcher", daemon=True)
+            _catalog_watcher.start()
+
+
+def disable_catalog_watcher(reason):
+    """Stop the watcher for the life of the process; the snapshot TTL keeps the catalog fresh."""
+    global _catalog_watcher_disabled
+    _catalog_watcher_disabled = reason
+    print(f"ℹ️ Catalog watcher off: {reason}; relying on the {CATALOG_CACHE_TTL:.0f}s snapshot TTL")
+
+
+def catalog_watch_loop():
+    """
+    Run the watcher for as long as the process lives. Errors are retried with a doubling
+    wait, and a layout the watcher can't follow is waited out here rather than by
+    restarting the thread from every request.
+    """
+    use_change_streams = CATALOG_WATCH in ('auto', 'change_stream')
+    delay = CATALOG_POLL_INTERVAL
+    waiting_for_layout = False
+    while True:
+        started = time.time()
+        try:
+            if not ensure_mongodb():
+                time.sleep(CATALOG_POLL_INTERVAL)
+                continue
+            per_product = use_product_items()
+            source = get_product_items_collection() if per_product else collection
+            if use_change_streams:
+                try:
+                    watch_catalog_changes(source, per_product)
+                except OperationFailure as e:
+                    if CATALOG_WATCH == 'change_stream':
+                        disable_catalog_watcher(f"change streams unavailable ({e.code})")
+                        return
+                    print(f"ℹ️ Change streams unavailable ({e.code}), polling updatedAt every {CATALOG_POLL_INTERVAL:.0f}s")
+                    use_change_streams = False
+            elif per_product:
+                waiting_for_layout = False
+                poll_catalog_changes(source)
+            else:
+                # Embedded documents carry no updatedAt: the snapshot TTL keeps them fresh until
+                # the catalog is migrated to per-product documents
+                if not waiting_for_layout:
+                    print("ℹ️ Catalog watcher needs change streams for the embedded layout; relying on the TTL")
+                    waiting_for_layout = True
+                time.sleep(max(PRODUCT_SCHEMA_RECHECK, CATALOG_POLL_INTERVAL))
+        except Exception as e:
+            if time.time() - started > delay:
+                delay = CATALOG_POLL_INTERVAL  # It ran for a while before failing: start over
+            print(f"⚠️ Catalog watcher error: {str(e)} (retrying in {delay:.0f}s)")
+            time.sleep(delay)
+            delay = min(delay * 2, max(CATALOG_WATCH_MAX_DELAY, CATALOG_POLL_INTERVAL))
+
+
+def watch_catalog_changes(source, per_product):
+    """Apply change stream events in batches. Category documents are reloaded whole."""
+    with source.watch(full_document='updateLookup', max_await_time_ms=1000) as stream:
+        # Reload once the stream is open, so no edit falls between the snapshot and the stream
+        refresh_catalog_snapshot()
+        print(f"👀 Watching '{source.name}' for catalog changes")
+        while stream.alive:
+            changes = []
+            change = stream.try_next()
+            while change is not None:
+                changes.append(change)
+                if len(changes) >= CATALOG_CHANGE_BATCH:
+                    break
+                change = stream.try_next()
+            if not changes:
+                continue
+            refresh_changed_keys(source, per_product, changes)
+            if not per_product or any(c["operationType"] in ("drop", "rename", "dropDatabase", "invalidate")
+                                      for c in changes):
+                refresh_catalog_snapshot()
+                continue
+            upserted, deleted = {}, set()
+            for change in changes:
+                product_id = change.get("documentKey", {}).get("_id")
+                document = change.get("fullDocument")
+                if document is not None and change["operationType"] in ("insert", "update", "replace"):
+                    upserted[product_id] = document
+                    deleted.discard(product_id)
+                else:
+                    # Deleted (or deleted again before the update could be looked up)
+                    deleted.add(product_id)
+                    upserted.pop(product_id, None)
+            apply_catalog_changes(upserted, deleted)
+
+
+def refresh_changed_keys(source, per_product, changes):
+    """Re-derive the lookup keys of documents edited outside the app (e.g. a product renamed in Atlas)."""
+    changed_ids = [change["documentKey"]["_id"] for change in changes
+                   if change["operationType"] in ("insert", "update", "replace")]
+    if not changed_ids:
+        return
+    scope = {"_id": {"$in": changed_ids}}
+    try:
+        if per_product:
+            refresh_key_fields(source, PRODUCT_ITEM_KEY_FIELDS, scope)
+        else:
+            refresh_catalog_keys(source, scope)
+    except Exception as e:
+        print(f"⚠️ Could not refresh catalog lookup keys: {str(e)}")
+
+
+def poll_catalog_changes(items_collection):
+    """
+    Standalone servers: pick up products whose updatedAt moved, and sweep for deletions now and then.
+    Each poll re-reads CATALOG_POLL_OVERLAP seconds behind the newest updatedAt seen, and skips
+    documents already applied at that same updatedAt.
+    """
+    overlap = timedelta(seconds=CATALOG_POLL_OVERLAP)
+    latest = items_collection.find_one({"updatedAt": {"$ne": None}}, {"updatedAt": 1}, sort=[("updatedAt", -1)])
+    watermark = (latest or {}).get("updatedAt") or datetime(1970, 1, 1)
+    # Everything in the overlap window so far is part of the reload below
+    applied = {document["_id"]: document["updatedAt"]
+               for document in items_collection.find({"updatedAt": {"$gte": watermark - overlap}}, {"updatedAt": 1})}
+    refresh_catalog_snapshot()
+    print(f"👀 Polling '{items_collection.name}' for catalog changes every {CATALOG_POLL_INTERVAL:.0f}s")
+    polls = 0
+    while True:
+        time.sleep(CATALOG_POLL_INTERVAL)
+        polls += 1
+        upserted = {}
+        for document in items_collection.find({"updatedAt": {"$gte": watermark - overlap}},
+                                              {**PRODUCT_ITEM_PROJECTION, "updatedAt": 1}):
+            if applied.get(document["_id"]) == document["updatedAt"]:
+                continue
+            applied[document["_id"]] = document["updatedAt"]
+            upserted[document["_id"]] = document
+            watermark = max(watermark, document["updatedAt"])
+        applied = {product_id: updated_at for product_id, updated_at in applied.items()
+                   if updated_at >= watermark - overlap}
+        deleted = set()
+        snapshot = _catalog_snapshot
+        if CATALOG_RECONCILE_EVERY and polls % CATALOG_RECONCILE_EVERY == 0 and snapshot is not None:
+            # The snapshot is keyed on the stored _id (see load_products_from_items)
+            live_ids = {str(document["_id"]) for document in items_collection.find({}, {"_id": 1})}
+            deleted = set(snapshot.products_by_id) - live_ids
+        if upserted or deleted:
+            apply_catalog_changes(upserted, deleted)
+
+
+def refresh_catalog_snapshot():
+    """
+    Reload the whole catalog now, from the watcher thread rather than a request. With a
+    shared catalog file, one another worker read from the data source after this call counts.
+    """
+    invalidate_catalog_cache()
+    get_catalog_snapshot()
+
+
+def apply_catalog_changes(upserted_items, deleted_ids):
+    """
+    Publish a new snapshot version with per-product documents upserted and products deleted.
+    Derived indexes are patched or rebuilt before the swap, so requests never see them cold.
+    """
+    global _catalog_snapshot
+
+    upserts = []
+    deleted_ids = {str(product_id) for product_id in deleted_ids}
+    for product_id, item in upserted_items.items():
+        product_id = str(product_id)
+        category = normalize_key(item.get("category"))
+        product = normalize_catalog_product(item, "") if category else None
+        if product:
+            product["id"] = product_id
+            upserts.append((product_id, category, product))
+        else:
+            deleted_ids.add(product_id)
+
+    with _catalog_apply_lock:
+        while True:
+            current = _catalog_snapshot
+            if current is None:
+                return None
+            started = time.time()
+            updated = current.with_changes(upserts, deleted_ids, CATALOG_CACHE_TTL)
+            if updated.digest == current.digest:
+                return current  # Already reflected in the snapshot (e.g. a write that changed nothing)
+            updated.warm_from(current)
+            with _catalog_lock:
+                # A TTL reload may have replaced the snapshot meanwhile: apply on top of that one
+                if _catalog_snapshot is current:
+                    _catalog_snapshot = updated
+                    break
+    print(f"🔁 Catalog snapshot v{updated.version}: {len(upserts)} upserted, {len(deleted_ids)} deleted "
+          f"({time.time() - started:.2f}s)")
+    return updated
+
+
+def fetch_products_from_database():
+    """
+    Returns all products grouped by category, served from the in-process catalog snapshot.
+    The lists are fresh; the products are the snapshot's shared read-only records.
+    """
+    return get_catalog_snapshot().to_structured_products()
+
+
+def normalize_catalog_product(sub_prod, image_base):
+    """
+    Shape a raw product (embedded or per-product document, or local JSON) into the
+    {name, price, features, brand, image} record the rest of the app expects.
+    Returns None for products without a name.
+    """
+    product_name = str(sub_prod.get("name", "")).strip()
+    product_price = sub_prod.get("price", "N/A")
+    product_features = sub_prod.get("specifications", [])
+    product_brand = str(sub_prod.get("brand", "")).strip()
+    
+    # Get image directly from database field
+    product_image = sub_prod.get("image", "")
+
+    # Skip products without a name
+    if not product_name:
+        return None
+
+    # Handle missing data
+    if product_price == "N/A" or product_price is None:
+        product_price = "Unknown Price"
+
+    if not product_brand:
+        product_brand = "Generic Brand"
+    
+    # If no image in database, use default image
+    image_url = f"{image_base}/images/{product_image or 'default-product.jpg'}"
+    
+    return {
+        "name": product_name,
+        "price": f"${product_price}" if isinstance(product_price, (int, float)) else product_price,
+        "features": product_features,
+        "brand": product_brand,
+        "image": image_url
+    }
+
+def load_products_from_database():
+    """
+    Fetches all products from MongoDB with fallback to local JSON file.
+    Reads the one-document-per-product collection when it is populated,
+    otherwise the embedded one-document-per-category layout.
+    """
+    # First try MongoDB if connected
+    if ensure_mongodb():
+        try:
+            if use_product_items():
+                print("🔍 Fetching products from MongoDB Atlas (per-product documents)...")
+                structured_products = load_products_from_items(get_product_items_collection())
+            else:
+                print("🔍 Fetching products from MongoDB Atlas...")
+                structured_products = load_products_from_category_documents(collection)
+            
+            if not structured_products:
+                print("⚠️ No documents found in MongoDB, falling back to local data")
+                return fetch_products_from_local()
+
+            # Detailed summary debug
+            product_counts = {cat: len(prods) for cat, prods in structured_products.items()}
+            print(f"📦 Loaded products from MongoDB: {product_counts}")
+            
+            # Extra debug for gaming and audio
+            if 'gaming' in structured_products:
+                print(f"🎮 Gaming products: {[p['name'] for p in structured_products['gaming']]}")
+            if 'audio' in structured_products:
+                print(f"🔊 Audio products: {[p['name'] for p in structured_products['audio']]}")
+            
+            return structured_products
+
+        except Exception as e:
+            print(f"❌ MongoDB Error: {str(e)}")
+            print("🔄 Falling back to local JSON data...")
+            mark_mongodb_unavailable(e)
+            return fetch_products_from_local()
+    else:
+        print("🔄 Using local JSON data (MongoDB not connected)")
+        return fetch_products_from_local()
+
+# Documents fetched per round trip while streaming the catalog out of MongoDB
+CATALOG_LOAD_BATCH_SIZE = int(os.getenv('CATALOG_LOAD_BATCH_SIZE', '200'))
+# Log loading progress every N products
+CATALOG_PROGRESS_EVERY = int(os.getenv('CATALOG_PROGRESS_EVERY', '1000'))
+
+# Only the fields normalize_catalog_product() reads are transferred
+CATALOG_PRODUCT_FIELDS = ("name", "price", "specifications", "brand", "image")
+CATEGORY_DOCUMENT_PROJECTION = {"_id": 0, "category": 1, **{f"products.{field}": 1 for field in CATALOG_PRODUCT_FIELDS}}
+PRODUCT_ITEM_PROJECTION = {"_id": 1, "category": 1, **{field: 1 for field in CATALOG_PRODUCT_FIELDS}}
+
+def load_products_from_category_documents(products_collection):
+    """Embedded layout: one document per category with a `products` array."""
+    documents = products_collection.find({}, CATEGORY_DOCUMENT_PROJECTION).batch_size(CATALOG_LOAD_BATCH_SIZE)
+    return collect_catalog(iter_embedded_products(documents))
+
+def load_products_from_items(items_collection):
+    """Per-product layout: one document per product, kept in catalog order by sort_order."""
+    documents = (items_collection.find({}, PRODUCT_ITEM_PROJECTION)
+                 .sort("sort_order", 1)
+                 .batch_size(CATALOG_LOAD_BATCH_SIZE))
+    # The stored _id becomes the product ID, so watcher changes and deletions match the snapshot
+    return collect_catalog(((item.get("category"), item) for item in documents), id_field="_id")
+
+def iter_embedded_products(documents):
+    """Flatten category documents into (category, raw product) pairs, one document in memory at a time."""
+    for doc in documents:
+        category = doc.get("category", "")
+        products = doc.get("products")
+        if isinstance(products, list):
+            for sub_prod in products:
+                yield category, sub_prod
+
+def iter_normalized_products(raw_products, image_base="", id_field=None):
+    """
+    Normalize (category, raw product) pairs, dropping anything without a category or name.
+    With id_field, the raw product's stored ID is kept as the product's "id".
+    """
+    for category, sub_prod in raw_products:
+        category = normalize_key(category)
+        if not category:
+            continue  # Skip documents with no category
+        product = normalize_catalog_product(sub_prod, image_base)
+        if product:
+            if id_field and sub_prod.get(id_field) is not None:
+                product["id"] = str(sub_prod[id_field])
+            yield category, product
+
+def collect_catalog(raw_products, image_base="", id_field=None):
+    """
+    Sink of the loading pipeline: streams normalized products into {category: [product, ...]}
+    and reports progress, so no intermediate copy of the catalog is ever held.
+    """
+    started = time.time()
+    structured_products = {}
+    count = 0
+    for category, product in iter_normalized_products(raw_products, image_base, id_field):
+        structured_products.setdefault(category, []).append(product)
+        count += 1
+        if CATALOG_PROGRESS_EVERY and count % CATALOG_PROGRESS_EVERY == 0:
+            print(f"⏳ Loaded {count} products ({time.time() - started:.1f}s)")
+    print(f"📋 Streamed {count} products in {len(structured_products)} categories ({time.time() - started:.2f}s)")
+    return structured_products
+
+# -------------------- **Local Catalog Fallback** --------------------
+# Resolved next to this module so the fallback works whatever the working directory is
+LOCAL_PRODUCTS_PATH = os.getenv('LOCAL_PRODUCTS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'products.json'))
+# Parse straight out of a read-only memory map instead of reading the file into a str first
+LOCAL_PRODUCTS_MMAP = os.getenv('LOCAL_PRODUCTS_MMAP', 'true').lower() == 'true'
+
+# Categories the local file does not carry; only added when missing from it
+LOCAL_FALLBACK_PRODUCTS = (
+    ("gaming", {
+        "name": "Sony PlayStation 5 Console",
+        "brand": "Sony",
+        "price": "$499.99",
+        "specifications": [
+            "Custom AMD Zen 2 8-core CPU running at 3.5GHz",
+            "Custom AMD RDNA 2 GPU with 10.28 TFLOPs",
+            "16GB GDDR6 RAM with 448GB/s memory bandwidth",
+            "825GB custom NVMe SSD with 5.5GB/s raw throughput",
+            "Support for 4K gaming at up to 120fps with ray tracing",
+            "Backwards compatibility with PlayStation 4 games",
+            "DualSense wireless controller with haptic feedback"
+        ],
+        "image": "ps5.jpg"
+    }),
+    ("gaming", {
+        "name": "Gaming Headset Stereo Surround Sound Gaming Headphones with Breathing RGB Light",
+        "brand": "OZEINO",
+        "price": "$29.99",
+        "specifications": [
+            "50mm high-precision neodymium drivers for superior sound quality",
+            "Breathing RGB LED lights with 7 color variations",
+            "360-degree adjustable noise-canceling microphone",
+            "3.5mm universal compatibility (PC, PS4, PS5, Xbox One, Nintendo Switch)",
+            "Comfortable memory foam ear cushions for extended gaming sessions",
+            "Professional gaming-grade audio with virtual surround sound"
+        ],
+        "image": "gamingheadphone.jpg"
+    }),
+    ("audio", {
+        "name": "Gaming Headset Pro with RGB Lighting",
+        "brand": "OZEINO",
+        "price": "$49.99",
+        "specifications": [
+            "7.1 Surround Sound for immersive gaming experience",
+            "Dynamic RGB lighting with multiple color modes",
+            "Professional-grade noise canceling microphone",
+            "Ultra-comfortable memory foam padding",
+            "Compatible with PC, PS4, PS5, Xbox, Nintendo Switch",
+            "High-quality 50mm drivers for crystal clear audio"
+        ],
+        "image": "headphone.jpg"
+    }),
+)
+
+_local_catalog_lock = threading.Lock()
+_local_catalog_cache = {"key": None, "products": None}
+
+def read_json_file(path):
+    """Parse a JSON file, using mmap and orjson when available."""
+    with open(path, 'rb') as f:
+        if LOCAL_PRODUCTS_MMAP and os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if orjson is not None:
+                    with memoryview(mapped) as view:
+                        return orjson.loads(view)
+                return json.loads(mapped[:])
+        raw = f.read()
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+def fetch_products_from_local():
+    """
+    Fallback function to load products from local JSON file and add missing categories.
+    The normalized result is cached until the file's mtime or size changes.
+    """
+    try:
+        frontend_base_url = os.getenv('FRONTEND_BASE_URL', 'https://final-year-project-taupe.vercel.app')
+        stat = os.stat(LOCAL_PRODUCTS_PATH)
+        cache_key = (LOCAL_PRODUCTS_PATH, stat.st_mtime_ns, stat.st_size, frontend_base_url)
+
+        with _local_catalog_lock:
+            if _local_catalog_cache["key"] != cache_key:
+                print(f"📁 Loading products from local {LOCAL_PRODUCTS_PATH}...")
+                data = read_json_file(LOCAL_PRODUCTS_PATH)
+
+                # Process existing categories
+                structured_products = collect_catalog(iter_embedded_products(data), frontend_base_url)
+
+                # Add missing gaming and audio products
+                missing = {category for category, _ in LOCAL_FALLBACK_PRODUCTS} - structured_products.keys()
+                for category, product in iter_normalized_products(
+                        ((category, raw) for category, raw in LOCAL_FALLBACK_PRODUCTS if category in missing),
+                        frontend_base_url):
+                    structured_products.setdefault(category, []).append(product)
+
+                _local_catalog_cache["key"] = cache_key
+                _local_catalog_cache["products"] = structured_products
+
+                # Detailed summary
+                product_counts = {cat: len(prods) for cat, prods in structured_products.items()}
+                print(f"📦 Loaded products from local JSON: {product_counts}")
+
+            structured_products = _local_catalog_cache["products"]
+
+        # New lists so callers can't reshape the cached catalog
+        return {category: list(products) for category, products in structured_products.items()}
+
     except Exception as e:
         print(f"❌ Error loading local JSON: {str(e)}")
         return {}
 
-
 def parse_budget_range(budget_string):
     """
     Parse budget ranges using regex patterns rather than hardcoded phrases.
@@ -2436,62 +5115,54 @@ def parse_budget_range(budget_string):
     
     return None, None
 
-def extract_numeric_price(price_string):
-    """
-    Extracts numeric price from a string like '$2399' or '2399' and returns it as an integer.
-    If the price is 'N/A' or non-numeric, returns None.
-    """
-    if not price_string or price_string in ["N/A", "null", ""]:
-        return None  # No price available
-
-    price_match = re.search(r"\d+", str(price_string))  # ✅ Ensure input is a string
-    return int(price_match.group()) if price_match else None
-
-
-
-
-def filter_products_for_gemini(user_data, structured_products):
+def filter_products_for_gemini(user_data, structured_products=None):
     """
     Filters products based on basic criteria, but with more flexibility.
+    Budget windows are answered from a sorted price index: the catalog snapshot's
+    by default, or one built over the structured_products passed in.
     """
-    category = user_data["category"].lower()
     min_budget, max_budget = parse_budget_range(user_data["budget"])
     preferred_brand = user_data["brand"].lower() if user_data["brand"] else None
+    return filter_category_products(user_data["category"].lower(), min_budget, max_budget, preferred_brand,
+                                    structured_products)
 
-    # Get all products from the selected category
-    all_products = structured_products.get(category, [])
+def filter_category_products(category, min_budget=None, max_budget=None, preferred_brand=None,
+                             structured_products=None, snapshot=None):
+    """
+    Category products within the budget and of the preferred brand, relaxing the brand,
+    then the budget (±20%), then returning the whole category when nothing matches.
+    """
+    # Get all products from the selected category (numeric price and lowercase brand precomputed)
+    if structured_products is None:
+        snapshot = snapshot or get_catalog_snapshot()
+        all_products = list(snapshot.products.get(category, ()))
+        columns = get_catalog_columns(snapshot)
+        price_index = snapshot.derived("prices", build_price_index) if columns is None else None
+    else:
+        all_products = [as_product_record(product) for product in structured_products.get(category, [])]
+        columns = None
+        price_index = PriceIndex({category: all_products})
     if not all_products:
         print(f"⚠️ No products found in category '{category}'")
         return []
     
     print(f"📊 Found {len(all_products)} products in category '{category}'")
     
-    # Apply flexible filtering
-    filtered_products = all_products.copy()
+    # Products without a valid price never match once a budget is specified
+    has_budget = bool(min_budget or max_budget)
+    
+    def matching(low, high, brand):
+        """Category products within [low, high] whose brand contains `brand`, in catalog order."""
+        if columns is not None:
+            return columns.products(columns.mask(category=category, brand=brand, low=low, high=high))
+        if low is not None or high is not None:
+            return price_index.window(category, low, high, brand)
+        return [product for product in all_products if not brand or brand in product.brand_lower]
     
     # If we have strict matching criteria but no results, we'll gradually relax constraints
     
     # 1. Try strict filtering first (both budget and brand if specified)
-    strict_filtered = []
-    for product in filtered_products:
-        product_price = extract_numeric_price(product["price"])
-        product_brand = product["brand"].lower()
-        
-        # Skip products without a valid price when budget is specified
-        if (min_budget or max_budget) and not product_price:
-            continue
-            
-        # Budget filtering
-        if min_budget and product_price and product_price < min_budget:
-            continue
-        if max_budget and product_price and product_price > max_budget:
-            continue
-            
-        # Brand filtering
-        if preferred_brand and preferred_brand not in product_brand:
-            continue
-            
-        strict_filtered.append(product)
+    strict_filtered = matching(min_budget or None, max_budget or None, preferred_brand)
     
     # If we have strict matches, return them
     if strict_filtered:
@@ -2500,75 +5171,123 @@ def filter_products_for_gemini(user_data, structured_products):
         
     # 2. If no strict matches, relax brand constraint if specified
     if preferred_brand:
-        brand_relaxed = []
-        for product in filtered_products:
-            product_price = extract_numeric_price(product["price"])
-            
-            # Skip products without a valid price when budget is specified
-            if (min_budget or max_budget) and not product_price:
-                continue
-                
-            # Only apply budget filtering
-            if min_budget and product_price and product_price < min_budget:
-                continue
-            if max_budget and product_price and product_price > max_budget:
-                continue
-                
-            brand_relaxed.append(product)
-            
+        brand_relaxed = matching(min_budget or None, max_budget or None, None)
         if brand_relaxed:
             print(f"✅ Found {len(brand_relaxed)} products after relaxing brand constraint")
             return brand_relaxed
     
     # 3. If still no matches, relax budget slightly (±20%)
-    budget_relaxed = []
-    relaxed_min = min_budget * 0.8 if min_budget else None
-    relaxed_max = max_budget * 1.2 if max_budget else None
-    
-    for product in filtered_products:
-        product_price = extract_numeric_price(product["price"])
-        product_brand = product["brand"].lower()
-        
-        # Skip products without a valid price when budget is specified
-        if (relaxed_min or relaxed_max) and not product_price:
-            continue
-            
-        # Relaxed budget filtering
-        if relaxed_min and product_price and product_price < relaxed_min:
-            continue
-        if relaxed_max and product_price and product_price > relaxed_max:
-            continue
-            
-        # Brand filtering (if still applying)
-        if preferred_brand and preferred_brand not in product_brand:
-            continue
-            
-        budget_relaxed.append(product)
-    
-    if budget_relaxed:
-        print(f"✅ Found {len(budget_relaxed)} products after relaxing budget constraints")
-        return budget_relaxed
+    if has_budget:
+        relaxed_min = min_budget * 0.8 if min_budget else None
+        relaxed_max = max_budget * 1.2 if max_budget else None
+        budget_relaxed = matching(relaxed_min, relaxed_max, preferred_brand)
+        if budget_relaxed:
+            print(f"✅ Found {len(budget_relaxed)} products after relaxing budget constraints")
+            return budget_relaxed
     
     # 4. If still no matches, return all products in the category as fallback
     print(f"ℹ️ No specific matches, returning all {len(all_products)} products in category")
     return all_products
 
-def get_price_number(price_string):
-    """Extract the numeric value from a price string."""
-    if not price_string or not isinstance(price_string, str):
-        return float('inf')  # Return infinity for missing prices
-    
-    print(f"💲 Extracting price from: {price_string}")
-    
-    # Remove currency symbols and any non-numeric characters except decimal point
-    numeric_part = re.sub(r'[^\d.]', '', price_string)
-    try:
-        price = float(numeric_part)
-        print(f"💲 Extracted price: {price}")
-        return price
-    except ValueError:
-        print(f"❌ Failed to extract price from: {price_string}")
-        return float('inf')  # Return infinity for invalid formats
+# Products embedded in a Gemini prompt. Larger categories are narrowed to the best K
+# candidates first, so prompt size no longer grows with the inventory (0 sends everything).
+CHAT_PROMPT_CANDIDATES = int(os.getenv('CHAT_PROMPT_CANDIDATES', '20'))
+BUDGET_CUES = re.compile(r'[$£€]|budget|price|under|below|less than|at most|around|about|between|up to|afford')
+CANDIDATE_IGNORED_TOKENS = {
+    "a", "an", "and", "for", "i", "in", "is", "it", "me", "my", "of", "on", "or", "the", "to",
+    "want", "need", "looking", "something", "with", "what", "show", "some", "good", "best",
+}
+
+def select_prompt_candidates(products, query_data, k=None):
+    """
+    Narrow a category to the K products most worth showing Gemini for this conversation.
+    Products already recommended or mentioned by name are always kept. The rest are scored
+    on budget fit, preferred brand and use-case keywords from the conversation; previously
+    rejected products sink to the bottom. Categories with K products or fewer pass through.
+    """
+    k = CHAT_PROMPT_CANDIDATES if k is None else k
+    if k <= 0 or len(products) <= k:
+        return products
+
+    user_messages = [entry.get("message", "") for entry in query_data.get("conversation_history", [])
+                     if entry.get("role") == "user"]
+    latest = query_data.get("user_message", "")
+    if latest and (not user_messages or user_messages[-1] != latest):
+        user_messages.append(latest)
+    features = query_data.get("features") or []
+    conversation = " ".join([*user_messages, query_data.get("purpose") or "", query_data.get("budget_brand_response") or "",
+                             query_data.get("budget") or "", " ".join(features) if isinstance(features, list) else features]).lower()
+
+    # Budget from the budget answer, else the most recent message that talks about money
+    low = high = None
+    budget_texts = [text for text in (query_data.get("budget"), query_data.get("budget_brand_response")) if text]
+    budget_texts += [text for text in reversed(user_messages) if BUDGET_CUES.search(text.lower())]
+    for text in budget_texts:
+        if any(char.isdigit() for char in text):
+            low, high = parse_budget_range(text)
+            break
+    recommended = [as_product_record(p) for p in query_data.get("recommended_products", []) if isinstance(p, dict)]
+    if "cheaper" in latest.lower() or "too expensive" in latest.lower():
+        recommended_prices = [p.price_value for p in recommended if p.price_value is not None]
+        if recommended_prices:
+            high = max(recommended_prices) * 0.85
+
+    records = [as_product_record(product) for product in products]
+    brands = {product.brand_lower for product in records if product.brand_lower}
+    preferred_brands = {brand for brand in brands if brand in conversation and f"not {brand}" not in conversation}
+    keywords = set(tokenize_search_text(conversation)) - CANDIDATE_IGNORED_TOKENS
+    rejected = {str(name).lower() for name in query_data.get("rejected_products", []) if name}
+    pinned = {p.name_lower for p in recommended}
+    pinned.update(str(name).lower() for name in query_data.get("specifically_mentioned_products", []) if name)
+    if query_data.get("focus_product"):
+        pinned.add(str(query_data["focus_product"]).lower())
+    pinned.update(product.name_lower for product in records if product.name_lower and product.name_lower in conversation)
+
+    def score(product):
+        if product.name_lower in pinned:
+            return math.inf
+        points = 0.0
+        if low is not None or high is not None:
+            price = product.price_value
+            if price is not None and (low is None or price >= low) and (high is None or price <= high):
+                points += 3
+            elif price is not None and (low is None or price >= low * 0.8) and (high is None or price <= high * 1.2):
+                points += 1
+        if product.brand_lower in preferred_brands:
+            points += 2
+        product_tokens = set(product.name_tokens) | set(tokenize_search_text(" ".join(map(str, product_feature_list(product)))))
+        points += len(keywords & product_tokens)
+        if product.name_lower in rejected:
+            points -= 10
+        return points
+
+    # Budget and brand narrow the pool through the snapshot's price index (or columns) first,
+    # so only that pool is scored; the rest only competes when the pool can't fill K
+    rows = range(len(products))
+    category = normalize_key(query_data.get("category"))
+    snapshot = snapshot_for_category(products, category)
+    brand = next(iter(preferred_brands)) if len(preferred_brands) == 1 else None
+    if snapshot is not None and (low is not None or high is not None or brand):
+        matched = {product["id"] for product in filter_category_products(category, low, high, brand, snapshot=snapshot)}
+        pool = [row for row, product in enumerate(records) if product["id"] in matched or product.name_lower in pinned]
+        if len(pool) >= k:
+            rows = pool
+
+    # Best K by score, ties in catalog order
+    scores = {row: score(records[row]) for row in rows}
+    rows = heapq.nlargest(k, rows, key=lambda row: (scores[row], -row))
+    print(f"🎯 Prompt candidates: {len(rows)} of {len(products)} products ({len(scores)} scored)")
+    return [products[row] for row in rows]
+
+def snapshot_for_category(products, category):
+    """The current snapshot if `products` is exactly its `category` (same records, same order), else None."""
+    snapshot = _catalog_snapshot
+    if snapshot is None or not category:
+        return None
+    catalog_products = snapshot.products.get(category, ())
+    if len(catalog_products) != len(products) or not all(map(operator.is_, catalog_products, products)):
+        return None
+    return snapshot
 
 def get_category_specific_follow_up(user_message, product_category=None):
     """Generate category-specific follow-up questions"""
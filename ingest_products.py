@@ -0,0 +1,255 @@
+"""
+Load products into the per-product `product_items` collection from JSON, JSONL or CSV files.
+
+Every product is validated against the catalog product schema and upserted on its stable
+product ID, so re-running an ingest updates products in place instead of duplicating them.
+Input is streamed and written in concurrent bulk_write batches.
+
+Accepted input:
+    .json   a list of products, or a list of category documents ({"category": ..., "products": [...]})
+    .jsonl  one product (or category document) per line
+    .csv    columns name, category, brand, price, specifications, image
+            (specifications separated by "|" or ";")
+A product's category comes from "category" or the legacy "type" field, or from --category.
+
+A database whose catalog is still in the embedded category documents has to go through
+migrate_products.py first: products written to `product_items` before that would not be
+served (or, with PRODUCT_SCHEMA=per_product, would hide the embedded catalog). --force
+writes anyway.
+
+Usage:
+    python ingest_products.py products.json [more files...] [--dry-run] [--force] [--workers 4] [--batch-size 500]
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+from app import (PRODUCT_ITEMS_COLLECTION, build_product_item, ensure_product_item_indexes,
+                 mark_product_items_migrated, parse_price_value, product_item_update, product_items_migrated)
+
+# Fields kept from the input; anything else is reported and dropped
+PRODUCT_FIELDS = ("name", "brand", "price", "specifications", "image")
+MISSING_PRICES = ("", "N/A", "null", None)
+
+
+def read_records(path, file_format=None):
+    """Yield (location, record) pairs from a JSON, JSONL or CSV file ("-" reads JSONL from stdin)."""
+    file_format = file_format or ("jsonl" if path == "-" else os.path.splitext(path)[1].lstrip(".").lower())
+    handle = sys.stdin if path == "-" else open(path, newline="" if file_format == "csv" else None, encoding="utf-8")
+    try:
+        if file_format == "json":
+            data = json.load(handle)
+            for index, record in enumerate(data if isinstance(data, list) else [data]):
+                yield f"{path}[{index}]", record
+        elif file_format == "jsonl":
+            for line_number, line in enumerate(handle, 1):
+                if line.strip():
+                    yield f"{path}:{line_number}", json.loads(line)
+        elif file_format == "csv":
+            for line_number, row in enumerate(csv.DictReader(handle), 2):
+                yield f"{path}:{line_number}", row
+        else:
+            raise ValueError(f"Unsupported input format '{file_format}' for {path}")
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+
+def iter_raw_products(records, default_category=""):
+    """Flatten category documents into (location, category, raw product) triples."""
+    for location, record in records:
+        if isinstance(record, dict) and isinstance(record.get("products"), list):
+            for index, raw_product in enumerate(record["products"]):
+                yield f"{location}.products[{index}]", record.get("category", default_category), raw_product
+        else:
+            category = (record.get("category") or record.get("type") or default_category) if isinstance(record, dict) else ""
+            yield location, category, record
+
+
+def validate_product(raw_product, category):
+    """
+    Clean a raw product into the schema normalize_catalog_product() reads.
+    Returns (product, dropped field names); raises ValueError if it can't be stored.
+    """
+    if not isinstance(raw_product, dict):
+        raise ValueError("product must be an object")
+    if not str(category or "").strip():
+        raise ValueError("missing category")
+    name = raw_product.get("name")
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("missing name")
+
+    price = raw_product.get("price")
+    if isinstance(price, str):
+        price = price.strip()
+        try:
+            # CSV cells arrive as text: store plain numbers as numbers, display prices ("$1,299") as given
+            number = float(price)
+            price = int(number) if number.is_integer() else number
+        except ValueError:
+            pass
+    if price not in MISSING_PRICES and (isinstance(price, bool) or parse_price_value(price) is None):
+        raise ValueError(f"unreadable price {price!r}")
+
+    specifications = raw_product.get("specifications", [])
+    if isinstance(specifications, str):
+        separator = "|" if "|" in specifications else ";" if ";" in specifications else ","
+        specifications = [spec.strip() for spec in specifications.split(separator) if spec.strip()]
+    if not isinstance(specifications, list) or not all(isinstance(spec, str) for spec in specifications):
+        raise ValueError("specifications must be a list of strings")
+
+    for field in ("brand", "image"):
+        if raw_product.get(field) is not None and not isinstance(raw_product[field], str):
+            raise ValueError(f"{field} must be a string")
+
+    product = {
+        "name": name.strip(),
+        "brand": (raw_product.get("brand") or "").strip(),
+        "price": "N/A" if price in MISSING_PRICES else price,
+        "specifications": specifications,
+        "image": (raw_product.get("image") or "").strip(),
+    }
+    dropped = sorted(set(raw_product) - set(PRODUCT_FIELDS) - {"category", "type", "_id"})
+    return product, dropped
+
+
+def check_catalog_layout(db, force=False):
+    """
+    Refuse to write products while the catalog still lives in un-migrated category documents.
+    A database with no catalog yet starts out on the per-product layout.
+    """
+    if product_items_migrated(db):
+        return
+    if db["products"].estimated_document_count() == 0:
+        mark_product_items_migrated(db, products=0)
+        return
+    if force:
+        print(f"⚠️ '{db.name}' has not been migrated; writing to '{PRODUCT_ITEMS_COLLECTION}' anyway (--force)")
+        return
+    raise SystemExit(f"❌ '{db.name}' still keeps its catalog in category documents: run migrate_products.py "
+                     f"first (or pass --force to write to '{PRODUCT_ITEMS_COLLECTION}' anyway)")
+
+
+def ingest(db, sources, batch_size=500, workers=4, dry_run=False, default_category="", strict=False, force=False):
+    """
+    Validate and upsert every product from the sources (iterables of (location, record)).
+    Returns counts for the run: read, invalid, upserted, modified, unchanged and duplicates.
+    """
+    items_collection = db[PRODUCT_ITEMS_COLLECTION]
+    if not dry_run:
+        check_catalog_layout(db, force)
+        ensure_product_item_indexes(items_collection)
+
+    # New products are appended after the existing catalog; existing ones keep their place
+    last = None if dry_run else items_collection.find_one({}, {"sort_order": 1}, sort=[("sort_order", -1)])
+    next_sort_order = (last or {}).get("sort_order") or 0
+
+    stats = {"read": 0, "invalid": 0, "upserted": 0, "modified": 0, "unchanged": 0, "duplicates": 0}
+    stats_lock = threading.Lock()
+    seen_ids = set()
+    started = time.time()
+
+    def write_batch(batch):
+        result = items_collection.bulk_write(batch, ordered=False)
+        with stats_lock:
+            stats["upserted"] += result.upserted_count
+            stats["modified"] += result.modified_count
+            stats["unchanged"] += result.matched_count - result.modified_count
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        pending = []
+        batch = []
+        for source in sources:
+            for location, category, raw_product in iter_raw_products(source, default_category):
+                stats["read"] += 1
+                try:
+                    product, dropped = validate_product(raw_product, category)
+                except ValueError as e:
+                    stats["invalid"] += 1
+                    print(f"❌ {location}: {e}")
+                    if strict:
+                        raise SystemExit(f"❌ Aborting on invalid product ({location})")
+                    continue
+                if dropped:
+                    print(f"⚠️ {location}: ignoring unknown fields {', '.join(dropped)}")
+
+                next_sort_order += 1
+                item = build_product_item(product, category, next_sort_order)
+                if item["_id"] in seen_ids:
+                    stats["duplicates"] += 1
+                    print(f"⚠️ {location}: '{item['name']}' appears more than once; the last copy wins")
+                    # Earlier copies may still be queued or in flight (unordered batches, parallel
+                    # workers): write them out first so this copy really is the last one applied
+                    if not dry_run:
+                        if batch:
+                            pending.append(executor.submit(write_batch, batch))
+                        for future in pending:
+                            future.result()
+                    pending = []
+                    batch = []
+                seen_ids.add(item["_id"])
+                batch.append(UpdateOne({"_id": item["_id"]}, product_item_update(item), upsert=True))
+
+                if len(batch) >= batch_size:
+                    if not dry_run:
+                        pending.append(executor.submit(write_batch, batch))
+                        # Bound the batches in flight so large inputs stay streamed
+                        if len(pending) >= workers * 2:
+                            pending.pop(0).result()
+                    batch = []
+        if batch and not dry_run:
+            pending.append(executor.submit(write_batch, batch))
+        for future in pending:
+            future.result()
+
+    elapsed = max(time.time() - started, 1e-6)
+    valid = stats["read"] - stats["invalid"]
+    target = "" if dry_run else f" into '{PRODUCT_ITEMS_COLLECTION}'"
+    print(f"{'🔍 Validated' if dry_run else '✅ Ingested'} {valid} products{target} "
+          f"in {elapsed:.2f}s ({valid / elapsed:,.0f} products/s)")
+    if not dry_run:
+        print(f"📦 {stats['upserted']} new, {stats['modified']} updated, {stats['unchanged']} unchanged")
+    if stats["invalid"]:
+        print(f"⚠️ {stats['invalid']} invalid products skipped")
+    return stats
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="JSON, JSONL or CSV files ('-' reads JSONL from stdin)")
+    parser.add_argument("--format", choices=("json", "jsonl", "csv"), help="input format (default: from the file extension)")
+    parser.add_argument("--category", default="", help="category for products that don't name one")
+    parser.add_argument("--uri", default=os.getenv("MONGODB_URI"), help="MongoDB connection string (default: $MONGODB_URI)")
+    parser.add_argument("--db", default="ecommerce_db", help="database name")
+    parser.add_argument("--batch-size", type=int, default=500, help="upserts per bulk_write")
+    parser.add_argument("--workers", type=int, default=4, help="bulk_write batches in flight")
+    parser.add_argument("--dry-run", action="store_true", help="validate the input without writing")
+    parser.add_argument("--strict", action="store_true", help="stop at the first invalid product")
+    parser.add_argument("--force", action="store_true", help="write even if the database hasn't been migrated")
+    args = parser.parse_args()
+
+    if not args.uri and not args.dry_run:
+        sys.exit("❌ No MongoDB URI given (use --uri or set MONGODB_URI)")
+
+    client = MongoClient(args.uri or "mongodb://localhost:27017/", serverSelectionTimeoutMS=5000)
+    try:
+        sources = (read_records(path, args.format) for path in args.files)
+        stats = ingest(client[args.db], sources, batch_size=args.batch_size, workers=args.workers,
+                       dry_run=args.dry_run, default_category=args.category, strict=args.strict, force=args.force)
+    finally:
+        client.close()
+    if stats["invalid"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Migrate the catalog from the embedded layout (one MongoDB document per category with a
+`products` array) to one document per product in the `product_items` collection.
+
+Products are upserted on their stable product ID, so the migration can be re-run safely.
+A completed migration leaves a marker in `catalog_meta`; until then the app keeps reading
+the embedded documents (PRODUCT_SCHEMA=auto), or whichever layout PRODUCT_SCHEMA names.
+ingest_products.py refuses to write into a database that still has to be migrated.
+
+Usage:
+    python migrate_products.py [--dry-run] [--prune] [--batch-size 500]
+"""
+import argparse
+import os
+import sys
+
+from dotenv import load_dotenv
+from pymongo import DeleteMany, MongoClient, UpdateOne
+
+from app import (PRODUCT_ITEMS_COLLECTION, build_product_item, ensure_product_item_indexes, make_content_hash,
+                 mark_product_items_migrated, normalize_catalog_product, product_item_update)
+
+
+def iter_product_items(category_collection):
+    """
+    Yield per-product documents in catalog order. A name repeated within a category gets
+    the same content-hash suffix the app gives it, so both products survive with the IDs
+    their links already use.
+    """
+    sort_order = 0
+    seen_ids = set()
+    for doc in category_collection.find({}, {"_id": 0}):
+        category = str(doc.get("category", "")).strip()
+        if not category or not isinstance(doc.get("products"), list):
+            continue
+        for raw_product in doc["products"]:
+            if not str(raw_product.get("name", "")).strip():
+                continue
+            sort_order += 1
+            item = build_product_item(raw_product, category, sort_order)
+            if item["_id"] in seen_ids:
+                product_id = f"{item['_id']}-{make_content_hash(normalize_catalog_product(raw_product, ''))[:6]}"
+                print(f"⚠️ '{item['name']}' appears more than once in '{category}'; migrating it as '{product_id}'")
+                item["_id"] = item["product_id"] = product_id
+            seen_ids.add(item["_id"])
+            yield item
+
+
+def migrate(db, batch_size=500, dry_run=False, prune=False):
+    items_collection = db[PRODUCT_ITEMS_COLLECTION]
+    if not dry_run:
+        ensure_product_item_indexes(items_collection)
+
+    migrated_ids = []
+    batch = []
+    for item in iter_product_items(db["products"]):
+        migrated_ids.append(item["_id"])
+        batch.append(UpdateOne({"_id": item["_id"]}, product_item_update(item, keep_sort_order=False), upsert=True))
+        if len(batch) >= batch_size:
+            if not dry_run:
+                items_collection.bulk_write(batch, ordered=False)
+            batch = []
+    if batch and not dry_run:
+        items_collection.bulk_write(batch, ordered=False)
+
+    print(f"{'🔍 Would migrate' if dry_run else '✅ Migrated'} {len(migrated_ids)} products "
+          f"into '{PRODUCT_ITEMS_COLLECTION}'")
+    if not dry_run:
+        mark_product_items_migrated(db, products=len(migrated_ids))
+
+    if prune:
+        stale = {"_id": {"$nin": migrated_ids}}
+        if dry_run:
+            print(f"🔍 Would remove {items_collection.count_documents(stale)} products no longer in the catalog")
+        else:
+            result = items_collection.bulk_write([DeleteMany(stale)])
+            print(f"🧹 Removed {result.deleted_count} products no longer in the catalog")
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default=os.getenv("MONGODB_URI"), help="MongoDB connection string (default: $MONGODB_URI)")
+    parser.add_argument("--db", default="ecommerce_db", help="database name")
+    parser.add_argument("--batch-size", type=int, default=500, help="upserts per bulk_write")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    parser.add_argument("--prune", action="store_true", help="delete per-product documents missing from the category documents")
+    args = parser.parse_args()
+
+    if not args.uri:
+        sys.exit("❌ No MongoDB URI given (use --uri or set MONGODB_URI)")
+
+    client = MongoClient(args.uri, serverSelectionTimeoutMS=5000)
+    try:
+        migrate(client[args.db], batch_size=args.batch_size, dry_run=args.dry_run, prune=args.prune)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
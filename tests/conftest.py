@@ -0,0 +1,10 @@
+import os
+import sys
+
+# app.py and the CLIs live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Deterministic app configuration: no Atlas, no background watcher threads
+os.environ.pop('MONGODB_URI', None)
+os.environ.setdefault('CATALOG_WATCH', 'off')
+os.environ.setdefault('GEMINI_API_KEY', 'test-key')
@@ -0,0 +1,89 @@
+import base64
+from collections import OrderedDict
+
+import pytest
+
+import app as visiontech
+
+CATALOG = {
+    "laptop": [
+        {"name": f"Laptop {n}", "brand": brand, "price": f"${price}", "features": [], "image": ""}
+        for n, (brand, price) in enumerate([("Apple", 1299), ("Dell", 899), ("HP", 649), ("Apple", 999),
+                                            ("Lenovo", 749), ("Dell", 1099), ("HP", 549)], 1)
+    ],
+    "phone": [{"name": "Pixel 9", "brand": "Google", "price": "$799", "features": [], "image": ""}],
+}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(visiontech, "CATALOG_CACHE_TTL", 3600)
+    monkeypatch.setattr(visiontech, "_catalog_snapshot", visiontech.CatalogSnapshot(1, CATALOG, 3600))
+    monkeypatch.setattr(visiontech, "_catalog_responses", OrderedDict())
+    monkeypatch.setattr(visiontech, "_catalog_responses_bytes", 0)
+    return visiontech.app.test_client()
+
+
+def ids(response):
+    return [product["id"] for product in response.get_json()]
+
+
+def test_cursor_pages_round_trip_to_the_unpaged_result(client):
+    everything = ids(client.get('/api/products?category=laptop&sort=price_asc'))
+
+    pages, cursor = [], None
+    while True:
+        response = client.get('/api/products?category=laptop&sort=price_asc&limit=3'
+                              + (f'&cursor={cursor}' if cursor else ''))
+        assert response.status_code == 200
+        assert response.headers['X-Total-Count'] == "7"
+        pages.append(ids(response))
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            break
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert sum(pages, []) == everything
+    assert visiontech.decode_page_cursor(visiontech.encode_page_cursor("laptop-3-laptop")) == "laptop-3-laptop"
+
+
+def test_cursor_survives_a_catalog_version_change(client):
+    first = client.get('/api/products?category=laptop&sort=price_asc&limit=3')
+    cursor = first.headers['X-Next-Cursor']
+    last_seen = ids(first)[-1]
+
+    # A cheaper laptop lands before the cursor, a pricier one after it
+    visiontech._catalog_snapshot = visiontech._catalog_snapshot.with_changes([
+        ("laptop-8-laptop", "laptop", {"name": "Laptop 8", "brand": "Acer", "price": "$399", "features": [], "image": ""}),
+        ("laptop-9-laptop", "laptop", {"name": "Laptop 9", "brand": "Acer", "price": "$1199", "features": [], "image": ""}),
+    ], set(), 3600)
+    everything = ids(client.get('/api/products?category=laptop&sort=price_asc'))
+
+    second = client.get(f'/api/products?category=laptop&sort=price_asc&limit=3&cursor={cursor}')
+
+    assert second.status_code == 200
+    assert ids(second) == everything[everything.index(last_seen) + 1:][:3]
+    assert "laptop-8-laptop" not in ids(second)
+
+
+def test_cursor_for_a_removed_product_has_expired(client):
+    first = client.get('/api/products?category=laptop&sort=price_asc&limit=3')
+    visiontech._catalog_snapshot = visiontech._catalog_snapshot.with_changes([], {ids(first)[-1]}, 3600)
+
+    response = client.get(f"/api/products?category=laptop&sort=price_asc&limit=3&cursor={first.headers['X-Next-Cursor']}")
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid or expired cursor"}
+
+
+@pytest.mark.parametrize("cursor", [
+    "!!!",
+    base64.urlsafe_b64encode(b"\xff\xfe").decode('ascii'),  # Not UTF-8
+    visiontech.encode_page_cursor("no-such-product"),
+    visiontech.encode_page_cursor("pixel-9-phone"),  # A real product, but not in this listing
+])
+def test_malformed_or_foreign_cursor_is_rejected(client, cursor):
+    response = client.get(f'/api/products?category=laptop&limit=3&cursor={cursor}')
+
+    assert response.status_code == 400
+    assert "cursor" in response.get_json()["error"]
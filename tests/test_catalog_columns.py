@@ -0,0 +1,83 @@
+import itertools
+import random
+
+import pytest
+
+import app as visiontech
+
+pytestmark = pytest.mark.skipif(visiontech.np is None, reason="the columnar path needs NumPy")
+
+BRANDS = ["Dell", "HP", "Apple", "Dell Alienware", "ASUS"]
+FEATURES = ["16GB RAM", "8GB DDR5 RAM", "512GB SSD", "1TB NVMe storage", '15.6" display', "6.1-inch OLED",
+            "48MP camera", "120Hz", "Backlit keyboard"]
+
+
+def random_catalog(seed, size=120):
+    rng = random.Random(seed)
+    catalog = {}
+    for n in range(size):
+        category = rng.choice(["laptop", "phone", "tv"])
+        price = rng.choice([None, "", "Call for price", *(f"${rng.choice([99, 500, 999, 1000, 1500, 2499])}",) * 4])
+        catalog.setdefault(category, []).append({
+            "name": f"{category} {n}", "brand": rng.choice(BRANDS), "price": price,
+            "features": rng.sample(FEATURES, rng.randint(0, 4)), "image": "",
+        })
+    return catalog
+
+
+FILTERS = [
+    {},
+    {"brand": "dell"},
+    {"brand": "alienware", "min_price": 999},
+    {"min_price": 500, "max_price": 1000},
+    {"max_price": 99},
+    {"min_price": 3000},
+    {"spec_filters": {"ram_gb": (16, None)}},
+    {"spec_filters": {"storage_gb": (512, 1024), "display_inches": (None, 15.6)}},
+    {"search": "laptop"},
+    {"search": "phone 1", "brand": "hp"},
+    {"brand": "dell", "min_price": 500, "max_price": 2499, "spec_filters": {"refresh_hz": (120, 120)}},
+]
+
+
+def select(snapshot, monkeypatch, columnar, category, filters, sort_key):
+    monkeypatch.setattr(visiontech, "CATALOG_COLUMNAR", columnar)
+    filters = {"category": category, "brand": "", "search": "", "min_price": None, "max_price": None,
+               "spec_filters": {}, **filters}
+    products, positions = visiontech.select_catalog_products(snapshot, filters, sort_key)
+    return [product["id"] for product in products], [positions[product["id"]] for product in products]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_masks_match_the_python_filters(monkeypatch, seed):
+    snapshot = visiontech.CatalogSnapshot(1, random_catalog(seed), 3600)
+    # Far below CATALOG_COLUMNAR_MIN_PRODUCTS: "on" forces the NumPy path, "off" the loops
+    assert snapshot.product_count() < visiontech.CATALOG_COLUMNAR_MIN_PRODUCTS
+
+    for category, filters, sort_key in itertools.product(["all", "laptop", "phone", "missing"], FILTERS,
+                                                         ["", *visiontech.CATALOG_SORT_KEYS]):
+        expected = select(snapshot, monkeypatch, "off", category, filters, sort_key)
+        assert select(snapshot, monkeypatch, "on", category, filters, sort_key) == expected, (category, filters, sort_key)
+
+
+def test_lowered_threshold_switches_to_columns(monkeypatch):
+    snapshot = visiontech.CatalogSnapshot(1, random_catalog(0), 3600)
+    monkeypatch.setattr(visiontech, "CATALOG_COLUMNAR", "auto")
+
+    assert visiontech.get_catalog_columns(snapshot) is None
+    monkeypatch.setattr(visiontech, "CATALOG_COLUMNAR_MIN_PRODUCTS", snapshot.product_count())
+    assert isinstance(visiontech.get_catalog_columns(snapshot), visiontech.CatalogColumns)
+
+
+@pytest.mark.parametrize("budget, brand", [
+    ((None, None), None), ((500, 1000), None), ((None, 999), "dell"), ((1500, None), "apple"), ((5000, None), "hp"),
+])
+def test_budget_filter_matches_the_price_index(monkeypatch, budget, brand):
+    snapshot = visiontech.CatalogSnapshot(1, random_catalog(1), 3600)
+    results = {}
+    for columnar in ("on", "off"):
+        monkeypatch.setattr(visiontech, "CATALOG_COLUMNAR", columnar)
+        results[columnar] = [p["id"] for p in visiontech.filter_category_products("laptop", *budget, brand,
+                                                                                  snapshot=snapshot)]
+
+    assert results["on"] == results["off"]
@@ -0,0 +1,104 @@
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+import app as visiontech
+
+# The indexes the app creates and the shape of the queries it sends, checked without a server.
+# Whether the planner really picks them is covered by the explain() tests in test_catalog_indexes.py.
+
+
+@pytest.fixture
+def database(monkeypatch):
+    # mongomock can't run the $trim/$expr pipeline updates that derive the key fields
+    monkeypatch.setattr(visiontech, "refresh_catalog_keys", lambda collection, scope=None: 0)
+    return mongomock.MongoClient()["ecommerce_db"]
+
+
+def index_keys(collection):
+    return sorted(tuple(spec["key"]) for name, spec in collection.index_information().items() if name != "_id_")
+
+
+def test_category_document_indexes(database):
+    visiontech.ensure_catalog_indexes(database["products"])
+    visiontech.ensure_catalog_indexes(database["products"])  # Safe to run on every startup
+
+    assert index_keys(database["products"]) == [(("category_key", 1),), (("products.name_key", 1),)]
+
+
+def test_product_item_indexes(database):
+    items = database[visiontech.PRODUCT_ITEMS_COLLECTION]
+    visiontech.ensure_product_item_indexes(items)
+
+    assert index_keys(items) == [
+        (("category_key", 1), ("brand_key", 1), ("price_value", 1)),
+        (("category_key", 1), ("price_value", 1)),
+        (("name_key", 1),),
+        (("sort_order", 1),),
+        (("updatedAt", 1),),
+    ]
+
+
+def served_by_index(indexes, query):
+    """Equality fields first, then at most one range field, as a prefix of some index (ESR order)."""
+    equality = {field for field, condition in query.items() if not isinstance(condition, dict) or "$in" in condition}
+    ranges = [field for field in query if field not in equality]
+    for keys in indexes:
+        fields = [field for field, _ in keys]
+        if set(fields[:len(equality)]) == equality and fields[len(equality):len(equality) + len(ranges)] == ranges:
+            return True
+    return False
+
+
+def test_category_and_name_lookups_match_their_indexes(database):
+    products = database["products"]
+    visiontech.ensure_catalog_indexes(products)
+    indexes = index_keys(products)
+
+    assert served_by_index(indexes, visiontech.category_key_query("Laptops"))
+    assert served_by_index(indexes, visiontech.product_name_prefix_query("iPhone 16"))
+    # Anchored prefix on the lowercase key: a bounded scan, not a full-index regex
+    assert visiontech.product_name_prefix_query("iPhone 16") == {"products.name_key": {"$regex": "^iphone\\ 16"}}
+
+
+def test_lookup_queries_match_the_right_documents(database):
+    products = database["products"]
+    products.insert_many([
+        {"category": "Laptops", "category_key": "laptops", "products": [{"name": "XPS 13", "name_key": "xps 13"}]},
+        {"category": "Phone", "category_key": "phone", "products": [
+            {"name": "C++ Phone (2nd gen)", "name_key": "c++ phone (2nd gen)"},
+            {"name": "Cx Phone", "name_key": "cx phone"},
+        ]},
+    ])
+
+    assert products.find_one(visiontech.category_key_query("laptop"))["category"] == "Laptops"
+    assert products.find_one(visiontech.category_key_query(" PHONE "))["category"] == "Phone"
+    # Regex metacharacters in the name are matched literally
+    assert products.count_documents(visiontech.product_name_prefix_query("C++ Phone (2")) == 1
+    assert products.count_documents(visiontech.product_name_prefix_query("C.")) == 0
+
+
+@pytest.mark.parametrize("filters", [
+    {"category": "laptop"},
+    {"category": "laptop", "brand": "dell"},
+    {"category": "laptop", "min_price": 500},
+    {"category": "laptop", "brand": "dell", "min_price": 500, "max_price": 1500},
+    {"category": "laptop", "brand": "dell", "sort_key": "price_asc"},
+])
+def test_pushdown_queries_match_the_compound_indexes(database, monkeypatch, filters):
+    items = database[visiontech.PRODUCT_ITEMS_COLLECTION]
+    visiontech.ensure_product_item_indexes(items)
+    for n, (brand, price) in enumerate([("Dell", 999), ("Dell", 1799), ("HP", 649)]):
+        items.insert_one(visiontech.build_product_item({"name": f"Laptop {n}", "brand": brand, "price": price},
+                                                       "laptop", n))
+    queries = []
+    find = items.find
+    monkeypatch.setattr(items, "find", lambda query, *args, **kwargs: queries.append(query) or find(query, *args, **kwargs))
+    monkeypatch.setattr(visiontech, "get_product_items_collection", lambda: items)
+
+    products = visiontech.query_product_items(**filters)
+
+    assert served_by_index(index_keys(items), queries[0])
+    low, high = filters.get("min_price", 0), filters.get("max_price", float("inf"))
+    assert all(low <= visiontech.parse_price_value(p["price"]) <= high for p in products)
+    assert products and all(filters.get("brand", "") in p["brand"].lower() for p in products)
@@ -0,0 +1,104 @@
+import os
+import uuid
+
+import pytest
+
+pymongo = pytest.importorskip("pymongo")
+
+import app as visiontech
+
+# explain() plans only mean something on a real server (mongomock has no query planner)
+TEST_MONGODB_URI = os.getenv('TEST_MONGODB_URI')
+pytestmark = pytest.mark.skipif(not TEST_MONGODB_URI, reason="set TEST_MONGODB_URI to a disposable mongod")
+
+
+@pytest.fixture
+def database():
+    client = pymongo.MongoClient(TEST_MONGODB_URI, serverSelectionTimeoutMS=2000)
+    db = client[f"visiontech_test_{uuid.uuid4().hex[:8]}"]
+    yield db
+    client.drop_database(db.name)
+    client.close()
+
+
+@pytest.fixture
+def products_collection(database):
+    products = database["products"]
+    products.insert_many([
+        {"category": f"Category {i}", "products": [{"name": f"Product {i}-{j}", "price": 100 + j} for j in range(5)]}
+        for i in range(200)
+    ])
+    visiontech.ensure_catalog_indexes(products)
+    return products
+
+
+def explain(cursor):
+    explained = cursor.explain()
+    plan = explained["queryPlanner"]["winningPlan"]
+    # Slot-based execution (MongoDB 7+) nests the classic plan under queryPlan
+    return visiontech.describe_plan_stages(plan.get("queryPlan", plan)), explained["executionStats"]
+
+
+def test_category_lookup_uses_category_key_index(products_collection):
+    stages, stats = explain(products_collection.find(visiontech.category_key_query("category 42")).limit(1))
+
+    assert "IXSCAN" in stages
+    assert "COLLSCAN" not in stages
+    assert stats["totalDocsExamined"] == 1
+
+
+def test_product_name_prefix_is_a_bounded_index_scan(products_collection):
+    stages, stats = explain(products_collection.find(visiontech.product_name_prefix_query("Product 42-")))
+
+    assert "IXSCAN" in stages
+    assert "COLLSCAN" not in stages
+    # Only the five matching name keys (plus the end-of-range probe) are read out of the 1000
+    assert stats["totalKeysExamined"] <= 6
+    assert stats["nReturned"] == 1
+
+
+def test_prefix_query_escapes_regex_metacharacters(products_collection):
+    products_collection.insert_one({"category": "Special", "products": [{"name": "C++ (2024) Edition"}]})
+    visiontech.ensure_catalog_indexes(products_collection)
+
+    stages, stats = explain(products_collection.find(visiontech.product_name_prefix_query("c++ (2024")))
+
+    assert "IXSCAN" in stages
+    assert stats["nReturned"] == 1
+
+
+def test_renamed_products_get_fresh_keys(products_collection):
+    products_collection.update_one({"category": "Category 7"},
+                                   {"$set": {"category": "Tablets", "products.0.name": "Galaxy Tab S10"}})
+
+    assert visiontech.refresh_catalog_keys(products_collection) == 1
+    assert products_collection.find_one(visiontech.category_key_query("tablet"))["category"] == "Tablets"
+    assert products_collection.find_one(visiontech.category_key_query("category 7")) is None
+    assert products_collection.find_one(visiontech.product_name_prefix_query("galaxy tab")) is not None
+    assert products_collection.find_one(visiontech.product_name_prefix_query("product 7-0")) is None
+    # Nothing is stale any more
+    assert visiontech.refresh_catalog_keys(products_collection) == 0
+
+
+def test_product_item_keys_follow_their_source_fields(database):
+    items = database[visiontech.PRODUCT_ITEMS_COLLECTION]
+    item = visiontech.build_product_item({"name": "Pixel 9", "brand": "Google", "price": 799}, "phone", 0)
+    items.insert_one(item)
+    visiontech.ensure_product_item_indexes(items)
+    items.update_one({"_id": item["_id"]}, {"$set": {"name": " Pixel 9 Pro ", "brand": "GOOGLE LLC"}})
+
+    assert visiontech.refresh_key_fields(items, visiontech.PRODUCT_ITEM_KEY_FIELDS) == 1
+
+    refreshed = items.find_one({"_id": item["_id"]})
+    assert (refreshed["name_key"], refreshed["brand_key"], refreshed["category_key"]) == ("pixel 9 pro", "google llc", "phone")
+    stages, _ = explain(items.find({"name_key": "pixel 9 pro"}))
+    assert "IXSCAN" in stages
+
+
+def test_category_endpoint_reads_through_the_index(products_collection, monkeypatch):
+    monkeypatch.setattr(visiontech, "get_mongo_collection", lambda: products_collection)
+
+    response = visiontech.app.test_client().get('/products/Category 3')
+
+    assert response.status_code == 200
+    assert "Product 3-0 - Price: $100" in response.get_json()["reply"]
@@ -0,0 +1,120 @@
+import os
+from collections import OrderedDict
+
+import pytest
+
+import app as visiontech
+
+
+@pytest.fixture
+def response_cache(monkeypatch):
+    monkeypatch.setattr(visiontech, "_catalog_responses", OrderedDict())
+    monkeypatch.setattr(visiontech, "_catalog_responses_bytes", 0)
+    monkeypatch.setattr(visiontech, "CATALOG_RESPONSE_CACHE_SIZE", 100)
+    monkeypatch.setattr(visiontech, "CATALOG_RESPONSE_CACHE_BYTES", 10_000)
+    monkeypatch.setattr(visiontech, "CATALOG_RESPONSE_CACHE_MAX_BODY", 4_000)
+    return visiontech._catalog_responses
+
+
+def cache(etag, size):
+    return visiontech.cache_catalog_response(etag, visiontech.app.response_class(b"x" * size))
+
+
+def test_byte_budget_evicts_least_recently_used(response_cache):
+    for etag in ("a", "b", "c"):
+        cache(etag, 3_000)
+    visiontech.cached_catalog_response("a")
+
+    cache("d", 3_000)
+
+    assert list(response_cache) == ["c", "a", "d"]
+    assert visiontech._catalog_responses_bytes == 9_000
+
+
+def test_bodies_over_the_size_limit_are_not_cached(response_cache):
+    assert cache("big", 4_001) is None
+    assert cache("small", 4_000) is not None
+    assert list(response_cache) == ["small"]
+
+
+def test_compressed_copies_count_against_the_budget(response_cache):
+    entry = cache("a", 2_000)
+    body = os.urandom(3_000)  # Incompressible, so the gzip copy is about as large as the body
+    other = visiontech.cache_catalog_response("b", visiontech.app.response_class(body))
+
+    compressed = visiontech.add_compressed_body("b", other, "gzip")
+
+    assert visiontech._catalog_responses_bytes == 5_000 + len(compressed)
+    cache("c", 4_000)
+    assert "a" not in response_cache and entry is not None
+    assert visiontech._catalog_responses_bytes == sum(map(visiontech.cached_response_size, response_cache.values()))
+
+
+CATALOG = {
+    "laptop": [{"name": "MacBook Air 13", "brand": "Apple", "price": "$1099", "features": ["16GB RAM"], "image": ""},
+               {"name": "XPS 13", "brand": "Dell", "price": "$999", "features": ["16GB RAM"], "image": ""}],
+}
+
+
+@pytest.fixture
+def client(monkeypatch, response_cache):
+    monkeypatch.setattr(visiontech, "CATALOG_CACHE_TTL", 3600)
+    monkeypatch.setattr(visiontech, "_catalog_snapshot", visiontech.CatalogSnapshot(1, CATALOG, 3600))
+    return visiontech.app.test_client()
+
+
+@pytest.mark.parametrize("if_none_match, matches", [
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"xyz", W/"abc"', True),
+    ('"abc-gzip"', True),  # A compressed representation of the same body
+    ('*', True),
+    ('"xyz"', False),
+    ('"ab"', False),
+    ('W/"abcd", "abc-deflate"', False),
+])
+def test_if_none_match_comparison(if_none_match, matches):
+    assert visiontech.etag_matches('"abc"', if_none_match) is matches
+
+
+def test_conditional_get_answers_304_without_a_body(client):
+    first = client.get('/api/facets?category=laptop')
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and etag.startswith('"')
+
+    for if_none_match in (etag, f'W/{etag}', f'"stale", {etag}'):
+        response = client.get('/api/facets?category=laptop', headers={'If-None-Match': if_none_match})
+        assert response.status_code == 304, if_none_match
+        assert response.data == b""
+        assert response.headers['ETag'] == etag
+        assert response.headers['Cache-Control'] == visiontech.CATALOG_CACHE_CONTROL['facets']
+
+    assert client.get('/api/facets?category=laptop', headers={'If-None-Match': '"stale"'}).status_code == 200
+
+
+def test_etag_changes_with_the_catalog(client):
+    etag = client.get('/api/products?category=laptop').headers['ETag']
+    visiontech._catalog_snapshot = visiontech._catalog_snapshot.with_changes([], {"xps-13-laptop"}, 3600)
+
+    response = client.get('/api/products?category=laptop', headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_conditional_get_without_a_snapshot_ttl(monkeypatch, client):
+    catalog = {"laptop": list(CATALOG["laptop"])}
+    monkeypatch.setattr(visiontech, "CATALOG_CACHE_TTL", 0)
+    monkeypatch.setattr(visiontech, "_catalog_snapshot", None)
+    monkeypatch.setattr(visiontech, "ensure_mongodb", lambda: False)
+    monkeypatch.setattr(visiontech, "load_products_from_database", lambda: catalog)
+
+    first = client.get('/api/products?category=laptop')
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and len(first.get_json()) == 2
+    assert client.get('/api/products?category=laptop', headers={'If-None-Match': etag}).status_code == 304
+
+    catalog["laptop"] = catalog["laptop"][:1]
+    response = client.get('/api/products?category=laptop', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and len(response.get_json()) == 1
+    assert response.headers['ETag'] != etag
@@ -0,0 +1,95 @@
+import pytest
+from pymongo.errors import OperationFailure
+
+mongomock = pytest.importorskip("mongomock")
+
+import app as visiontech
+import ingest_products
+
+PHONES = [
+    {"category": "phone", "name": "iPhone 16 Pro", "brand": "Apple", "price": 999, "specifications": ["6.3-inch display"]},
+    {"category": "phone", "name": "Galaxy S24", "brand": "Samsung", "price": 799, "specifications": ["6.2-inch display"]},
+    {"category": "tv", "name": "Bravia 65", "brand": "Sony", "price": 1499, "specifications": []},
+]
+
+
+@pytest.fixture
+def items(monkeypatch):
+    db = mongomock.MongoClient()["ecommerce_db"]
+    ingest_products.ingest(db, [[(f"phones[{i}]", product) for i, product in enumerate(PHONES)]])
+    items = db[visiontech.PRODUCT_ITEMS_COLLECTION]
+    monkeypatch.setattr(visiontech, "load_products_from_database", lambda: visiontech.load_products_from_items(items))
+    monkeypatch.setattr(visiontech, "CATALOG_SHARED_PATH", "")
+    return items
+
+
+def test_reload_of_unchanged_catalog_keeps_version_and_digest(items):
+    first = visiontech.load_catalog_snapshot(None)
+
+    assert visiontech.load_catalog_snapshot(first) is first
+
+    items.update_one({"_id": "galaxy-s24-phone"}, {"$set": {"price": 749, "price_value": 749.0}})
+    changed = visiontech.load_catalog_snapshot(first)
+    assert (changed.version, changed.find_product("galaxy-s24-phone")["price"]) == (2, "$749")
+    assert changed.digest != first.digest
+
+
+def test_incremental_update_and_full_reload_agree_on_digest(items):
+    snapshot = visiontech.load_catalog_snapshot(None)
+    items.update_one({"_id": "galaxy-s24-phone"}, {"$set": {"price": 749, "price_value": 749.0}})
+
+    patched = snapshot.with_changes([("galaxy-s24-phone", "phone", {
+        **visiontech.normalize_catalog_product(items.find_one({"_id": "galaxy-s24-phone"}), ""),
+        "id": "galaxy-s24-phone"})], set(), 60)
+
+    assert visiontech.load_catalog_snapshot(patched) is patched
+
+
+def test_snapshot_is_keyed_on_the_stored_id(items, monkeypatch):
+    # A migrated duplicate name keeps the suffixed _id it was stored under
+    items.insert_one({"_id": "galaxy-s24-phone-1a2b3c", "category": "phone", "name": "Galaxy S24",
+                      "brand": "Samsung", "price": 699, "specifications": ["Refurbished"], "sort_order": 99})
+    snapshot = visiontech.load_catalog_snapshot(None)
+    assert set(snapshot.products_by_id) == {str(item["_id"]) for item in items.find({}, {"_id": 1})}
+
+    monkeypatch.setattr(visiontech, "_catalog_snapshot", snapshot)
+    items.update_one({"_id": "galaxy-s24-phone-1a2b3c"}, {"$set": {"price": 649}})
+    updated = visiontech.apply_catalog_changes({"galaxy-s24-phone-1a2b3c": items.find_one({"_id": "galaxy-s24-phone-1a2b3c"})},
+                                               {"bravia-65-tv"})
+
+    assert [p["price"] for p in updated.products["phone"]] == ["$999", "$799", "$649"]
+    assert "tv" not in updated.products
+    assert updated.product_count() == 3
+
+
+def test_applying_a_change_already_in_the_snapshot_publishes_nothing(items, monkeypatch):
+    snapshot = visiontech.load_catalog_snapshot(None)
+    monkeypatch.setattr(visiontech, "_catalog_snapshot", snapshot)
+
+    assert visiontech.apply_catalog_changes({"galaxy-s24-phone": items.find_one({"_id": "galaxy-s24-phone"})}, set()) is snapshot
+    assert visiontech._catalog_snapshot is snapshot
+
+
+def test_watcher_stays_off_once_change_streams_are_unavailable(monkeypatch):
+    attempts = []
+
+    def watch_catalog_changes(source, per_product):
+        attempts.append(source)
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", code=40573)
+
+    monkeypatch.setattr(visiontech, "CATALOG_WATCH", "change_stream")
+    monkeypatch.setattr(visiontech, "CATALOG_CACHE_TTL", 60)
+    monkeypatch.setattr(visiontech, "_catalog_watcher", None)
+    monkeypatch.setattr(visiontech, "_catalog_watcher_disabled", None)
+    monkeypatch.setattr(visiontech, "ensure_mongodb", lambda: True)
+    monkeypatch.setattr(visiontech, "use_product_items", lambda: True)
+    monkeypatch.setattr(visiontech, "get_product_items_collection", lambda: "product_items")
+    monkeypatch.setattr(visiontech, "watch_catalog_changes", watch_catalog_changes)
+
+    visiontech.catalog_watch_loop()
+    for _ in range(3):
+        visiontech.start_catalog_watcher()
+
+    assert attempts == ["product_items"]
+    assert "40573" in visiontech._catalog_watcher_disabled
+    assert visiontech._catalog_watcher is None
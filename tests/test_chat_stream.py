@@ -0,0 +1,125 @@
+import json
+import threading
+
+import pytest
+
+import app as visiontech
+
+REPLY = ('```json\n{"response_type": "recommendation", "message": "Try the **MacBook Air 13** \\ud83d\\ude80, '
+         'it is *light*.", "recommended_products": [{"name": "MacBook Air 13", "price": "$1099", '
+         '"features": ["16GB RAM"], "image": "macbook_air.jpg"}]}\n```')
+CATALOG = {"laptop": [{"name": "MacBook Air 13", "brand": "Apple", "price": "$1099", "features": ["16GB RAM"],
+                       "image": "macbook_air.jpg"}]}
+
+
+class FakeStreamResponse:
+    """streamGenerateContent answered as SSE, a few characters per event."""
+    status_code = 200
+    text = ""
+
+    def __init__(self, session):
+        self.session = session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.session.closed += 1
+
+    def iter_lines(self, decode_unicode=False):
+        for i in range(0, len(REPLY), 5):
+            self.session.lines_read += 1
+            yield "data: " + json.dumps({"candidates": [{"content": {"parts": [{"text": REPLY[i:i + 5]}]}}]})
+            yield ""
+            if self.session.lines_read == self.session.pause_after:
+                self.session.resume.wait(5)
+
+
+class FakeGeminiSession:
+    def __init__(self):
+        self.urls = []
+        self.lines_read = 0
+        self.closed = 0
+        self.pause_after = None  # Lines sent before the model "stalls" until resume is set
+        self.resume = threading.Event()
+
+    def post(self, url, json=None, timeout=None, stream=False):
+        self.urls.append(url)
+        assert stream and "streamGenerateContent" in url
+        return FakeStreamResponse(self)
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    session = FakeGeminiSession()
+    monkeypatch.setattr(visiontech, "get_gemini_session", lambda: session)
+    monkeypatch.setattr(visiontech, "gemini_response_cache", visiontech.GeminiResponseCache(0, 0))
+    monkeypatch.setattr(visiontech, "CATALOG_CACHE_TTL", 3600)
+    monkeypatch.setattr(visiontech, "_catalog_snapshot", visiontech.CatalogSnapshot(1, CATALOG, 3600))
+    return session
+
+
+def parse_events(body):
+    events = []
+    for block in body.split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n") if ": " in line and not line.startswith(":"))
+        if "event" in fields:
+            events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_deltas_preview_the_reply_done_sends(gemini):
+    response = visiontech.app.test_client().post('/chat/stream', json={"message": "laptop", "new_chat": True})
+
+    assert response.status_code == 200
+    events = parse_events(response.get_data(as_text=True))
+    kinds = [kind for kind, _ in events]
+    assert kinds[-3:] == ["products", "chat_state", "done"] and kinds.count("delta") > 1
+    deltas = [data for kind, data in events if kind == "delta"]
+    assert not any(data.get("reset") for data in deltas)
+    done = events[-1][1]
+    streamed = "".join(data["text"] for data in deltas)
+    assert streamed == "Try the <strong>MacBook Air 13</strong> 🚀, it is <em>light</em>."
+    # The final reply is the same message, followed by the product cards
+    assert done["reply"].startswith(streamed)
+    assert len(gemini.urls) == 1
+
+
+def test_a_second_gemini_call_starts_a_fresh_preview(gemini):
+    def two_calls():
+        for _ in range(2):
+            on_text = visiontech._gemini_stream.open()
+            for i in range(0, len(REPLY), 5):
+                on_text(REPLY[i:i + 5])
+        return visiontech.jsonify({"reply": "ok", "chat_state": {}})
+
+    with visiontech.app.test_request_context('/chat/stream', method='POST', json={"message": "laptop"}):
+        original_chat = visiontech.chat
+        visiontech.chat = two_calls
+        try:
+            response = visiontech.chat_stream()
+            body = "".join(response.response)
+        finally:
+            visiontech.chat = original_chat
+
+    deltas = [data for kind, data in parse_events(body) if kind == "delta"]
+    resets = [i for i, data in enumerate(deltas) if data.get("reset")]
+    assert len(resets) == 1
+    first, second = deltas[:resets[0]], deltas[resets[0]:]
+    assert "".join(d["text"] for d in first) == "".join(d["text"] for d in second)
+
+
+def test_client_disconnect_stops_the_gemini_stream(gemini):
+    gemini.pause_after = 20
+    response = visiontech.app.test_client().post('/chat/stream', json={"message": "laptop", "new_chat": True},
+                                                 buffered=False)
+    assert next(iter(response.response)).startswith(b"event: delta")
+    response.close()
+    gemini.resume.set()
+
+    for _ in range(100):
+        if gemini.closed:
+            break
+        threading.Event().wait(0.05)
+    assert gemini.closed == 1
+    assert gemini.lines_read < len(REPLY) // 5
@@ -0,0 +1,103 @@
+import itertools
+import random
+
+import pytest
+
+import app as visiontech
+
+BRANDS = ["Dell", "HP", "Apple", "Dell Alienware"]
+FEATURES = ["16GB RAM", "8GB RAM", "512GB SSD", '15.6" display', "120Hz"]
+UNFILTERED = {"category": "all", "brand": "", "search": "", "min_price": None, "max_price": None, "spec_filters": {}}
+
+
+def random_product(rng, n):
+    price = rng.choice([None, 99, 250, 499, 500, 1000, 1499, 2000, 4999])
+    return {"name": f"Model {n}", "brand": rng.choice(BRANDS), "price": "" if price is None else f"${price}",
+            "features": rng.sample(FEATURES, rng.randint(0, 3)), "image": ""}
+
+
+def random_catalog(seed, size=60):
+    rng = random.Random(seed)
+    catalog = {}
+    for n in range(size):
+        catalog.setdefault(rng.choice(["laptop", "phone", "tv"]), []).append(random_product(rng, n))
+    return catalog
+
+
+def relaxed_facets(snapshot, filters):
+    """The slow definition: each facet counts the products matching every filter but its own."""
+    def matching(**relaxed):
+        return visiontech.select_catalog_products(snapshot, {**filters, **relaxed})[0]
+
+    facets = visiontech.FacetCounts(matching()).summary()
+    facets["categories"] = visiontech.FacetCounts(matching(category="all")).summary()["categories"]
+    facets["brands"] = visiontech.FacetCounts(matching(brand="")).summary()["brands"]
+    by_price = visiontech.FacetCounts(matching(min_price=None, max_price=None)).summary()
+    facets["price_buckets"], facets["price_range"] = by_price["price_buckets"], by_price["price_range"]
+    return facets
+
+
+FILTERS = [
+    {"category": "laptop"},
+    {"category": "missing"},
+    {"brand": "dell"},
+    {"min_price": 250, "max_price": 1000},
+    {"category": "phone", "brand": "dell", "max_price": 999},
+    {"category": "laptop", "brand": "alienware", "min_price": 500, "spec_filters": {"ram_gb": (16, None)}},
+    {"search": "model", "brand": "hp"},
+    {"search": "model 1", "category": "tv", "min_price": 100},
+]
+
+
+@pytest.mark.parametrize("columnar", ["off", pytest.param("on", marks=pytest.mark.skipif(
+    visiontech.np is None, reason="the columnar path needs NumPy"))])
+def test_one_pass_matches_counting_each_relaxed_filter(monkeypatch, columnar):
+    monkeypatch.setattr(visiontech, "CATALOG_COLUMNAR", columnar)
+    snapshot = visiontech.CatalogSnapshot(1, random_catalog(3), 3600)
+
+    for filters in FILTERS:
+        filters = {**UNFILTERED, **filters}
+        expected = relaxed_facets(snapshot, filters)
+        assert expected["total"] == len(visiontech.select_catalog_products(snapshot, filters)[0])
+        assert visiontech.count_filtered_facets(snapshot, filters).summary() == expected, filters
+
+
+def test_facets_endpoint(monkeypatch):
+    catalog = random_catalog(4)
+    monkeypatch.setattr(visiontech, "CATALOG_CACHE_TTL", 3600)
+    monkeypatch.setattr(visiontech, "_catalog_snapshot", visiontech.CatalogSnapshot(1, catalog, 3600))
+    client = visiontech.app.test_client()
+
+    everything = client.get('/api/facets').get_json()
+    assert everything["total"] == sum(map(len, catalog.values()))
+    assert everything == relaxed_facets(visiontech._catalog_snapshot, UNFILTERED)
+
+    laptops = client.get('/api/facets?category=laptop&brand=dell&max_price=1000').get_json()
+    assert laptops["categories"] == relaxed_facets(visiontech._catalog_snapshot, {
+        **UNFILTERED, "category": "laptop", "brand": "dell", "max_price": 1000.0})["categories"]
+    assert laptops["total"] < everything["total"]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_counts_are_patched_across_catalog_versions(seed):
+    rng = random.Random(seed)
+    snapshot = visiontech.CatalogSnapshot(1, random_catalog(seed), 3600)
+    snapshot.derived("facets", visiontech.build_catalog_facets)
+    names = itertools.count(1000)
+
+    for _ in range(5):
+        ids = list(snapshot.products_by_id)
+        changed = rng.sample(ids, rng.randint(0, 4))
+        upserts = [(product_id, snapshot.products_by_id[product_id]["category"], random_product(rng, next(names)))
+                   for product_id in changed]
+        upserts += [(f"new-{n}", rng.choice(["laptop", "camera"]), random_product(rng, n))
+                    for n in itertools.islice(names, rng.randint(0, 3))]
+        deleted = set(rng.sample([i for i in ids if i not in changed], rng.randint(0, 4)))
+
+        updated = snapshot.with_changes(upserts, deleted, 3600)
+        updated.warm_from(snapshot)
+        patched = updated.derived("facets", None)
+
+        assert patched is not snapshot.derived("facets", None)
+        assert patched.summary() == visiontech.build_catalog_facets(updated).summary()
+        snapshot = updated
@@ -0,0 +1,93 @@
+import sqlite3
+import types
+
+import pytest
+
+import app as visiontech
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Stands in for time.time() inside the app; advance it by assigning clock.now."""
+    fake = types.SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(visiontech, "time", types.SimpleNamespace(time=lambda: fake.now))
+    return fake
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = visiontech.GeminiResponseCache(ttl=60, size=10)
+    cache.put("k", "reply")
+
+    clock.now += 59
+    assert cache.get("k") == "reply"
+    clock.now += 1
+    assert cache.get("k") is None
+    assert "k" not in cache.entries
+    assert cache.summary()["hits"] == 1 and cache.summary()["misses"] == 1
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = visiontech.GeminiResponseCache(ttl=60, size=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+
+    cache.put("c", "C")
+
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.get("b") is None
+    assert cache.summary()["evictions"] == 1
+
+
+def test_sqlite_entries_survive_a_restart(clock, tmp_path):
+    path = str(tmp_path / "gemini_cache.sqlite")
+    visiontech.GeminiResponseCache(ttl=60, size=10, path=path).put("k", "reply")
+
+    restarted = visiontech.GeminiResponseCache(ttl=60, size=10, path=path)
+    assert restarted.summary()["persistent"]
+    assert restarted.get("k") == "reply"
+    assert restarted.summary()["disk_hits"] == 1
+    assert restarted.get("k") == "reply"  # Now from memory
+    assert restarted.summary()["hits"] == 1
+
+    clock.now += 60
+    assert visiontech.GeminiResponseCache(ttl=60, size=10, path=path).get("k") is None
+
+
+def test_evicted_entries_are_still_served_from_sqlite(clock, tmp_path):
+    cache = visiontech.GeminiResponseCache(ttl=60, size=1, path=str(tmp_path / "cache.sqlite"))
+    cache.put("a", "A")
+    cache.put("b", "B")
+
+    assert "a" not in cache.entries
+    assert cache.get("a") == "A"
+    assert cache.summary()["disk_hits"] == 1
+
+
+def test_expired_rows_are_swept(clock, tmp_path, monkeypatch):
+    monkeypatch.setattr(visiontech, "GEMINI_CACHE_SWEEP_EVERY", 2)
+    path = str(tmp_path / "cache.sqlite")
+    cache = visiontech.GeminiResponseCache(ttl=60, size=10, path=path)
+    cache.put("old", "O")
+    clock.now += 61
+    cache.put("new", "N")  # Second store: sweeps
+
+    with sqlite3.connect(path) as db:
+        assert [row[0] for row in db.execute("SELECT key FROM gemini_cache")] == ["new"]
+
+
+def test_zero_ttl_disables_the_cache(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    cache = visiontech.GeminiResponseCache(ttl=0, size=10, path=str(path))
+    cache.put("k", "reply")
+
+    assert cache.get("k") is None
+    assert not path.exists()
+
+
+def test_unusable_sqlite_path_falls_back_to_memory(clock, tmp_path):
+    cache = visiontech.GeminiResponseCache(ttl=60, size=10, path=str(tmp_path / "missing" / "cache.sqlite"))
+    cache.put("k", "reply")
+
+    assert not cache.summary()["persistent"]
+    assert cache.get("k") == "reply"
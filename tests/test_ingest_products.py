@@ -0,0 +1,121 @@
+import json
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+import app as visiontech
+import ingest_products
+import migrate_products
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient()["ecommerce_db"]
+
+
+def write_inputs(tmp_path):
+    (tmp_path / "phones.json").write_text(json.dumps([
+        {"category": "phone", "products": [
+            {"name": "iPhone 16 Pro", "brand": "Apple", "price": 999, "specifications": ["6.3-inch display", "48MP camera"],
+             "image": "iphone_16_pro.jpg"},
+            {"name": "Galaxy S24", "brand": "Samsung", "price": "$799", "specifications": ["6.2-inch display"]},
+        ]},
+    ]), encoding="utf-8")
+    (tmp_path / "laptops.csv").write_text(
+        "name,category,brand,price,specifications,image\n"
+        "MacBook Air 13,laptop,Apple,1099,16GB RAM|512GB SSD,macbook_air.jpg\n"
+        "Broken Laptop,laptop,Acme,cheap,,\n",
+        encoding="utf-8")
+    (tmp_path / "tvs.jsonl").write_text(
+        json.dumps({"name": "Bravia 65", "type": "tv", "brand": "Sony", "price": 1499}) + "\n",
+        encoding="utf-8")
+    return [str(tmp_path / name) for name in ("phones.json", "laptops.csv", "tvs.jsonl")]
+
+
+def run_ingest(db, paths, **options):
+    return ingest_products.ingest(db, (ingest_products.read_records(path) for path in paths), batch_size=2, **options)
+
+
+def test_ingest_round_trips_through_the_catalog_loader(db, tmp_path):
+    stats = run_ingest(db, write_inputs(tmp_path))
+
+    assert (stats["read"], stats["invalid"], stats["upserted"]) == (5, 1, 4)
+    catalog = visiontech.load_products_from_items(db[visiontech.PRODUCT_ITEMS_COLLECTION])
+    assert {category: [p["name"] for p in products] for category, products in catalog.items()} == {
+        "phone": ["iPhone 16 Pro", "Galaxy S24"],
+        "laptop": ["MacBook Air 13"],
+        "tv": ["Bravia 65"],
+    }
+    assert catalog["phone"][0] == {"name": "iPhone 16 Pro", "price": "$999", "brand": "Apple",
+                                   "features": ["6.3-inch display", "48MP camera"], "image": "/images/iphone_16_pro.jpg",
+                                   "id": "iphone-16-pro-phone"}
+    assert catalog["laptop"][0]["features"] == ["16GB RAM", "512GB SSD"]
+    assert visiontech.detect_product_items_schema(db)
+
+
+def test_reingest_is_idempotent(db, tmp_path):
+    paths = write_inputs(tmp_path)
+    run_ingest(db, paths)
+    items = db[visiontech.PRODUCT_ITEMS_COLLECTION]
+    before = {item["_id"]: item for item in items.find()}
+
+    stats = run_ingest(db, paths, workers=2)
+
+    assert (stats["upserted"], stats["modified"], stats["unchanged"]) == (0, 0, 4)
+    assert {item["_id"]: item for item in items.find()} == before
+
+
+def test_changed_product_is_updated_in_place(db, tmp_path):
+    paths = write_inputs(tmp_path)
+    run_ingest(db, paths)
+    items = db[visiontech.PRODUCT_ITEMS_COLLECTION]
+    sort_order = items.find_one({"_id": "galaxy-s24-phone"})["sort_order"]
+
+    stats = ingest_products.ingest(db, [[("update", {"category": "phone", "name": "Galaxy S24", "brand": "Samsung",
+                                                      "price": 699})]])
+
+    assert (stats["upserted"], stats["modified"]) == (0, 1)
+    item = items.find_one({"_id": "galaxy-s24-phone"})
+    assert (item["price"], item["price_value"], item["sort_order"]) == (699, 699.0, sort_order)
+    assert items.count_documents({}) == 4
+
+
+def test_refuses_to_write_into_an_unmigrated_database(db, tmp_path):
+    db["products"].insert_one({"category": "phone", "products": [{"name": "Pixel 9", "brand": "Google", "price": 799}]})
+
+    with pytest.raises(SystemExit):
+        run_ingest(db, write_inputs(tmp_path))
+
+    assert db[visiontech.PRODUCT_ITEMS_COLLECTION].count_documents({}) == 0
+    assert not visiontech.detect_product_items_schema(db)
+
+
+def test_force_writes_without_switching_the_schema(db, tmp_path):
+    db["products"].insert_one({"category": "phone", "products": [{"name": "Pixel 9", "brand": "Google", "price": 799}]})
+
+    run_ingest(db, write_inputs(tmp_path), force=True)
+
+    assert db[visiontech.PRODUCT_ITEMS_COLLECTION].count_documents({}) == 4
+    assert not visiontech.detect_product_items_schema(db)
+
+
+def test_ingest_after_migration(db, tmp_path):
+    db["products"].insert_one({"category": "phone", "products": [
+        {"name": "Pixel 9", "brand": "Google", "price": 799},
+        {"name": "Pixel 9", "brand": "Google", "price": 899},
+    ]})
+    migrate_products.migrate(db)
+
+    run_ingest(db, write_inputs(tmp_path))
+
+    catalog = visiontech.load_products_from_items(db[visiontech.PRODUCT_ITEMS_COLLECTION])
+    assert [p["name"] for p in catalog["phone"]] == ["Pixel 9", "Pixel 9", "iPhone 16 Pro", "Galaxy S24"]
+    assert visiontech.detect_product_items_schema(db)
+
+
+def test_dry_run_writes_nothing(db, tmp_path):
+    stats = run_ingest(db, write_inputs(tmp_path), dry_run=True)
+
+    assert stats["read"] == 5
+    assert db.list_collection_names() == []
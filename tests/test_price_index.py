@@ -0,0 +1,116 @@
+import itertools
+import json
+import random
+
+import pytest
+
+import app as visiontech
+
+PRICES = [None, 99, 250, 250, 999, 1500, 1500]  # Repeats on purpose: equal prices tie on catalog position
+BRANDS = ["Dell", "HP", "Apple", "Dell Alienware"]
+_ids = itertools.count()
+
+
+def record(product_id=None, category="laptop", rng=random):
+    product_id = product_id or f"p{next(_ids)}"
+    price = rng.choice(PRICES)
+    return visiontech.ProductRecord({"id": product_id, "category": category, "name": f"Laptop {product_id}",
+                                     "brand": rng.choice(BRANDS), "price": "" if price is None else f"${price}"})
+
+
+def windows(category, products):
+    """Every interesting window: unbounded, each price as a bound (equal prices included), by brand."""
+    prices = sorted({p.price_value for p in products if p.price_value is not None}) or [0]
+    bounds = [None, prices[0] - 1, *prices, prices[-1] + 1]
+    for low, high in itertools.product(bounds, repeat=2):
+        for brand in (None, "dell", "alienware", "acer"):
+            for strict_high in (False, True):
+                yield (category, low, high, brand, strict_high)
+
+
+def ids(products):
+    return [product["id"] for product in products]
+
+
+def test_window_bounds_and_ties():
+    products = [visiontech.ProductRecord({"id": f"p{n}", "brand": "Dell", "price": f"${price}"})
+                for n, price in enumerate([500, 100, 500, 900, 100])]
+    index = visiontech.PriceIndex({"laptop": products})
+
+    assert ids(index.window("laptop", 100, 500)) == ["p0", "p1", "p2", "p4"]  # Catalog order, bounds included
+    assert ids(index.window("laptop", 100, 500, strict_high=True)) == ["p1", "p4"]
+    assert ids(index.window("laptop", 500, 500)) == ["p0", "p2"]
+    assert ids(index.window("laptop", 901)) == []
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_updated_matches_a_rebuild_after_random_deltas(seed):
+    rng = random.Random(seed)
+    catalog = [record(rng=rng) for _ in range(rng.randint(0, 30))]
+    index = visiontech.PriceIndex({"laptop": catalog})
+
+    for _ in range(10):
+        removed = rng.sample(catalog, rng.randint(0, min(5, len(catalog))))
+        replaced = removed[:rng.randint(0, len(removed))]  # Same ID, new price and brand
+        added = [record(product["id"], rng=rng) for product in replaced] + [record(rng=rng) for _ in range(rng.randint(0, 4))]
+
+        replacements = {product["id"]: product for product in added}
+        catalog = [replacements.pop(product["id"]) if product in replaced else product
+                   for product in catalog if product not in removed or product in replaced]
+        catalog += replacements.values()
+        index = index.updated(removed, added)
+        rebuilt = visiontech.PriceIndex({"laptop": catalog})
+
+        for window in windows("laptop", catalog):
+            assert ids(index.window(*window)) == ids(rebuilt.window(*window)), window
+
+
+def test_updated_keeps_the_all_category_in_step():
+    rng = random.Random(7)
+    laptops = [record(category="laptop", rng=rng) for _ in range(10)]
+    phones = [record(category="phone", rng=rng) for _ in range(10)]
+    index = visiontech.PriceIndex({"laptop": laptops, "phone": phones, "all": laptops + phones})
+
+    removed = [laptops[0], phones[3], phones[4]]
+    added = [record(phones[3]["id"], category="phone", rng=rng), record(category="laptop", rng=rng)]
+    index = index.updated(removed, added)
+
+    catalog = [p for p in laptops + phones if p not in removed] + added
+    rebuilt = visiontech.PriceIndex({"all": catalog})
+    for window in windows("all", catalog):
+        # New products go to the end of "all" rather than of their category: same set, maybe another order
+        assert set(ids(index.window(*window))) == set(ids(rebuilt.window(*window))), window
+
+
+class FakeGeminiResponse:
+    status_code = 200
+
+    def __init__(self, reply):
+        self.reply = reply
+
+    def json(self):
+        return {"candidates": [{"content": {"parts": [{"text": json.dumps(self.reply)}]}}]}
+
+
+def test_cheaper_alternatives_are_priced_from_the_catalog(monkeypatch):
+    catalog = {"laptop": [{"name": name, "brand": "Dell", "price": price, "features": [], "image": ""}
+                          for name, price in [("XPS 16", "$2000"), ("XPS 13", "$999"), ("Inspiron 15", "$1700"),
+                                              ("Latitude 7", "$1699")]]}
+    monkeypatch.setattr(visiontech, "CATALOG_CACHE_TTL", 3600)
+    monkeypatch.setattr(visiontech, "_catalog_snapshot", visiontech.CatalogSnapshot(1, catalog, 3600))
+    monkeypatch.setattr(visiontech, "gemini_response_cache", visiontech.GeminiResponseCache(0, 0))
+    # Gemini quotes made-up prices; only the catalog's count for products it lists
+    reply = {"message": "Here you go", "alternative_products": [
+        {"name": "XPS 13", "price": "$3000"}, {"name": "Inspiron 15", "price": "$10"},
+        {"name": "Latitude 7", "price": "$10"}, {"name": "Vostro 3000", "price": "$500"},
+    ]}
+    monkeypatch.setattr(visiontech, "get_gemini_session",
+                        lambda: type("Session", (), {"post": lambda self, *a, **kw: FakeGeminiResponse(reply)})())
+
+    result = visiontech.send_followup_to_gemini({
+        "category": "laptop", "user_message": "these are too expensive", "conversation_history": [],
+        "recommended_products": [dict(catalog["laptop"][0])], "rejected_products": [],
+    })
+
+    # 15% under $2000 is $1700, exclusive; the Vostro isn't in the catalog at all
+    assert [p["name"] for p in result["alternative_products"]] == ["XPS 13", "Latitude 7"]
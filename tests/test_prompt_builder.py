@@ -0,0 +1,85 @@
+import app as visiontech
+
+SYSTEM = "You are a digital shopping assistant helping customers find the best products from our inventory."
+QUESTION = "### USER QUESTION:\nWhich of these laptops is best for gaming under $1500?"
+
+
+def products(count):
+    return [{"name": f"Laptop {n}", "brand": "Acme", "price": f"${500 + n}",
+             "features": ["16GB RAM", "512GB SSD", "RTX 4060", "15.6-inch display"]} for n in range(count)]
+
+
+def history(count):
+    return [{"role": "user" if n % 2 == 0 else "assistant", "message": f"Turn {n}: " + "tell me more " * 10}
+            for n in range(count)]
+
+
+def build_prompt(catalog, turns, budget):
+    prompt = visiontech.PromptBuilder("test", token_budget=budget)
+    prompt.add("instructions", SYSTEM)
+    prompt.add_items("history", turns, lambda items: "### HISTORY:\n" + visiontech.compact_json(items),
+                     priority=0, keep=2, trim_from_start=True)
+    prompt.add_items("products", catalog, lambda items: "### PRODUCTS:\n" + visiontech.compact_json(items),
+                     priority=1, keep=3)
+    prompt.add("question", QUESTION)
+    return prompt
+
+
+def section(prompt, name):
+    return next(s for s in prompt.sections if s["name"] == name)
+
+
+def test_prompt_under_budget_is_sent_whole():
+    prompt = build_prompt(products(5), history(4), budget=5000)
+    text = prompt.build()
+
+    assert section(prompt, "products")["items"] == products(5)
+    assert section(prompt, "history")["items"] == history(4)
+    assert text == "\n\n".join(s["text"] for s in prompt.sections)
+
+
+def test_over_budget_catalog_is_trimmed_to_fit():
+    prompt = build_prompt(products(200), history(4), budget=1500)
+    assert prompt.total_tokens() > 1500
+
+    text = prompt.build()
+
+    assert prompt.total_tokens() <= 1500
+    assert visiontech.estimate_tokens(text) <= 1500 + len(prompt.sections)
+    kept = section(prompt, "products")["items"]
+    # The highest-ranked candidates (listed first) stay
+    assert 3 <= len(kept) < 200 and kept == products(200)[:len(kept)]
+
+
+def test_old_turns_go_before_products():
+    prompt = build_prompt(products(20), history(30), budget=1200)
+    prompt.build()
+
+    turns = section(prompt, "history")["items"]
+    assert 2 < len(turns) < 30
+    assert turns == history(30)[-len(turns):]  # Oldest first
+    assert len(section(prompt, "products")["items"]) == 20
+
+    # Products are only trimmed once the history is down to its keep
+    prompt = build_prompt(products(20), history(30), budget=500)
+    prompt.build()
+    assert section(prompt, "history")["items"] == history(30)[-2:]
+    assert 3 < len(section(prompt, "products")["items"]) < 20
+
+
+def test_required_sections_are_never_dropped(capsys):
+    prompt = build_prompt(products(100), history(10), budget=50)
+    text = prompt.build()
+
+    assert text.startswith(SYSTEM) and text.endswith(QUESTION)
+    assert len(section(prompt, "history")["items"]) == 2
+    assert len(section(prompt, "products")["items"]) == 3
+    assert "still over its 50-token budget" in capsys.readouterr().out
+
+
+def test_zero_budget_means_no_limit():
+    prompt = build_prompt(products(200), history(30), budget=0)
+    prompt.build()
+
+    assert len(section(prompt, "products")["items"]) == 200
+    assert len(section(prompt, "history")["items"]) == 30
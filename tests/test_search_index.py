@@ -0,0 +1,70 @@
+import pytest
+
+import app as visiontech
+
+PRODUCTS = [
+    {"id": "iphone", "name": "iPhone 16 Pro Max", "brand": "Apple", "features": ["A18 Pro chip", "6.9-inch display"]},
+    {"id": "macbook", "name": "MacBook Pro 16", "brand": "Apple", "features": ["M4 Max chip", "48GB RAM"]},
+    {"id": "legion", "name": "Legion Gaming Laptop", "brand": "Lenovo", "features": ["RTX 4070", "240Hz display"]},
+    {"id": "xps", "name": "XPS 15", "brand": "Dell", "features": ["Great for gaming", "OLED display"]},
+    {"id": "projector", "name": "Projector Lamp", "brand": "Epson", "features": []},
+    {"id": "lamp", "name": "Pro Lamp", "brand": "Epson", "features": []},
+]
+
+
+@pytest.fixture
+def index():
+    return visiontech.SearchIndex(PRODUCTS)
+
+
+def test_name_matches_rank_above_feature_matches(index):
+    assert index.search("gaming") == ["legion", "xps"]
+    assert index.search("apple")[0] in ("iphone", "macbook")
+    assert set(index.search("display")) == {"iphone", "legion", "xps"}
+
+
+def test_every_word_must_match(index):
+    assert index.search("gaming laptop") == ["legion"]
+    assert index.search("apple oled") == []
+    assert index.search("nintendo") == []
+
+
+def test_shorter_documents_rank_higher_for_the_same_match():
+    index = visiontech.SearchIndex([
+        {"id": "long", "name": "Bravia 65", "brand": "Sony", "features": ["OLED panel", "Dolby Vision", "120Hz", "HDMI 2.1"]},
+        {"id": "short", "name": "C4 65", "brand": "LG", "features": ["OLED panel"]},
+        {"id": "none", "name": "QN90", "brand": "Samsung", "features": ["Neo QLED"]},
+    ])
+
+    assert index.search("oled") == ["short", "long"]
+    assert index.search("65") == ["short", "long"]
+
+
+def test_quoted_phrase_matches_words_in_order_within_one_field(index):
+    assert index.search('"pro max"') == ["iphone"]
+    # Both words occur in the MacBook, but in different fields ("Pro" in the name, "Max" in a feature)
+    assert "macbook" in index.search("pro max")
+    assert index.search('"max pro"') == []
+    assert index.search('apple "m4 max"') == ["macbook"]
+
+
+def test_single_word_quotes_are_plain_words(index):
+    assert visiontech.parse_search_query('oled "pro max" "gaming"') == ([["pro", "max"]], ["oled", "gaming"])
+    assert index.search('"gaming"') == index.search("gaming")
+
+
+def test_prefixes_match_but_rank_below_exact_terms(index):
+    assert index.search("gam") == ["legion", "xps"]
+    assert index.search("proj") == ["projector"]
+    ranked = index.search("pro")
+    assert set(ranked) == {"iphone", "macbook", "projector", "lamp"}
+    assert ranked.index("lamp") < ranked.index("projector")
+
+
+@pytest.mark.parametrize("query", ["", "   ", '""', '" "', "!!!"])
+def test_empty_queries_match_nothing(index, query):
+    assert index.search(query) == []
+
+
+def test_empty_catalog():
+    assert visiontech.SearchIndex([]).search("pro") == []
@@ -0,0 +1,76 @@
+import pytest
+
+import app as visiontech
+
+pytestmark = pytest.mark.skipif(visiontech.np is None, reason="the semantic cache needs NumPy")
+
+CACHED = "cheap gaming laptop"
+PARAPHRASE = "budget laptop for games"
+UNRELATED = "noise cancelling headphones for flights"
+
+
+def similarity(a, b):
+    return float(visiontech.np.dot(visiontech.embed_semantic_text(a), visiontech.embed_semantic_text(b)))
+
+
+def semantic_cache(threshold):
+    cache = visiontech.SemanticResponseCache(True, threshold, size=10, ttl=60)
+    cache.put("bucket", "key", CACHED, "reply")
+    return cache
+
+
+def test_paraphrases_are_similar():
+    assert similarity(CACHED, PARAPHRASE) > 0.99
+    assert similarity(CACHED, UNRELATED) < 0.5
+
+
+def test_similarity_just_above_the_threshold_hits():
+    score = similarity(CACHED, "cheap gaming laptop with rgb")
+    assert 0 < score < 1
+
+    assert semantic_cache(score - 1e-4).get("bucket", "cheap gaming laptop with rgb") == "reply"
+    assert semantic_cache(score).get("bucket", "cheap gaming laptop with rgb") == "reply"
+
+
+def test_similarity_just_below_the_threshold_misses():
+    score = similarity(CACHED, "cheap gaming laptop with rgb")
+    cache = semantic_cache(score + 1e-4)
+
+    assert cache.get("bucket", "cheap gaming laptop with rgb") is None
+    assert cache.summary()["misses"] == 1
+    assert [entry["accepted"] for entry in cache.audit] == [False]
+
+
+def test_buckets_are_isolated():
+    cache = semantic_cache(0.5)
+
+    assert cache.get("other bucket", CACHED) is None
+    assert cache.get("bucket", CACHED) == "reply"
+
+
+def query(message, **slots):
+    return {"user_message": message, "category": "laptop", "conversation_history": [], **slots}
+
+
+def test_slot_state_separates_categories_and_budgets(monkeypatch):
+    monkeypatch.setattr(visiontech, "_catalog_snapshot", None)
+    cache = visiontech.SemanticResponseCache(True, 0.5, size=10, ttl=60)
+    bucket, conversation = visiontech.semantic_cache_context(query("cheap gaming laptop under 1000"))
+    cache.put(bucket, "key", conversation, "reply")
+
+    assert cache.get(*visiontech.semantic_cache_context(query("budget laptop for games under 1000"))) == "reply"
+    assert cache.get(*visiontech.semantic_cache_context(query("cheap gaming laptop under 1000", category="phone"))) is None
+    assert cache.get(*visiontech.semantic_cache_context(query("cheap gaming laptop under 1500"))) is None
+    assert cache.get(*visiontech.semantic_cache_context(query("cheap gaming laptop under 1000", has_budget=True))) is None
+
+
+def test_audit_log_does_not_keep_the_wording(capsys):
+    cache = semantic_cache(0.5)
+    cache.get("bucket", PARAPHRASE)
+
+    entry = cache.audit[-1]
+    assert entry["accepted"]
+    assert entry["query_hash"] == visiontech.semantic_conversation_hash(PARAPHRASE)
+    assert entry["cached_query_hash"] == visiontech.semantic_conversation_hash(CACHED)
+    logged = repr(list(cache.audit)) + repr(list(cache.entries.values())) + capsys.readouterr().out
+    assert "laptop" not in logged and "games" not in logged
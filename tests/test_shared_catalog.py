@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+import app as visiontech
+
+CATALOG = {
+    "phone": [{"name": "iPhone 16 Pro", "brand": "Apple", "price": "$999", "features": ["6.3-inch display"], "image": ""}],
+    "tv": [{"name": "Bravia 65", "brand": "Sony", "price": "$1,499", "features": [], "image": ""}],
+}
+
+
+@pytest.fixture
+def shared_path(tmp_path, monkeypatch):
+    loads = []
+
+    def load_products_from_database():
+        loads.append(1)
+        return CATALOG
+
+    path = str(tmp_path / "catalog.json")
+    monkeypatch.setattr(visiontech, "CATALOG_SHARED_PATH", path)
+    monkeypatch.setattr(visiontech, "CATALOG_CACHE_TTL", 60)
+    monkeypatch.setattr(visiontech, "_catalog_snapshot", None)
+    monkeypatch.setattr(visiontech, "_catalog_invalidated_at", 0.0)
+    monkeypatch.setattr(visiontech, "load_products_from_database", load_products_from_database)
+    return path, loads
+
+
+def test_one_load_from_the_data_source_serves_every_worker(shared_path):
+    path, loads = shared_path
+    published = visiontech.load_shared_catalog_snapshot(None)
+    # Another worker starting up: no snapshot of its own yet
+    read = visiontech.load_shared_catalog_snapshot(None)
+
+    assert len(loads) == 1
+    assert (read.version, read.digest) == (published.version, published.digest)
+    assert dict(read.find_product("bravia-65-tv")) == dict(published.find_product("bravia-65-tv"))
+
+
+def test_invalidation_keeps_the_file_and_republishes_unchanged_content_in_place(shared_path):
+    path, loads = shared_path
+    visiontech._catalog_snapshot = visiontech.load_shared_catalog_snapshot(None)
+    with open(path, 'rb') as f:
+        published = f.read()
+    os.utime(path, (0, 0))
+
+    visiontech.invalidate_catalog_cache()
+    assert os.path.exists(path)
+
+    snapshot = visiontech.get_catalog_snapshot()
+    assert len(loads) == 2
+    assert snapshot.version == 1
+    assert os.path.getmtime(path) > 0
+    with open(path, 'rb') as f:
+        assert f.read() == published
+    assert not [name for name in os.listdir(os.path.dirname(path)) if name.endswith(".tmp")]
@@ -0,0 +1,107 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import app as visiontech
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Importing the app must never wait on the network; generous enough for a slow CI machine
+IMPORT_BUDGET_SECONDS = float(os.getenv('IMPORT_BUDGET_SECONDS', '3'))
+
+
+def test_import_stays_within_budget_with_unreachable_mongodb():
+    env = dict(os.environ,
+               MONGODB_URI="mongodb://192.0.2.1:27017/",  # TEST-NET-1: never answers
+               MONGODB_TIMEOUT_MS="10000",
+               CATALOG_WATCH="off",
+               GEMINI_API_KEY="test-key")
+    script = "import time; started = time.perf_counter(); import app; print(time.perf_counter() - started)"
+
+    result = subprocess.run([sys.executable, "-c", script], cwd=REPO_ROOT, env=env,
+                            capture_output=True, text=True, timeout=60)
+
+    assert result.returncode == 0, result.stderr
+    elapsed = float(result.stdout.strip().splitlines()[-1])
+    assert elapsed < IMPORT_BUDGET_SECONDS
+    assert "Connecting to MongoDB" not in result.stdout
+
+
+class FakeMongoClient:
+    """Counts instances; ping takes a while and can be told to fail."""
+    created = []
+    ping_delay = 0.1
+    failures = 0
+
+    def __init__(self, uri, serverSelectionTimeoutMS=None):
+        FakeMongoClient.created.append(self)
+        self.admin = self
+
+    def command(self, name):
+        time.sleep(FakeMongoClient.ping_delay)
+        if FakeMongoClient.failures:
+            FakeMongoClient.failures -= 1
+            raise ConnectionError("server selection timed out")
+        return {"ok": 1}
+
+    def __getitem__(self, name):
+        return {"products": object(), visiontech.PRODUCT_ITEMS_COLLECTION: object()}
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fresh_connection_state(monkeypatch):
+    FakeMongoClient.created = []
+    FakeMongoClient.ping_delay = 0.1
+    FakeMongoClient.failures = 0
+    monkeypatch.setattr(visiontech, "MongoClient", FakeMongoClient)
+    monkeypatch.setattr(visiontech, "MONGODB_URI", "mongodb://fake")
+    for name, value in (("client", None), ("db", None), ("collection", None), ("MONGODB_CONNECTED", False),
+                        ("_mongodb_attempted", False), ("_mongodb_pending_client", None),
+                        ("_mongodb_reconnect_thread", None),
+                        ("_catalog_index_thread", None)):
+        monkeypatch.setattr(visiontech, name, value)
+    monkeypatch.setattr(visiontech, "invalidate_catalog_cache", lambda: None)
+    index_calls = []
+    monkeypatch.setattr(visiontech, "prepare_catalog_indexes", index_calls.append)
+    return index_calls
+
+
+def test_concurrent_connection_attempts_create_one_client(fresh_connection_state):
+    threads = [threading.Thread(target=visiontech.ensure_mongodb)]
+    threads += [threading.Thread(target=visiontech.connect_to_mongodb) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert visiontech.MONGODB_CONNECTED
+    assert len(FakeMongoClient.created) == 1
+
+
+def test_first_use_waits_for_the_ping_but_not_for_index_preparation(fresh_connection_state, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(visiontech, "prepare_catalog_indexes", lambda database: release.wait(5))
+
+    started = time.perf_counter()
+    assert visiontech.ensure_mongodb()
+    elapsed = time.perf_counter() - started
+    release.set()
+
+    assert elapsed < 1
+
+
+def test_reconnect_loop_flips_connected_back_on(fresh_connection_state):
+    FakeMongoClient.failures = 1
+
+    assert not visiontech.ensure_mongodb()
+    visiontech._mongodb_reconnect_thread.join(timeout=5)
+
+    assert visiontech.MONGODB_CONNECTED
+    assert len(FakeMongoClient.created) == 1
+    assert len(fresh_connection_state) == 1